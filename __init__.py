@@ -18,7 +18,7 @@ from .nodes import materials, volumes, textures
 from .ui import (
     aovs, blender_object, camera, config, denoiser, display, errorlog,
     halt, image_tools, light, lightgroups, material, particle,
-    postpro, render, render_layer, texture, units, world
+    postpro, profiler, render, render_layer, texture, texture_memory, units, world
 )
 
 bl_info = {
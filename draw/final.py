@@ -1,8 +1,11 @@
 from bgl import *  # Nah I'm not typing them all out
 import array
+import bpy
+import numpy
 from time import time, sleep
 from ..bin import pyluxcore
 from .. import utils
+from ..handlers.draw_imageeditor import TileStats
 from ..export.aovs import get_denoiser_imgpipeline_props
 
 
@@ -34,9 +37,22 @@ DEFAULT_AOV_SETTINGS = AOV(3, pyluxcore.ConvertFilmChannelOutput_3xFloat_To_3xFl
 
 AOVS_WITH_ID = {"RADIANCE_GROUP", "BY_MATERIAL_ID", "BY_OBJECT_ID", "MATERIAL_ID_MASK", "OBJECT_ID_MASK"}
 
+# The imagepipeline of the Combined pass
+COMBINED_PIPELINE_INDEX = 0
+# Index of the Combined pass in the render layer
+COMBINED_PASS_INDEX = 0
+# If more of the film changed, a full refresh is faster than importing the tiles one by one
+MAX_TILE_REFRESH_AREA = 0.5
+
 
 class FrameBufferFinal(object):
-    """ FrameBuffer for final render """
+    """
+    FrameBuffer for final render.
+    Every refresh has to write all passes, because Blender merges the whole result and
+    passes that are not written would become black. Interim refreshes only execute the
+    imagepipelines of the passes shown in an image editor, the other passes are
+    converted from the output of their last imagepipeline run.
+    """
     def __init__(self, scene):
         filmsize = utils.calc_filmsize(scene)
         self._width = filmsize[0]
@@ -56,38 +72,132 @@ class FrameBufferFinal(object):
         self.denoiser_last_elapsed_time = 0
         self.denoiser_last_samples = 0
 
+        # True while the imagepipeline of the Combined pass runs asynchronously
+        self._refresh_pending = False
+        self._last_viewed_passes = None
+        # Pass counts of the tiles in the last refresh (TILEPATH only) {(x, y): passcount}
+        self._tile_passcounts = {}
+        # Pass counts of the tiles when the running refresh was started
+        self._refresh_tile_passcounts = {}
+        self._tile_buffer = None
+        # Tile results can only be merged without blanking other passes if there are none
+        self._only_combined = False
+
     def draw(self, engine, session, scene, render_stopped):
+        """
+        Synchronous refresh. The imagepipelines of all AOVs are executed when the render
+        is stopped, before that only those of the passes shown in an image editor.
+        """
+        self.wait_for_refresh(session)
+        tile_passcounts = {} if engine.is_preview else self._get_tile_passcounts()
+        self._draw(engine, session, scene, render_stopped, tile_passcounts, execute_combined_pipeline=True)
+
+    def start_refresh(self, session):
+        """
+        Starts the imagepipeline of the Combined pass on a LuxCore thread, so the
+        render loop is not blocked. The last imported result stays visible until
+        finish_refresh() finds the new one.
+        """
+        if self._refresh_pending:
+            return
+
+        # The tile stats are updated while the imagepipeline runs, but the result only
+        # contains the samples up to this point
+        self._refresh_tile_passcounts = self._get_tile_passcounts()
+        session.GetFilm().AsyncExecuteImagePipeline(COMBINED_PIPELINE_INDEX)
+        self._refresh_pending = True
+
+    def finish_refresh(self, engine, session, scene):
+        """ Imports the film if the refresh started by start_refresh() is done. Returns True in this case """
+        if not self._refresh_pending or not session.GetFilm().HasDoneAsyncExecuteImagePipeline():
+            return False
+
+        self._refresh_pending = False
+        tile_passcounts = {} if engine.is_preview else self._refresh_tile_passcounts
+        self._draw(engine, session, scene, False, tile_passcounts, execute_combined_pipeline=False)
+        return True
+
+    def wait_for_refresh(self, session):
+        """ LuxCore can only run one asynchronous imagepipeline at a time """
+        if not self._refresh_pending:
+            return
+
+        while not session.GetFilm().HasDoneAsyncExecuteImagePipeline():
+            sleep(0.05)
+        self._refresh_pending = False
+
+    def is_viewed_pass_changed(self, scene):
+        """ True if the user switched to a pass that was not refreshed with the last interim update """
+        viewed_passes = self._get_viewed_pass_indices(scene)
+        if viewed_passes is None or self._last_viewed_passes is None:
+            return False
+        return not viewed_passes.issubset(self._last_viewed_passes)
+
+    def _draw(self, engine, session, scene, render_stopped, tile_passcounts, execute_combined_pipeline):
+        """
+        tile_passcounts: Pass counts of the tiles at the time the imagepipeline
+        of the Combined pass was (or is) executed
+        """
         active_layer_index = scene.luxcore.active_layer_index
         scene_layer = scene.render.layers[active_layer_index]
 
+        if not render_stopped and not engine.is_preview and self._can_draw_tiles(scene):
+            if self._draw_changed_tiles(engine, session, scene, scene_layer, tile_passcounts,
+                                        execute_combined_pipeline):
+                return
+
+        # Only the tiles that change after this refresh have to be imported in the next one
+        # (TileStats are only collected in final render)
+        self._tile_passcounts = tile_passcounts
+
         result = engine.begin_result(0, 0, self._width, self._height, scene_layer.name)
         # Regardless of the scene render layers, the result always only contains one layer
         render_layer = result.layers[0]
+        self._only_combined = len(render_layer.passes) == 1
 
         combined = render_layer.passes["Combined"]
-        self._convert_combined(session.GetFilm(), self._combined_output_type, 0,
-                               self._width, self._height, combined.as_pointer(), False, True)
+        self._convert_combined(session.GetFilm(), self._combined_output_type, COMBINED_PIPELINE_INDEX,
+                               self._width, self._height, combined.as_pointer(), False,
+                               execute_combined_pipeline)
 
         # Import AOVs only in final render, not in material preview mode
         if not engine.is_preview:
+            # Interim updates only run the imagepipelines of the passes the user is looking at
+            # (None = all passes). The other passes re-use the result of their last imagepipeline run,
+            # otherwise they would be black until the final refresh.
+            viewed_pass_indices = None if render_stopped else self._get_viewed_pass_indices(scene)
+            self._last_viewed_passes = viewed_pass_indices
+
+            if viewed_pass_indices is None:
+                viewed_passes = None
+            else:
+                passes = list(render_layer.passes)
+                viewed_passes = {passes[i].name for i in viewed_pass_indices if i < len(passes)}
+
             for output_name, output_type in pyluxcore.FilmOutputType.names.items():
                 # Check if this AOV is enabled on this render layer
-                if getattr(scene_layer.luxcore.aovs, output_name.lower(), False):
-                    try:
-                        self._import_aov(output_name, output_type, render_layer, session, engine)
-                    except RuntimeError as error:
-                        print("Error on import of AOV %s: %s" % (output_name, error))
+                if not getattr(scene_layer.luxcore.aovs, output_name.lower(), False):
+                    continue
+                execute_imagepipeline = viewed_passes is None or self._get_pass_name(output_name) in viewed_passes
+
+                try:
+                    self._import_aov(output_name, output_type, render_layer, session, engine,
+                                     execute_imagepipeline)
+                except RuntimeError as error:
+                    print("Error on import of AOV %s: %s" % (output_name, error))
 
             lightgroup_pass_names = scene.luxcore.lightgroups.get_pass_names()
             for i, name in enumerate(lightgroup_pass_names):
                 if i not in engine.exporter.lightgroup_cache:
                     # This light group is not used by any lights in the scene, so it was not defined
                     continue
+                execute_imagepipeline = viewed_passes is None or name in viewed_passes
 
                 output_name = "RADIANCE_GROUP"
                 output_type = pyluxcore.FilmOutputType.RADIANCE_GROUP
                 try:
-                    self._import_aov(output_name, output_type, render_layer, session, engine, True, i, name)
+                    self._import_aov(output_name, output_type, render_layer, session, engine,
+                                     execute_imagepipeline, i, name)
                 except RuntimeError as error:
                     print("Error on import of Lightgroup AOV of group %s: %s" % (name, error))
 
@@ -97,6 +207,115 @@ class FrameBufferFinal(object):
         # Reset the refresh button
         self._reset_button(scene.luxcore.display, "refresh")
 
+    def _can_draw_tiles(self, scene):
+        if not self._tile_passcounts:
+            # TILEPATH is not used or the first refresh has not happened yet
+            return False
+
+        if not self._only_combined:
+            # Merging a tile result blanks all other passes (AOVs, light groups, denoiser) in the tile
+            return False
+
+        pipeline = scene.camera.data.luxcore.imagepipeline
+        if pipeline.tonemapper.is_automatic():
+            # The brightness of all tiles changes with every refresh
+            return False
+        if pipeline.has_nonlocal_plugins():
+            # Changed tiles also change the pixels of their unchanged neighbours
+            return False
+
+        return True
+
+    def _draw_changed_tiles(self, engine, session, scene, scene_layer, tile_passcounts, execute_combined_pipeline):
+        """
+        Imports only the tiles whose pass count changed since the last refresh.
+        Returns False if a full refresh is required instead.
+        """
+        changed_tiles = [coords for coords, passcount in tile_passcounts.items()
+                         if self._tile_passcounts.get(coords) != passcount]
+
+        changed_area = sum(min(TileStats.width, self._width - x) * min(TileStats.height, self._height - y)
+                           for x, y in changed_tiles)
+        if changed_area > self._width * self._height * MAX_TILE_REFRESH_AREA:
+            return False
+
+        if changed_tiles:
+            channels = 4 if self._transparent else 3
+            if self._tile_buffer is None:
+                self._tile_buffer = numpy.empty(self._width * self._height * channels, dtype=numpy.float32)
+
+            session.GetFilm().GetOutputFloat(self._combined_output_type, self._tile_buffer,
+                                             COMBINED_PIPELINE_INDEX, execute_combined_pipeline)
+            pixels = self._tile_buffer.reshape(self._height, self._width, channels)
+
+            for x, y in changed_tiles:
+                width = min(TileStats.width, self._width - x)
+                height = min(TileStats.height, self._height - y)
+                # Blender passes always have 4 channels, without transparent film alpha is 1
+                rect = numpy.ones((height, width, 4), dtype=numpy.float32)
+                rect[:, :, :channels] = pixels[y:y + height, x:x + width]
+
+                result = engine.begin_result(x, y, width, height, scene_layer.name)
+                result.layers[0].passes["Combined"].rect = rect.reshape(-1, 4)
+                engine.end_result(result)
+
+            self._tile_passcounts.update(tile_passcounts)
+
+        self._last_viewed_passes = {COMBINED_PASS_INDEX}
+        # Reset the refresh button
+        self._reset_button(scene.luxcore.display, "refresh")
+        return True
+
+    def _get_tile_passcounts(self):
+        tile_passcounts = {}
+
+        for coords, passcounts in ((TileStats.pending_coords, TileStats.pending_passcounts),
+                                   (TileStats.converged_coords, TileStats.converged_passcounts),
+                                   (TileStats.notconverged_coords, TileStats.notconverged_passcounts)):
+            for i, passcount in enumerate(passcounts):
+                tile_passcounts[(coords[i * 2], coords[i * 2 + 1])] = passcount
+
+        return tile_passcounts
+
+    def _get_viewed_pass_indices(self, scene):
+        """
+        Returns the indices of the passes of the current render layer that are shown in
+        image editors, or None if they can't be determined
+        """
+        scene_layer = scene.render.layers[scene.luxcore.active_layer_index]
+
+        # The render result only contains the layers that are rendered
+        if scene.render.use_single_layer:
+            result_layers = [scene.render.layers.active]
+        else:
+            result_layers = [layer for layer in scene.render.layers if layer.use]
+
+        viewed_passes = set()
+
+        try:
+            for window in bpy.context.window_manager.windows:
+                for area in window.screen.areas:
+                    if area.type != "IMAGE_EDITOR":
+                        continue
+
+                    space = area.spaces.active
+                    if not space.image or space.image.type != "RENDER_RESULT":
+                        continue
+
+                    image_user = space.image_user
+                    if result_layers[image_user.multilayer_layer] == scene_layer:
+                        viewed_passes.add(image_user.multilayer_pass)
+        except (AttributeError, IndexError):
+            return None
+
+        return viewed_passes
+
+    def _get_pass_name(self, output_name):
+        # Depth needs special treatment because it's pre-defined by Blender and not uppercase
+        if output_name == "DEPTH":
+            return "Depth"
+        return output_name
+
     def _import_aov(self, output_name, output_type, render_layer, session, engine,
                     execute_imagepipeline=True, index=0, lightgroup_name=""):
         if output_name in AOVS:
@@ -115,13 +334,10 @@ class FrameBufferFinal(object):
         else:
             convert_func = aov.convert_func
 
-        # Depth needs special treatment because it's pre-defined by Blender and not uppercase
-        if output_name == "DEPTH":
-            pass_name = "Depth"
-        elif output_name.startswith("RADIANCE_GROUP"):
+        if output_name.startswith("RADIANCE_GROUP"):
             pass_name = lightgroup_name
         else:
-            pass_name = output_name
+            pass_name = self._get_pass_name(output_name)
 
         blender_pass = render_layer.passes[pass_name]
 
@@ -100,6 +100,9 @@ def _render_layer(engine, scene):
 
         # Do session update (imagepipeline, lightgroups)
         changes = engine.exporter.get_changes()
+        if changes:
+            # The imagepipeline can't be parsed while it runs in the background
+            engine.framebuffer.wait_for_refresh(engine.session)
         engine.exporter.update_session(changes, engine.session)
 
         if engine.session.IsInPause():
@@ -113,6 +116,8 @@ def _render_layer(engine, scene):
 
                 # Refresh quickly when user changed something or requested a refresh via button
                 draw_film |= changes or refresh_requested
+                # Interim refreshes only contain the viewed passes, show a newly selected one quickly
+                draw_film |= engine.framebuffer.is_viewed_pass_changed(scene)
 
                 stats = utils_render.update_stats(engine.session)
                 if draw_film:
@@ -125,10 +130,18 @@ def _render_layer(engine, scene):
 
                 last_stat_refresh = now
                 if draw_film:
-                    # Show updated film (this operation is expensive)
-                    engine.framebuffer.draw(engine, engine.session, scene, render_stopped=False)
+                    if refresh_requested:
+                        # The denoiser has to run synchronously
+                        engine.framebuffer.draw(engine, engine.session, scene, render_stopped=False)
+                    else:
+                        # Run the imagepipeline (this operation is expensive) in the background,
+                        # the previous result stays visible until the new one is imported
+                        engine.framebuffer.start_refresh(engine.session)
                     last_film_refresh = now
 
+            # Import the film if the background refresh is done
+            engine.framebuffer.finish_refresh(engine, engine.session, scene)
+
             utils_render.update_status_msg(stats, engine, scene, config, time_until_film_refresh)
 
             # Compute and print the optimal clamp value. Done only once after a warmup phase.
@@ -3,10 +3,13 @@ from ..bin import pyluxcore
 from .. import utils
 from . import (
     blender_object, caches, camera, config, duplis,
-    imagepipeline, light, material, motion_blur, hair,
-    world, halt,
+    imagepipeline, light, material, mesh_cache, motion_blur, hair,
+    pipeline, world, halt,
 )
+from .image import ImageExporter
 from .light import WORLD_BACKGROUND_LIGHT_NAME
+from .texture_memory import TextureMemory
+from ..utils.profiler import Profiler
 
 
 class Change:
@@ -42,14 +45,14 @@ class Exporter(object):
         print("[Exporter] Init")
         self.scene = blender_scene
 
-        self.config_cache = caches.StringCache()
+        self.config_cache = caches.PropertiesCache()
         self.camera_cache = caches.CameraCache()
         self.object_cache = caches.ObjectCache()
         self.material_cache = caches.MaterialCache()
         self.visibility_cache = caches.VisibilityCache()
         self.world_cache = caches.WorldCache()
-        self.imagepipeline_cache = caches.StringCache()
-        self.halt_cache = caches.StringCache()
+        self.imagepipeline_cache = caches.PropertiesCache()
+        self.halt_cache = caches.PropertiesCache()
         # This dict contains ExportedObject and ExportedLight instances
         self.exported_objects = {}
 
@@ -65,38 +68,141 @@ class Exporter(object):
         # If a light/material uses a lightgroup, the id is stored here during export
         self.lightgroup_cache = set()
 
+        # Objects that can share their shape with other objects (final render only)
+        # {object key: shared mesh key}
+        self.shared_mesh_keys = {}
+        # The shapes that were already exported for a shared mesh key
+        # {shared mesh key: (luxcore_name, mesh_definitions)}
+        self.shared_shapes = {}
+
+        # Keys of the exported hair strands (see hair.get_cache_key())
+        # {luxcore_shape_name: key}
+        self.hair_shape_keys = {}
+        # Pixels of the images used for hair colors, shared by all hair systems of an export
+        # {image key: numpy array}
+        self.hair_image_pixels = {}
+        # Max. width/height of image textures, larger images are downscaled (0 = no limit)
+        self.texture_max_size = 0
+        # Reduced sizes assigned by the texture budget {image key: max. width/height}
+        self.texture_max_sizes = {}
+        # Smoke grids, shared by all smoke textures of a domain (see smoke.get_grid())
+        # {(domain key, frame, subframe): {channel: smoke.SparseGrid}}
+        self.smoke_grids = {}
+
     def create_session(self, context=None, engine=None):
         # Notes:
         # In final render, context is None
         # In viewport render, engine is None (we can't show messages or check test_break() anyway)
-
+        Profiler.begin_export(self.scene)
+        try:
+            return self._create_session(context, engine)
+        finally:
+            ImageExporter.save_index()
+            Profiler.end_export()
+
+            if not context:
+                # Final renders are not updated, the pixels and grids are not needed after the export
+                self.hair_image_pixels.clear()
+                self.smoke_grids.clear()
+
+    def _create_session(self, context, engine):
         print("[Exporter] create_session")
         start = time()
         scene = self.scene
+        # Reset the counter, we only report the matrices of this export
+        utils.pop_non_invertible_count()
+        self.texture_max_size = self._get_texture_max_size(scene, context, engine)
+        if scene.luxcore.config.use_texture_budget:
+            budget = scene.luxcore.config.texture_budget * 1024 * 1024
+            with Profiler.section("Textures", "Memory Analysis"):
+                self.texture_max_sizes = TextureMemory.analyze(scene, self.texture_max_size, budget)
+            TextureMemory.print_report()
         # Scene
         luxcore_scene = pyluxcore.Scene()
         scene_props = pyluxcore.Properties()
 
         # Camera (needs to be parsed first because it is needed for hair tesselation)
         self.camera_cache.diff(self, scene, context)  # Init camera cache
-        luxcore_scene.Parse(self.camera_cache.props)
+        with Profiler.section("Parse", "Camera"):
+            luxcore_scene.Parse(self.camera_cache.props)
 
         # Objects and lamps
         objs = context.visible_objects if context else scene.objects
         len_objs = len(objs)
 
-        for index, obj in enumerate(objs, start=1):
-            if obj.type in {"MESH", "CURVE", "SURFACE", "META", "FONT", "LAMP", "EMPTY"}:
-                if engine:
-                    engine.update_stats("Export", "Object: %s (%d/%d)" % (obj.name, index, len_objs))
-                self._convert_object(scene_props, obj, scene, context, luxcore_scene, engine=engine)
-
-                # Objects are the most expensive to export, so they dictate the progress
-                if engine:
-                    engine.update_progress(index / len_objs)
-            # Regularly check if we should abort the export (important in heavy scenes)
-            if engine and engine.test_break():
-                return None
+        if not context:
+            # In viewport render, every object is instanced anyway
+            self.shared_mesh_keys = blender_object.find_shared_meshes(objs, scene, "RENDER")
+
+        # In pipelined export, a worker thread parses the object properties in
+        # batches while we extract the next objects from Blender
+        if not context and scene.luxcore.config.use_pipelined_export:
+            parse_pipeline = pipeline.ParsePipeline(luxcore_scene)
+            export_scene = parse_pipeline.scene
+            object_props = pyluxcore.Properties()
+        else:
+            parse_pipeline = None
+            export_scene = luxcore_scene
+            object_props = scene_props
+
+        # Compute the transformations of all objects at once
+        matrices = utils.get_matrices(objs)
+        transformations, _ = utils.matrices_to_array(matrices, scene, apply_worldscale=True)
+        # Only exported objects are reported, not e.g. cameras or hidden objects
+        non_invertible = utils.find_non_invertible(matrices)
+        non_invertible_count = 0
+
+        objects_start = time()
+        mesh_cache.MeshCache.begin_export(context)
+        export_failed = True
+        try:
+            for index, obj in enumerate(objs, start=1):
+                if obj.type in {"MESH", "CURVE", "SURFACE", "META", "FONT", "LAMP", "EMPTY"}:
+                    if engine:
+                        engine.update_stats("Export", "Object: %s (%d/%d)" % (obj.name, index, len_objs))
+                    exported_obj = self._convert_object(object_props, obj, scene, context, export_scene,
+                                                        engine=engine,
+                                                        transformation=transformations[index - 1].tolist())
+                    # Lamps don't use the precomputed transformation, matrix_to_list() counts them
+                    if exported_obj and non_invertible[index - 1] and obj.type != "LAMP":
+                        non_invertible_count += 1
+
+                    if parse_pipeline and index % pipeline.BATCH_SIZE == 0:
+                        parse_pipeline.submit(object_props)
+                        object_props = pyluxcore.Properties()
+
+                    # Objects are the most expensive to export, so they dictate the progress
+                    if engine:
+                        engine.update_progress(index / len_objs)
+                # Regularly check if we should abort the export (important in heavy scenes)
+                if engine and engine.test_break():
+                    return None
+
+            if parse_pipeline:
+                parse_pipeline.submit(object_props)
+            export_failed = False
+        finally:
+            # Also save the cache index if the export was cancelled
+            mesh_cache.MeshCache.end_export()
+
+            if parse_pipeline:
+                # Waits for the remaining batches, also stops the worker thread if the export was cancelled.
+                # If the export raised an exception, an error of the worker thread must not replace it.
+                parse_pipeline.finish(raise_error=not export_failed)
+
+        # Reported together with the other non-invertible matrices of this export
+        utils.add_non_invertible_count(non_invertible_count)
+
+        if parse_pipeline:
+            lock_wait_time = parse_pipeline.scene.lock_wait_time
+            blender_time = time() - objects_start - parse_pipeline.wait_time - lock_wait_time
+            stage_msg = ("Blender: %.1f s, Parse: %.1f s (%d batches), Waiting for parser: %.1f s, "
+                         "Waiting for scene lock: %.1f s"
+                         % (blender_time, parse_pipeline.parse_time, parse_pipeline.batch_count,
+                            parse_pipeline.wait_time, lock_wait_time))
+            # The next update_stats() call would overwrite the timings immediately, so we only print them
+            # (the parse batches and waiting times are also recorded by the profiler)
+            print("[Exporter] Pipelined object export:", stage_msg)
 
         # Motion blur
         if scene.camera:
@@ -120,7 +226,11 @@ class Exporter(object):
         world_props = world.convert(self, scene)
         scene_props.Set(world_props)
 
-        luxcore_scene.Parse(scene_props)
+        self._report_non_invertible_matrices(scene)
+        # LuxCore loads the images during parsing
+        ImageExporter.wait(engine)
+        with Profiler.section("Parse", "Scene"):
+            luxcore_scene.Parse(scene_props)
 
         # Regularly check if we should abort the export (important in heavy scenes)
         if engine and engine.test_break():
@@ -132,8 +242,9 @@ class Exporter(object):
             # Config props are empty: there was a critical error in config export, we can't render
             raise Exception("Errors in config, check error log")
 
-        # Init config cache (convert to string here because config_props gets changed below)
-        self.config_cache.diff(str(config_props))
+        # Init config cache (the property hashes are computed here, so it
+        # does not matter that config_props gets changed below)
+        self.config_cache.diff(config_props)
 
         # Imagepipeline
         imagepipeline_props = imagepipeline.convert(scene, context)
@@ -146,8 +257,10 @@ class Exporter(object):
         self.halt_cache.diff(halt_props)
         config_props.Set(halt_props)
 
-        # Create the renderconfig
-        renderconfig = pyluxcore.RenderConfig(config_props, luxcore_scene)
+        # Create the renderconfig (the imagepipeline might use a background image)
+        ImageExporter.wait()
+        with Profiler.section("Session", "RenderConfig"):
+            renderconfig = pyluxcore.RenderConfig(config_props, luxcore_scene)
 
         # Regularly check if we should abort the export (important in heavy scenes)
         if engine and engine.test_break():
@@ -166,7 +279,8 @@ class Exporter(object):
 
         # Create session (in case of OpenCL engines, render kernels are compiled here)
         start = time()
-        session = pyluxcore.RenderSession(renderconfig)
+        with Profiler.section("Session", "RenderSession"):
+            session = pyluxcore.RenderSession(renderconfig)
         elapsed_msg = "Session created in %.1f s" % (time() - start)
         print(elapsed_msg)
 
@@ -215,6 +329,12 @@ class Exporter(object):
         print("[Exporter] Update because of:", Change.to_string(changes))
         # Invalidate node cache
         self.node_cache.clear()
+        # The images might have been edited since the last update
+        self.hair_image_pixels.clear()
+        if self.smoke_grids and changes & Change.OBJECT:
+            self._remove_outdated_smoke_grids(context.scene)
+        # get_changes() might have exported images (e.g. the imagepipeline background image)
+        ImageExporter.wait()
 
         if changes & Change.CONFIG:
             # We already converted the new config settings during get_changes(), re-use them
@@ -226,6 +346,8 @@ class Exporter(object):
 
             try:
                 props = self._update_scene(context, changes, luxcore_scene)
+                self._report_non_invertible_matrices(context.scene)
+                ImageExporter.wait()
                 luxcore_scene.Parse(props)
             except Exception as error:
                 context.scene.luxcore.errorlog.add_error(error)
@@ -250,19 +372,55 @@ class Exporter(object):
         if changes & Change.REQUIRES_SESSION_PARSE:
             self.update_session(changes, session)
 
+        ImageExporter.save_index()
+
         # We have to return and re-assign the session in the RenderEngine,
         # because it might have been replaced in _update_config()
         return session
 
+    def get_image_max_size(self, image):
+        """ The max_size argument for ImageExporter.export() """
+        return self.texture_max_sizes.get(utils.make_key(image), self.texture_max_size)
+
+    def _get_texture_max_size(self, scene, context, engine):
+        config = scene.luxcore.config
+
+        if not config.use_texture_max_size:
+            return 0
+        if context or (engine and engine.is_preview):
+            return config.texture_max_size_viewport
+        return config.texture_max_size
+
+    def _remove_outdated_smoke_grids(self, scene):
+        # Grids of other frames or of edited domains have to be read again
+        frame = (scene.frame_current, scene.frame_subframe)
+        # The object cache already collected the objects with changed data, no need to check all objects
+        updated = {utils.make_key(obj) for obj in self.object_cache.changed_mesh}
+
+        for key in list(self.smoke_grids.keys()):
+            domain_key, frame_current, subframe = key
+            if domain_key in updated or (frame_current, subframe) != frame:
+                del self.smoke_grids[key]
+
     def update_session(self, changes, session):
         if changes & Change.IMAGEPIPELINE:
             print("Updating imagepipeline")
-            session.Parse(self.imagepipeline_cache.props)
+            # LuxCore only accepts complete imagepipelines ("film.imagepipelines.<index>.*"),
+            # so we send all pipelines that contain a changed property
+            session.Parse(self.imagepipeline_cache.get_changed_props(group_depth=3))
         if changes & Change.HALT:
+            # Send all halt conditions, a removed key would otherwise keep its old value in the session
             session.Parse(self.halt_cache.props)
 
+    def _report_non_invertible_matrices(self, scene):
+        # One warning per export instead of one per matrix, the errorlog is slow with many entries
+        count = utils.pop_non_invertible_count()
+        if count:
+            msg = "%d non-invertible matrices. This can happen if e.g. an object has scale 0" % count
+            scene.luxcore.errorlog.add_warning(msg)
+
     def _convert_object(self, props, obj, scene, context, luxcore_scene,
-                        update_mesh=False, dupli_suffix="", engine=None):
+                        update_mesh=False, dupli_suffix="", engine=None, transformation=None):
         key = utils.make_key(obj)
         old_exported_obj = None
 
@@ -275,12 +433,15 @@ class Exporter(object):
             old_exported_obj = self.exported_objects[key]
 
         # Note: exported_obj can also be an instance of ExportedLight, but they behave the same
-        obj_props, exported_obj = blender_object.convert(self, obj, scene, context, luxcore_scene, old_exported_obj,
-                                                         update_mesh, dupli_suffix)
+        with Profiler.section("Object", obj.name):
+            obj_props, exported_obj = blender_object.convert(self, obj, scene, context, luxcore_scene,
+                                                             old_exported_obj, update_mesh, dupli_suffix,
+                                                             transformation=transformation)
 
         # Convert particles and dupliverts/faces
         if obj.is_duplicator:
-            duplis.convert(self, obj, scene, context, luxcore_scene, engine)
+            with Profiler.section("Duplis", obj.name):
+                duplis.convert(self, obj, scene, context, luxcore_scene, engine)
 
         # When moving a duplicated object, update the parent, too (concerns dupliverts/faces)
         if obj.parent and obj.parent.is_duplicator:
@@ -291,7 +452,8 @@ class Exporter(object):
             settings = psys.settings
             # render_type OBJECT and GROUP are handled by duplis.convert() above
             if settings.type == "HAIR" and settings.render_type == "PATH":
-                hair.convert_hair(self, obj, psys, luxcore_scene, scene, context, engine)
+                with Profiler.section("Hair", obj.name + ": " + psys.name):
+                    hair.convert_hair(self, obj, psys, luxcore_scene, scene, context, engine)
                 
         if exported_obj is None:
             # Object is not visible or an error happened.
@@ -365,8 +527,7 @@ class Exporter(object):
 
                 del self.exported_objects[key]
 
-            for key in self.visibility_cache.objects_to_add:
-                obj = utils.obj_from_key(key, context.visible_objects)
+            for obj in self.visibility_cache.objects_to_add:
                 self._convert_object(props, obj, context.scene, context, luxcore_scene)
 
         if changes & Change.WORLD:
@@ -1,4 +1,5 @@
 import bpy
+import hashlib
 from ..bin import pyluxcore
 from .. import utils
 from ..utils import ExportedObject
@@ -6,12 +7,16 @@ from ..utils import node as utils_node
 
 from . import material
 from .light import convert_lamp
+from .mesh_cache import MeshCache, hash_modifier, TIME_DEPENDENT_MODIFIERS
+from ..utils.profiler import Profiler
 
 
 def convert(exporter, blender_obj, scene, context, luxcore_scene,
-            exported_object=None, update_mesh=False, dupli_suffix="", duplicator=None):
+            exported_object=None, update_mesh=False, dupli_suffix="", duplicator=None, transformation=None):
     """
     duplicator: The duplicator object that created this dupli (e.g. the particle emitter object)
+    transformation: The world scaled matrix_world in the format of utils.matrix_to_list(),
+    if it was already computed for many objects at once (see utils.matrices_to_array())
     """
 
     if not utils.is_obj_visible(blender_obj, scene, context, is_dupli=dupli_suffix):
@@ -21,7 +26,7 @@ def convert(exporter, blender_obj, scene, context, luxcore_scene,
         return pyluxcore.Properties(), None
 
     if blender_obj.type == "LAMP":
-        return convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suffix)
+        return convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suffix, exported_object)
     elif blender_obj.type == "EMPTY":
         return pyluxcore.Properties(), None
 
@@ -36,33 +41,40 @@ def convert(exporter, blender_obj, scene, context, luxcore_scene,
             print(blender_obj.name + ": No mesh data")
             return props, None
 
-        transformation = utils.matrix_to_list(blender_obj.matrix_world, scene, apply_worldscale=True)
+        if transformation is None:
+            transformation = utils.matrix_to_list(blender_obj.matrix_world, scene, apply_worldscale=True)
+
+        # Objects with shared mesh data and equivalent modifier stacks use the same shape
+        shared_mesh_key = None if dupli_suffix else exporter.shared_mesh_keys.get(utils.make_key(blender_obj))
 
         # Instancing just means that we transform the object instead of the mesh
-        if utils.use_instancing(blender_obj, scene, context) or dupli_suffix:
+        if utils.use_instancing(blender_obj, scene, context) or dupli_suffix or shared_mesh_key:
             obj_transform = transformation
             mesh_transform = None
         else:
             obj_transform = None
             mesh_transform = transformation
 
+        # {lux_object_name: lux_object_name of the object whose shape is used}
+        shape_sources = {}
+
         if update_mesh:
-            # print("converting mesh:", blender_obj.data.name)
-            modifier_mode = "PREVIEW" if context else "RENDER"
-            apply_modifiers = True
-            edge_split_mod = _begin_autosmooth_if_required(blender_obj)
-            mesh = blender_obj.to_mesh(scene, apply_modifiers, modifier_mode)
-            _end_autosmooth_if_required(blender_obj, edge_split_mod)
-
-            if mesh is None or len(mesh.tessfaces) == 0:
-                # This is not worth a warning in the errorlog
-                print(blender_obj.name + ": No mesh data after to_mesh()")
-                if mesh:
-                    bpy.data.meshes.remove(mesh, do_unlink=False)
-                return props, None
-
-            mesh_definitions = _convert_mesh_to_shapes(luxcore_name, mesh, luxcore_scene, mesh_transform)
-            bpy.data.meshes.remove(mesh, do_unlink=False)
+            if shared_mesh_key in exporter.shared_shapes:
+                source_name, source_definitions = exporter.shared_shapes[shared_mesh_key]
+                mesh_definitions = []
+
+                for source_object_name, material_index in source_definitions:
+                    lux_object_name = luxcore_name + source_object_name[len(source_name):]
+                    shape_sources[lux_object_name] = source_object_name
+                    mesh_definitions.append([lux_object_name, material_index])
+            else:
+                mesh_definitions = _define_shapes(blender_obj, scene, context, luxcore_scene,
+                                                  luxcore_name, mesh_transform, props)
+                if mesh_definitions is None:
+                    return props, None
+
+                if shared_mesh_key:
+                    exporter.shared_shapes[shared_mesh_key] = (luxcore_name, mesh_definitions)
         else:
             assert exported_object is not None
             print(blender_obj.name + ": Using cached mesh")
@@ -92,8 +104,9 @@ def convert(exporter, blender_obj, scene, context, luxcore_scene,
                     lux_mat_name, mat_props = material.fallback()
 
             props.Set(mat_props)
+            shape_source = shape_sources.get(lux_object_name, lux_object_name)
             _define_luxcore_object(props, lux_object_name, lux_mat_name, obj_transform,
-                                   blender_obj, scene, context, duplicator)
+                                   blender_obj, scene, context, duplicator, shape_source)
 
         return props, ExportedObject(mesh_definitions)
     except Exception as error:
@@ -104,6 +117,73 @@ def convert(exporter, blender_obj, scene, context, luxcore_scene,
         return pyluxcore.Properties(), None
 
 
+def find_shared_meshes(objects, scene, modifier_mode):
+    """
+    Find objects that share their mesh data and have equivalent modifier stacks
+    (e.g. Alt+D copies), so their shape only has to be exported once.
+    Returns a dict {object key: shared mesh key}, only containing objects with at least one partner.
+    """
+    keys = {}
+    counts = {}
+
+    for obj in objects:
+        if obj.type != "MESH" or obj.data is None or obj.data.users < 2:
+            continue
+
+        if any(mod.type in TIME_DEPENDENT_MODIFIERS for mod in obj.modifiers):
+            # Simulations (cloth, soft body etc.) and particle modifiers give
+            # different results per object, even with the same mesh and settings
+            continue
+
+        md5 = hashlib.md5()
+        md5.update(utils.make_key(obj.data).encode())
+        equivalent_possible = all(hash_modifier(md5, mod, modifier_mode, scene) for mod in obj.modifiers)
+
+        if equivalent_possible:
+            shared_mesh_key = md5.hexdigest()
+            keys[utils.make_key(obj)] = shared_mesh_key
+            counts[shared_mesh_key] = counts.get(shared_mesh_key, 0) + 1
+
+    return {obj_key: shared_mesh_key for obj_key, shared_mesh_key in keys.items()
+            if counts[shared_mesh_key] > 1}
+
+
+def _define_shapes(blender_obj, scene, context, luxcore_scene, luxcore_name, mesh_transform, props):
+    """ Returns the mesh definitions or None if the object has no faces """
+    # print("converting mesh:", blender_obj.data.name)
+    modifier_mode = "PREVIEW" if context else "RENDER"
+    cache_key = None
+
+    if MeshCache.active:
+        cache_key = MeshCache.make_key(blender_obj, scene, modifier_mode, mesh_transform)
+        if cache_key:
+            mesh_definitions = MeshCache.load(cache_key, luxcore_name, props)
+            if mesh_definitions is not None:
+                return mesh_definitions
+
+    apply_modifiers = True
+    edge_split_mod = _begin_autosmooth_if_required(blender_obj)
+    with Profiler.section("to_mesh", blender_obj.name):
+        mesh = blender_obj.to_mesh(scene, apply_modifiers, modifier_mode)
+    _end_autosmooth_if_required(blender_obj, edge_split_mod)
+
+    if mesh is None or len(mesh.tessfaces) == 0:
+        # This is not worth a warning in the errorlog
+        print(blender_obj.name + ": No mesh data after to_mesh()")
+        if mesh:
+            bpy.data.meshes.remove(mesh, do_unlink=False)
+        return None
+
+    with Profiler.section("Define Mesh", blender_obj.name):
+        mesh_definitions = _convert_mesh_to_shapes(luxcore_name, mesh, luxcore_scene, mesh_transform)
+    bpy.data.meshes.remove(mesh, do_unlink=False)
+
+    if cache_key:
+        MeshCache.store(cache_key, luxcore_name, mesh_definitions, luxcore_scene)
+
+    return mesh_definitions
+
+
 def _begin_autosmooth_if_required(blender_obj):
     if not getattr(blender_obj.data, "use_auto_smooth", False):
         return None
@@ -140,9 +220,13 @@ def _handle_pointiness(props, luxcore_shape_name, blender_obj):
 
 
 def _define_luxcore_object(props, lux_object_name, lux_material_name, obj_transform,
-                           blender_obj, scene, context, duplicator):
+                           blender_obj, scene, context, duplicator, shape_source):
+    """
+    shape_source: The lux_object_name that was used when the shape was defined
+    (differs from lux_object_name if the shape is shared with other objects)
+    """
     # The "Mesh-" prefix is hardcoded in Scene_DefineBlenderMesh1 in the LuxCore API
-    luxcore_shape_name = "Mesh-" + lux_object_name
+    luxcore_shape_name = "Mesh-" + shape_source
     luxcore_shape_name = _handle_pointiness(props, luxcore_shape_name, blender_obj)
 
     prefix = "scene.objects." + lux_object_name + "."
@@ -1,39 +1,102 @@
 import bpy
+from collections import defaultdict
+from itertools import compress
+from operator import or_
+from ..bin import pyluxcore
 from .. import utils
-from ..utils import node as utils_node
 from ..export import camera
 
+MESH_TYPES = {"MESH", "CURVE", "SURFACE", "META", "FONT"}
+# Looking up collection elements by index is a linear search in Blender,
+# if more elements changed we iterate over the whole collection instead
+MAX_INDEX_LOOKUPS = 32
 
-class StringCache(object):
+
+class PropertiesCache(object):
+    """
+    Detects changes in pyluxcore.Properties.
+    Each property is hashed separately, so we know which keys changed.
+    Only the new properties are hashed, the hashes of the old ones are kept.
+    """
     def __init__(self):
         self.props = None
+        # Set of property names that were added, removed or changed in the last diff() call
+        self.changed_keys = set()
+        # {property name: hash of the property}
+        self._hashes = {}
 
     def diff(self, new_props):
-        props_str = str(self.props)
-        new_props_str = str(new_props)
-
-        if self.props is None:
-            # Not initialized yet
-            self.props = new_props
-            return True
-
-        has_changes = props_str != new_props_str
         self.props = new_props
-        return has_changes
+        hashes = {key: hash(str(new_props.Get(key))) for key in new_props.GetAllNames()}
+        old_hashes = self._hashes
+
+        if hashes == old_hashes:
+            # Fast path, nothing changed
+            self.changed_keys = set()
+            return self.changed_keys
+
+        self.changed_keys = {key for key, value_hash in hashes.items() if old_hashes.get(key) != value_hash}
+        # Removed keys are also changes
+        self.changed_keys.update(old_hashes.keys() - hashes.keys())
+
+        self._hashes = hashes
+        return self.changed_keys
+
+    def get_changed_props(self, group_depth=0):
+        """
+        Returns a pyluxcore.Properties object containing only the changed properties.
+        If group_depth > 0, all properties that share their first group_depth name parts
+        with a changed property are included. This is needed when LuxCore only accepts
+        complete definitions, e.g. group_depth=3 for "film.imagepipelines.0.*".
+        """
+        changed = pyluxcore.Properties()
+
+        if group_depth:
+            groups = {_get_group(key, group_depth) for key in self.changed_keys}
+            keys = [key for key in self.props.GetAllNames() if _get_group(key, group_depth) in groups]
+        else:
+            keys = [key for key in self.changed_keys if self.props.IsDefined(key)]
+
+        for key in keys:
+            changed.Set(self.props.Get(key))
+        return changed
+
+
+def _get_group(key, depth):
+    return ".".join(key.split(".", depth)[:depth])
+
+
+def _get_updated(collection):
+    """
+    Returns the elements of a collection of datablocks that have is_updated
+    or is_updated_data set. The flags are read in bulk with foreach_get, so we
+    don't have to access each element from Python.
+    """
+    count = len(collection)
+    updated = [False] * count
+    updated_data = [False] * count
+    collection.foreach_get("is_updated", updated)
+    collection.foreach_get("is_updated_data", updated_data)
+    flags = list(map(or_, updated, updated_data))
+    indices = list(compress(range(count), flags))
+
+    if len(indices) <= MAX_INDEX_LOOKUPS:
+        return [collection[index] for index in indices]
+    else:
+        return list(compress(collection, flags))
 
 
 class CameraCache(object):
     def __init__(self):
-        self.string_cache = StringCache()
+        self.props_cache = PropertiesCache()
 
     @property
     def props(self):
-        return self.string_cache.props
+        return self.props_cache.props
 
     def diff(self, exporter, scene, context):
-        # String cache
         camera_props = camera.convert(exporter, scene, context)
-        has_changes = self.string_cache.diff(camera_props)
+        has_changes = self.props_cache.diff(camera_props)
 
         # Check camera object and data for changes
         # Needed in case the volume node tree was relinked/unlinked
@@ -56,15 +119,15 @@ class ObjectCache(object):
         self._reset()
 
         if bpy.data.objects.is_updated:
-            for obj in scene.objects:
+            for obj in _get_updated(scene.objects):
                 if obj.is_updated_data:
-                    if obj.type in ["MESH", "CURVE", "SURFACE", "META", "FONT"]:
+                    if obj.type in MESH_TYPES:
                         self.changed_mesh.append(obj)
-                    elif obj.type in ["LAMP"]:
+                    elif obj.type == "LAMP":
                         self.lamps.append(obj)
 
                 if obj.is_updated:
-                    if obj.type in ["MESH", "CURVE", "SURFACE", "META", "FONT", "EMPTY"]:
+                    if obj.type in MESH_TYPES or obj.type == "EMPTY":
                         # check if a new material was assigned
                         if obj.data and obj.data.is_updated:
                             self.changed_mesh.append(obj)
@@ -77,8 +140,25 @@ class ObjectCache(object):
 
 
 class MaterialCache(object):
+    """
+    Uses reverse indices (node tree -> materials, pointer tree -> parent trees)
+    so only the materials affected by an update are visited.
+    All index keys are created with utils.make_key()
+    """
     def __init__(self):
         self._reset()
+        self._index_built = False
+        # {node_tree_key: {material_key, ...}}
+        self.tree_to_materials = defaultdict(set)
+        # {node_tree_key: {key of a tree with a pointer node to this tree, ...}}
+        self.tree_to_parents = defaultdict(set)
+        # Forward entries, needed to remove stale entries from the reverse indices
+        # {material_key: node_tree_key}
+        self._material_tree = {}
+        # {material_key: material name}
+        self._material_names = {}
+        # {node_tree_key: {key of a tree this tree points to, ...}}
+        self._tree_children = {}
 
     def _reset(self):
         self.changed_materials = []
@@ -86,35 +166,107 @@ class MaterialCache(object):
     def diff(self):
         self._reset()
 
-        if bpy.data.materials.is_updated:
+        if not self._index_built:
             for mat in bpy.data.materials:
-                node_tree = mat.luxcore.node_tree
-                mat_updated = False
+                self._index_material(mat)
+            self._index_built = True
 
-                if mat.is_updated:
-                    mat_updated = True
-                elif node_tree:
-                    if node_tree.is_updated or node_tree.is_updated_data:
-                        mat_updated = True
+        if not (bpy.data.materials.is_updated or bpy.data.node_groups.is_updated):
+            return self.changed_materials
 
-                    # Check pointer nodes for changes
-                    pointer_nodes = utils_node.find_nodes(node_tree, "LuxCoreNodeTreePointer")
-                    for node in pointer_nodes:
-                        pointer_tree = node.node_tree
-                        if pointer_tree and (pointer_tree.is_updated or pointer_tree.is_updated_data):
-                            mat_updated = True
+        changed_keys = set()
 
-                if mat_updated:
-                    self.changed_materials.append(mat)
+        for mat in _get_updated(bpy.data.materials):
+            # The node tree might have been replaced
+            self._index_material(mat)
+            changed_keys.add(utils.make_key(mat))
+
+        updated_tree_keys = set()
+        for node_tree in _get_updated(bpy.data.node_groups):
+            # Pointer nodes might have been added, removed or relinked
+            self._index_tree(node_tree)
+            updated_tree_keys.add(utils.make_key(node_tree))
+
+        for tree_key in self._with_parent_trees(updated_tree_keys):
+            changed_keys.update(self.tree_to_materials.get(tree_key, ()))
+
+        for mat_key in changed_keys:
+            mat = self._material_from_key(mat_key)
+            if mat:
+                self.changed_materials.append(mat)
 
         return self.changed_materials
 
+    def _index_material(self, mat):
+        mat_key = utils.make_key(mat)
+        self._material_names[mat_key] = mat.name
+
+        old_tree_key = self._material_tree.pop(mat_key, None)
+        if old_tree_key:
+            self.tree_to_materials[old_tree_key].discard(mat_key)
+
+        node_tree = mat.luxcore.node_tree
+        if node_tree:
+            tree_key = utils.make_key(node_tree)
+            self._material_tree[mat_key] = tree_key
+            self.tree_to_materials[tree_key].add(mat_key)
+
+            if tree_key not in self._tree_children:
+                self._index_tree(node_tree)
+
+    def _index_tree(self, node_tree):
+        tree_key = utils.make_key(node_tree)
+
+        for old_child_key in self._tree_children.get(tree_key, ()):
+            self.tree_to_parents[old_child_key].discard(tree_key)
+
+        children = set()
+        # Assign before recursing, protects against pointer loops
+        self._tree_children[tree_key] = children
+
+        for node in node_tree.nodes:
+            if node.bl_idname == "LuxCoreNodeTreePointer" and node.node_tree:
+                child_key = utils.make_key(node.node_tree)
+                children.add(child_key)
+                self.tree_to_parents[child_key].add(tree_key)
+
+                if child_key not in self._tree_children:
+                    self._index_tree(node.node_tree)
+
+    def _with_parent_trees(self, tree_keys):
+        """ Returns the tree keys plus the keys of all trees pointing to them (recursively) """
+        result = set(tree_keys)
+        stack = list(tree_keys)
+
+        while stack:
+            for parent_key in self.tree_to_parents.get(stack.pop(), ()):
+                if parent_key not in result:
+                    result.add(parent_key)
+                    stack.append(parent_key)
+
+        return result
+
+    def _material_from_key(self, mat_key):
+        mat = bpy.data.materials.get(self._material_names.get(mat_key, ""))
+
+        if mat and utils.make_key(mat) == mat_key:
+            return mat
+
+        # The material was renamed (or deleted), fall back to a full search
+        for mat in bpy.data.materials:
+            if utils.make_key(mat) == mat_key:
+                self._material_names[mat_key] = mat.name
+                return mat
+        return None
+
 
 class VisibilityCache(object):
     def __init__(self):
-        # sets containing keys
+        # {memory address: object} of the objects that were visible during the last diff
         self.last_visible_objects = None
+        # Set of keys (see utils.make_key()) of the objects that were hidden
         self.objects_to_remove = None
+        # List of the objects that became visible
         self.objects_to_add = None
 
     def diff(self, context):
@@ -124,14 +276,18 @@ class VisibilityCache(object):
             self.last_visible_objects = visible_objs
             return False
 
-        self.objects_to_remove = self.last_visible_objects - visible_objs
-        self.objects_to_add = visible_objs - self.last_visible_objects
+        # Integer comparisons only, the work afterwards is proportional to the number of changed objects
+        removed = self.last_visible_objects.keys() - visible_objs.keys()
+        added = visible_objs.keys() - self.last_visible_objects.keys()
+
+        # Note: we must not access the removed objects, they might have been deleted
+        self.objects_to_remove = {utils.make_key_from_pointer(pointer) for pointer in removed}
+        self.objects_to_add = [visible_objs[pointer] for pointer in added]
         self.last_visible_objects = visible_objs
         return self.objects_to_remove or self.objects_to_add
 
     def _get_visible_objects(self, context):
-        as_keylist = [utils.make_key(obj) for obj in context.visible_objects]
-        return set(as_keylist)
+        return {obj.as_pointer(): obj for obj in context.visible_objects}
 
 
 class WorldCache(object):
@@ -1,19 +1,24 @@
+import numpy
 from ..bin import pyluxcore
 from .. import utils
-from . import blender_object
+from . import blender_object, motion_blur
+from ..utils.profiler import Profiler
 from time import time
 from array import array
 
 
 class Duplis:
-    def __init__(self, exported_obj, matrix):
+    def __init__(self, exported_obj):
         self.exported_obj = exported_obj
-        self.matrices = matrix
-        self.count = 1
+        # Indices into the dupli_list of the duplicator
+        self.indices = array("I")
 
-    def add(self, matrix):
-        self.matrices += matrix
-        self.count += 1
+    def add(self, index):
+        self.indices.append(index)
+
+    @property
+    def count(self):
+        return len(self.indices)
 
 
 def convert(exporter, duplicator, scene, context, luxcore_scene, engine=None):
@@ -37,28 +42,25 @@ def convert(exporter, duplicator, scene, context, luxcore_scene, engine=None):
 
         name_prefix = utils.get_luxcore_name(duplicator, context)
         exported_duplis = {}
-        non_invertible_count = 0
 
         dupli_count = len(duplicator.dupli_list)
+        # Fetch all matrices at once instead of creating a mathutils.Matrix for each dupli
+        matrices, non_invertible_count = _get_dupli_matrices(duplicator.dupli_list, scene)
+
         for i, dupli in enumerate(duplicator.dupli_list):
             # Metaballs are omitted from this loop, they cause glitches.
             if dupli.object.type == "META":
                 continue
 
-            if dupli.matrix.determinant() == 0:
-                # We can handle non-invertible matrices (a small epsilon is added)
-                # but warn the user later because it's a sign of trouble
-                non_invertible_count += 1
-
             # Use the utils functions to build names so linked objects work (libraries)
             name = name_prefix + utils.get_luxcore_name(dupli.object, context)
-            matrix_list = utils.matrix_to_list(dupli.matrix, scene, apply_worldscale=True)
 
             if dupli.object.type == "LAMP" and not dupli.object.data.type == "AREA":
                 # It is a light
                 name_suffix = _get_name_suffix(name_prefix, dupli, context)
                 light_props, exported_light = blender_object.convert(exporter, dupli.object, scene, context, luxcore_scene,
                                                                      update_mesh=True, dupli_suffix=name_suffix)
+                matrix_list = matrices[i].tolist()
                 for luxcore_name in exported_light.luxcore_names:
                     key = "scene.lights." + luxcore_name + ".transformation"
                     light_props.Set(pyluxcore.Property(key, matrix_list))
@@ -68,7 +70,7 @@ def convert(exporter, duplicator, scene, context, luxcore_scene, engine=None):
                 # It is an object or area light
                 try:
                     # Already exported, just update the Duplis info
-                    exported_duplis[name].add(matrix_list)
+                    exported_duplis[name].add(i)
                 except KeyError:
                     # Not yet exported
                     name_suffix = _get_name_suffix(name_prefix, dupli, context)
@@ -76,7 +78,8 @@ def convert(exporter, duplicator, scene, context, luxcore_scene, engine=None):
                                                                      luxcore_scene, update_mesh=True,
                                                                      dupli_suffix=name_suffix, duplicator=duplicator)
                     dupli_props.Set(obj_props)
-                    exported_duplis[name] = Duplis(exported_obj, matrix_list)
+                    exported_duplis[name] = Duplis(exported_obj)
+                    exported_duplis[name].add(i)
 
             # Report progress and check if user wants to cancel export
             # Note: in viewport render we can't do all this, so we don't pass the engine there
@@ -96,31 +99,48 @@ def convert(exporter, duplicator, scene, context, luxcore_scene, engine=None):
             scene.luxcore.errorlog.add_warning(msg)
 
         duplicator.dupli_list_clear()
+
+        step_matrices = None
+        if exported_duplis and _use_dupli_motion_blur(duplicator, scene):
+            step_matrices, frame_offsets = _get_step_matrices(duplicator, scene, mode, dupli_count)
+
         # Need to parse so we have the dupli objects available for DuplicateObject
-        luxcore_scene.Parse(dupli_props)
+        with Profiler.section("Parse", "Duplis"):
+            luxcore_scene.Parse(dupli_props)
 
         for duplis in exported_duplis.values():
             # exported_obj sometimes is None, e.g. when instancing a group using an empty
             exported_obj = duplis.exported_obj
 
-            if exported_obj:
-                # exported_objects should only contain instances of ExportedObject
-                assert isinstance(exported_obj, utils.ExportedObject)
+            if not exported_obj:
+                continue
 
-                # Objects might be split if they have multiple materials
-                for src_name in exported_obj.luxcore_names:
-                    dst_name = src_name + "dupli"
-                    count = duplis.count
-                    transformations = array("f", duplis.matrices)
-                    luxcore_scene.DuplicateObject(src_name, dst_name, count, transformations)
+            # exported_objects should only contain instances of ExportedObject
+            assert isinstance(exported_obj, utils.ExportedObject)
 
-                    # TODO: support steps and times (motion blur)
-                    # steps = 0 # TODO
-                    # times = array("f", [])
-                    # luxcore_scene.DuplicateObject(src_name, dst_name, count, steps, times, transformations)
+            count = duplis.count
+            indices = numpy.frombuffer(duplis.indices, dtype=numpy.uintc)
 
-                    # Delete the object we used for duplication, we don't want it to show up in the scene
-                    luxcore_scene.DeleteObject(src_name)
+            if step_matrices is None:
+                # Fancy indexing returns a contiguous copy that can be passed to LuxCore directly
+                transformations = matrices[indices]
+            else:
+                steps = len(frame_offsets)
+                # LuxCore expects the steps of each dupli to be consecutive
+                transformations = numpy.ascontiguousarray(step_matrices[:, indices].transpose(1, 0, 2))
+                times = numpy.tile(numpy.array(frame_offsets, dtype=numpy.float32), count)
+
+            # Objects might be split if they have multiple materials
+            for src_name in exported_obj.luxcore_names:
+                dst_name = src_name + "dupli"
+
+                if step_matrices is None:
+                    luxcore_scene.DuplicateObject(src_name, dst_name, count, transformations)
+                else:
+                    luxcore_scene.DuplicateObject(src_name, dst_name, count, steps, times, transformations)
+
+                # Delete the object we used for duplication, we don't want it to show up in the scene
+                luxcore_scene.DeleteObject(src_name)
 
         print("Dupli export took %.3f s" % (time() - start))
     except Exception as error:
@@ -135,3 +155,61 @@ def _get_name_suffix(name_prefix, dupli, context):
     if dupli.particle_system:
         name_suffix += utils.get_luxcore_name(dupli.particle_system, context)
     return name_suffix
+
+
+def _get_dupli_matrices(dupli_list, scene):
+    """
+    Returns the world scaled matrices of all duplis as float32 array of shape (len(dupli_list), 16)
+    and the number of non-invertible matrices
+    """
+    matrices = utils.get_matrices(dupli_list, "matrix")
+    return utils.matrices_to_array(matrices, scene, apply_worldscale=True)
+
+
+def _use_dupli_motion_blur(duplicator, scene):
+    if not utils.use_obj_motion_blur(duplicator, scene):
+        return False
+
+    blur_settings = scene.camera.data.luxcore.motion_blur
+    return blur_settings.shutter > 0
+
+
+def _get_step_matrices(duplicator, scene, mode, dupli_count):
+    """
+    Returns the dupli matrices of each motion blur step as array of shape (steps, dupli_count, 16)
+    and the frame offsets of the steps.
+    The array is None if the duplis do not move or if their number changes during the shutter interval.
+    """
+    blur_settings = scene.camera.data.luxcore.motion_blur
+    steps = blur_settings.steps
+    frame_offsets = motion_blur.calc_frame_offsets(blur_settings.shutter, steps)
+    step_matrices = numpy.empty((steps, dupli_count, 16), dtype=numpy.float32)
+
+    frame_center = scene.frame_current
+    subframe_center = scene.frame_subframe
+
+    try:
+        for step in range(steps):
+            motion_blur.frame_set_offset(scene, frame_center, subframe_center, frame_offsets[step])
+            duplicator.dupli_list_create(scene, settings=mode)
+
+            try:
+                if len(duplicator.dupli_list) != dupli_count:
+                    # Particles were born or died, we can't match the matrices of the steps
+                    msg = ('Duplicator "%s": Number of duplis changes during the shutter interval, '
+                           'no motion blur for the duplis' % duplicator.name)
+                    scene.luxcore.errorlog.add_warning(msg)
+                    return None, frame_offsets
+
+                step_matrices[step], _ = _get_dupli_matrices(duplicator.dupli_list, scene)
+            finally:
+                duplicator.dupli_list_clear()
+    finally:
+        # Restore original frame
+        scene.frame_set(frame_center, subframe_center)
+
+    if (step_matrices == step_matrices[0]).all():
+        # The duplis do not move
+        return None, frame_offsets
+
+    return step_matrices, frame_offsets
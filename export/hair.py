@@ -1,9 +1,22 @@
 import bpy
+import hashlib
+import os
+from mathutils import Matrix
 from ..bin import pyluxcore
 from . import material
+from .mesh_cache import MeshCache, hash_collection, hash_mesh, hash_modifier
 from .. import utils
 from time import time
 import math
+import numpy
+
+# Number of strands whose points are fetched between two progress updates
+CHUNK_SIZE = 1000
+# How deep nested structs (e.g. the LuxCore hair settings) are followed in _hash_struct()
+MAX_HASH_DEPTH = 3
+# DefineStrands() orients ribbons towards the camera and adaptive tessellation
+# subdivides more close to the camera, so these strands depend on the camera position
+CAMERA_DEPENDENT_TESSELTYPES = {"ribbon", "ribbonadaptive", "solidadaptive"}
 
 
 def convert_hair(exporter, blender_obj, psys, luxcore_scene, scene, context=None, engine=None):
@@ -34,183 +47,40 @@ def convert_hair(exporter, blender_obj, psys, luxcore_scene, scene, context=None
         print("[%s: %s] Exporting hair" % (blender_obj.name, psys.name))
         start_time = time()
 
-        settings = psys.settings.luxcore.hair
-
-        hair_size = settings.hair_size
-        root_width = settings.root_width / 100
-        tip_width = settings.tip_width / 100
-        width_offset = settings.width_offset / 100
-
-        steps = 2 ** psys.settings.draw_step
+        luxcore_shape_name = utils.get_luxcore_name(blender_obj, context) + "_" + utils.get_luxcore_name(psys)
+        strandsProps = pyluxcore.Properties()
 
         if not context:
             psys.set_resolution(scene, blender_obj, "RENDER")
-            steps = 2 ** psys.settings.render_step
-
-        num_parents = len(psys.particles)
-        num_children = len(psys.child_particles)
-
-        if num_children == 0:
-            start = 0
-        else:
-            # Number of virtual parents reduces the number of exported children
-            num_virtual_parents = math.trunc(
-                0.3 * psys.settings.virtual_parents * psys.settings.child_nbr * num_parents)
-            start = num_parents + num_virtual_parents
-
-        segments = []
-        points = []
-        thickness = []
-        colors = []
-        uv_coords = []
-        total_segments_count = 0
-        has_vertex_colors = False
-        colorflag = False
-        uvflag = False
-        image_width = 0
-        image_height = 0
-        image_pixels = []
-        image_valid = False
 
-        if settings.export_color != "none":
-            modifier_mode = "PREVIEW" if context else "RENDER"
-            mesh = blender_obj.to_mesh(scene, True, modifier_mode)
-            uv_textures = mesh.tessface_uv_textures
-            vertex_color = mesh.tessface_vertex_colors
-
-            has_vertex_colors = vertex_color.active and vertex_color.active.data
-            has_uv_texture = uv_textures.active and uv_textures.active.data
-
-            if settings.export_color == "vertex_color" and has_vertex_colors:
-                colorflag = True
-
-            if settings.export_color == "uv_texture_map":
-                if has_uv_texture:
-                    uv_tex = uv_textures.active.data
-                    image = uv_tex[0].image
-                    if image:
-                        image_width = image.size[0]
-                        image_height = image.size[1]
-                        image_pixels = image.pixels[:]
-                        image_valid = len(image_pixels)
-                        colorflag = True
-                    uvflag = True
-
-        transform = blender_obj.matrix_world.inverted()
-        total_strand_count = 0
-
-        if root_width == tip_width:
-            thicknessflag = 0
-            hair_size *= root_width
-        else:
-            thicknessflag = 1
-
-        dupli_count = num_parents + num_children
-        i = 0
-
-        for pindex in range(start, dupli_count):
-            if num_children == 0:
-                i = pindex
-
-            # Make it possible to interrupt the export process
-            if engine and pindex % 1000 == 0:
-                progress = (pindex / dupli_count) * 100
-                engine.update_stats("Export", "Object: %s (Hair Particles: %d%%)" % (blender_obj.name, progress))
-
-                if engine.test_break():
+        try:
+            # A final render uses a new exporter, so without the mesh cache the key would never be used
+            if context or MeshCache.active:
+                cache_key = get_cache_key(blender_obj, psys, scene, context)
+            else:
+                cache_key = None
+
+            if cache_key and exporter.hair_shape_keys.get(luxcore_shape_name) == cache_key:
+                # The strands did not change (e.g. the emitter was only moved), we only update the object
+                print("[%s: %s] Using cached strands" % (blender_obj.name, psys.name))
+            elif cache_key and MeshCache.active and MeshCache.load(cache_key, luxcore_shape_name,
+                                                                    strandsProps, shape_prefix=""):
+                print("[%s: %s] Using strands from mesh cache" % (blender_obj.name, psys.name))
+            else:
+                if not _define_strands(exporter, blender_obj, psys, mod, luxcore_shape_name, luxcore_scene,
+                                       scene, context, engine):
+                    # Export was cancelled
                     return
 
-            # A small optimization in order to speedup the export
-            # process: cache the uv_co and color value
-            uv_co = None
-            col = None
-            seg_length = 1.0
-            point_count = 0
-
-            for step in range(0, steps+1):
-                co = psys.co_hair(blender_obj, pindex, step)
-                if step > 0 and points:
-                    seg_length = (co - blender_obj.matrix_world * points[-1]).length_squared
-
-                if not (co.length_squared == 0 or seg_length == 0):
-                    points.append(transform * co)
-
-                    if thicknessflag:
-                        if step > steps * width_offset:
-                            thick = (root_width * (steps - step - 1) + tip_width * (
-                                        step - steps * width_offset)) / (
-                                        steps * (1 - width_offset) - 1)
-                        else:
-                            thick = root_width
-
-                        thickness.append(thick * hair_size)
-
-                    point_count += 1
-
-                    if settings.export_color == 'uv_texture_map' and image_valid:
-                        if uvflag:
-                            if not uv_co:
-                                uv_co = psys.uv_on_emitter(mod, psys.particles[i], pindex, uv_textures.active_index)
-
-                            uv_coords.append(uv_co)
-                        if not col:
-                            x_co = round(uv_co[0] * (image_width - 1))
-                            y_co = round(uv_co[1] * (image_height - 1))
-
-                            pixelnumber = (image_width * y_co) + x_co
-
-                            r = image_pixels[pixelnumber * 4]
-                            g = image_pixels[pixelnumber * 4 + 1]
-                            b = image_pixels[pixelnumber * 4 + 2]
-                            col = (r, g, b)
-
-                        colors.append(col)
-                    elif settings.export_color == "vertex_color" and has_vertex_colors:
-                        if not col:
-                            col = psys.mcol_on_emitter(mod, psys.particles[i], pindex, vertex_color.active_index)
-
-                        colors.append(col)
-
-            if point_count == 1:
-                points.pop()
-
-                if thicknessflag:
-                    thickness.pop()
-                point_count -= 1
-            elif point_count > 1:
-                segments.append(point_count - 1)
-                total_strand_count += 1
-                total_segments_count = total_segments_count + point_count - 1
-
-        if settings.export_color != "none":
-            # Delete the temporary mesh we had to create
-            bpy.data.meshes.remove(mesh, do_unlink=False)
-
-        # LuxCore needs tuples, not vectors
-        points_as_tuples = [tuple(point) for point in points]
+                if cache_key and MeshCache.active:
+                    MeshCache.store(cache_key, luxcore_shape_name, [[luxcore_shape_name, 0]],
+                                    luxcore_scene, shape_prefix="")
+        finally:
+            if not context:
+                # Resolution was changed to "RENDER" for final renders, change it back
+                psys.set_resolution(scene, blender_obj, "PREVIEW")
 
-        if not thicknessflag:
-            thickness = hair_size
-
-        if not colorflag:
-            colors = (1.0, 1.0, 1.0)
-
-        if not uvflag:
-            uvs_as_tuples = None
-        else:
-            # LuxCore needs tuples, not vectors
-            uvs_as_tuples = [tuple(uv) for uv in uv_coords]
-
-        luxcore_shape_name = utils.get_luxcore_name(blender_obj, context) + "_" + utils.get_luxcore_name(psys)
-
-        if engine:
-            engine.update_stats('Exporting...', 'Refining Hair System %s' % psys.name)
-        # Documentation: http://www.luxrender.net/forum/viewtopic.php?f=8&t=12116&sid=03a16c5c345db3ee0f8126f28f1063c8#p112819
-
-        luxcore_scene.DefineStrands(luxcore_shape_name, total_strand_count, len(points), points_as_tuples, segments,
-                                    thickness, 0.0, colors, uvs_as_tuples,
-                                    settings.tesseltype, settings.adaptive_maxdepth, settings.adaptive_error,
-                                    settings.solid_sidecount, settings.solid_capbottom, settings.solid_captop, True)
+        exporter.hair_shape_keys[luxcore_shape_name] = cache_key
 
         # For some reason this index is not starting at 0 but at 1 (Blender is strange)
         material_index = psys.settings.material - 1
@@ -229,8 +99,6 @@ def convert_hair(exporter, blender_obj, psys, luxcore_scene, scene, context=None
                 print('WARNING: material slot %d on object "%s" is unassigned!' % (material_index + 1, blender_obj.name))
 
         # Convert material
-        strandsProps = pyluxcore.Properties()
-
         lux_mat_name, mat_props = material.convert(exporter, mat, scene, context)
         strandsProps.Set(mat_props)
 
@@ -249,10 +117,6 @@ def convert_hair(exporter, blender_obj, psys, luxcore_scene, scene, context=None
 
         luxcore_scene.Parse(strandsProps)
 
-        if not context:
-            # Resolution was changed to "RENDER" for final renders, change it back
-            psys.set_resolution(scene, blender_obj, "PREVIEW")
-
         time_elapsed = time() - start_time
         print("[%s: %s] Hair export finished (%.3f s)" % (blender_obj.name, psys.name, time_elapsed))
     except Exception as error:
@@ -260,3 +124,368 @@ def convert_hair(exporter, blender_obj, psys, luxcore_scene, scene, context=None
         scene.luxcore.errorlog.add_warning(msg)
         import traceback
         traceback.print_exc()
+
+
+def get_cache_key(blender_obj, psys, scene, context):
+    """
+    Returns a key that changes if the tessellated strands change, or None if we can't tell
+    (e.g. the emitter is deformed by another object or the hair is simulated).
+    The object transformation is only part of the key if the tessellation depends on the
+    camera position, otherwise it does not matter because the strands are defined in object space.
+    """
+    settings = psys.settings
+
+    if blender_obj.type != "MESH" or psys.use_hair_dynamics:
+        return None
+
+    if any(slot and slot.texture for slot in settings.texture_slots):
+        # Textures can influence e.g. the child length, we can't track their changes
+        return None
+
+    modifier_mode = "PREVIEW" if context else "RENDER"
+    md5 = hashlib.md5()
+    md5.update(modifier_mode.encode())
+    # Particle system, particle settings (including the tessellation settings in luxcore.hair)
+    _hash_struct(md5, psys, skip={"point_cache", "cloth"})
+    _hash_struct(md5, settings)
+
+    if settings.luxcore.hair.tesseltype in CAMERA_DEPENDENT_TESSELTYPES:
+        camera_position = _get_camera_position(scene, context)
+        if camera_position is None:
+            return None
+        md5.update(repr((tuple(camera_position), [tuple(row) for row in blender_obj.matrix_world])).encode())
+
+    # The emitter mesh with its modifiers defines where the hair grows.
+    # Vertex group weights can control e.g. the density and length of the hair.
+    if not hash_mesh(md5, blender_obj.data, bool(blender_obj.vertex_groups)):
+        return None
+
+    for mod in blender_obj.modifiers:
+        if not hash_modifier(md5, mod, modifier_mode, scene):
+            return None
+
+    # The groom (edited parent hair)
+    for particle in psys.particles:
+        hash_collection(md5, particle.hair_keys, "co", "f", 3)
+
+    if settings.luxcore.hair.export_color == "uv_texture_map":
+        image_key = _get_image_key(blender_obj.data)
+        if image_key is None:
+            return None
+        md5.update(image_key.encode())
+
+    return md5.hexdigest()
+
+
+def _get_camera_position(scene, context):
+    """ The position of the camera that LuxCore uses to tessellate the strands (world space) """
+    if context and context.region_data.view_perspective != "CAMERA":
+        # Viewport render without camera view
+        return Matrix(context.region_data.view_matrix).inverted().translation
+    if scene.camera:
+        return scene.camera.matrix_world.translation
+    return None
+
+
+def _hash_struct(md5, struct, skip=(), depth=0):
+    for prop in struct.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier == "rna_type" or identifier in skip or prop.type == "COLLECTION":
+            continue
+
+        value = getattr(struct, identifier)
+
+        if prop.type == "POINTER":
+            if isinstance(value, bpy.types.ID):
+                value = value.name
+            elif value is not None:
+                if depth < MAX_HASH_DEPTH:
+                    _hash_struct(md5, value, depth=depth + 1)
+                continue
+        elif getattr(prop, "is_array", False):
+            value = tuple(value)
+
+        md5.update(repr((identifier, value)).encode())
+
+
+def _get_image_key(mesh):
+    """ Identifies the pixels of the image used for the hair colors, None if they can't be tracked """
+    uv_texture = mesh.uv_textures.active
+    image = uv_texture.data[0].image if uv_texture and uv_texture.data else None
+
+    if image is None:
+        return ""
+
+    if image.source != "FILE" or image.packed_file or image.is_dirty:
+        # Pixels were changed in Blender
+        return None
+
+    try:
+        mtime = os.path.getmtime(bpy.path.abspath(image.filepath, library=image.library))
+    except OSError:
+        return None
+
+    return "%s %f" % (image.filepath, mtime)
+
+
+def _define_strands(exporter, blender_obj, psys, mod, luxcore_shape_name, luxcore_scene, scene, context, engine):
+    """ Returns False if the export was cancelled """
+    settings = psys.settings.luxcore.hair
+
+    hair_size = settings.hair_size
+    root_width = settings.root_width / 100
+    tip_width = settings.tip_width / 100
+    width_offset = settings.width_offset / 100
+
+    steps = 2 ** psys.settings.draw_step
+
+    if not context:
+        steps = 2 ** psys.settings.render_step
+
+    num_parents = len(psys.particles)
+    num_children = len(psys.child_particles)
+
+    if num_children == 0:
+        start = 0
+    else:
+        # Number of virtual parents reduces the number of exported children
+        num_virtual_parents = math.trunc(
+            0.3 * psys.settings.virtual_parents * psys.settings.child_nbr * num_parents)
+        start = num_parents + num_virtual_parents
+
+    has_vertex_colors = False
+    colorflag = False
+    uvflag = False
+    image = None
+
+    if settings.export_color != "none":
+        modifier_mode = "PREVIEW" if context else "RENDER"
+        mesh = blender_obj.to_mesh(scene, True, modifier_mode)
+        uv_textures = mesh.tessface_uv_textures
+        vertex_color = mesh.tessface_vertex_colors
+
+        has_vertex_colors = vertex_color.active and vertex_color.active.data
+        has_uv_texture = uv_textures.active and uv_textures.active.data
+
+        if settings.export_color == "vertex_color" and has_vertex_colors:
+            colorflag = True
+
+        if settings.export_color == "uv_texture_map":
+            if has_uv_texture:
+                uv_tex = uv_textures.active.data
+                image = uv_tex[0].image
+                if image and len(image.pixels):
+                    colorflag = True
+                uvflag = True
+
+    if root_width == tip_width:
+        thicknessflag = 0
+        hair_size *= root_width
+    else:
+        thicknessflag = 1
+
+    dupli_count = num_parents + num_children
+    coords = _get_hair_coords(blender_obj, psys, start, dupli_count, steps, engine)
+
+    if coords is None:
+        # Export was cancelled
+        if settings.export_color != "none":
+            bpy.data.meshes.remove(mesh, do_unlink=False)
+        return False
+
+    if thicknessflag:
+        step_thickness = _get_step_thickness(steps, root_width, tip_width, width_offset) * hair_size
+    else:
+        step_thickness = None
+
+    # The points are exported in object space
+    transform = numpy.array(blender_obj.matrix_world.inverted(), dtype=numpy.float32)
+    points, segments, exported, thickness = build_strands(coords, transform, step_thickness)
+    # Indices of the particles that are exported as strands
+    exported_pindices = numpy.flatnonzero(exported) + start
+    # Each strand has the color and uv of its root
+    points_per_strand = segments + 1
+
+    uv_coords = None
+    colors = None
+
+    if uvflag:
+        uv_index = uv_textures.active_index
+        strand_uvs = [psys.uv_on_emitter(mod, psys.particles[_get_parent_index(pindex, num_children)],
+                                         pindex, uv_index)
+                      for pindex in exported_pindices.tolist()]
+        strand_uvs = numpy.array(strand_uvs, dtype=numpy.float32).reshape(-1, 2)
+        uv_coords = numpy.repeat(strand_uvs, points_per_strand, axis=0)
+
+        if colorflag:
+            strand_colors = sample_image_bilinear(_get_image_pixels(exporter, image), strand_uvs)
+            colors = numpy.repeat(strand_colors, points_per_strand, axis=0)
+    elif colorflag:
+        color_index = vertex_color.active_index
+        strand_colors = [psys.mcol_on_emitter(mod, psys.particles[_get_parent_index(pindex, num_children)],
+                                              pindex, color_index)
+                         for pindex in exported_pindices.tolist()]
+        strand_colors = numpy.array(strand_colors, dtype=numpy.float32).reshape(-1, 3)
+        colors = numpy.repeat(strand_colors, points_per_strand, axis=0)
+
+    if settings.export_color != "none":
+        # Delete the temporary mesh we had to create
+        bpy.data.meshes.remove(mesh, do_unlink=False)
+
+    total_strand_count = len(segments)
+    # This pyluxcore version expects lists of tuples, the conversion is done once for all points
+    points_as_tuples = _to_tuples(points)
+    segments = segments.tolist()
+
+    if thicknessflag:
+        thickness = thickness.tolist()
+    else:
+        thickness = hair_size
+
+    if colorflag:
+        colors = _to_tuples(colors)
+    else:
+        colors = (1.0, 1.0, 1.0)
+
+    if not uvflag:
+        uvs_as_tuples = None
+    else:
+        uvs_as_tuples = _to_tuples(uv_coords)
+
+    if engine:
+        engine.update_stats('Exporting...', 'Refining Hair System %s' % psys.name)
+    # Documentation: http://www.luxrender.net/forum/viewtopic.php?f=8&t=12116&sid=03a16c5c345db3ee0f8126f28f1063c8#p112819
+
+    luxcore_scene.DefineStrands(luxcore_shape_name, total_strand_count, len(points_as_tuples),
+                                points_as_tuples, segments,
+                                thickness, 0.0, colors, uvs_as_tuples,
+                                settings.tesseltype, settings.adaptive_maxdepth, settings.adaptive_error,
+                                settings.solid_sidecount, settings.solid_capbottom, settings.solid_captop, True)
+    return True
+
+
+def build_strands(coords, transform, step_thickness=None):
+    """
+    Filters and transforms the hair points of all strands at once.
+    coords: float32 array of shape (strands, steps + 1, 3) with the hair points in world space
+    transform: 4x4 matrix (row-major) that is applied to the points
+    step_thickness: array with the thickness at each step, or None
+    Returns the points as array of shape (N, 3), the segment count of each exported strand,
+    a boolean array that marks the exported strands, and the thickness of each point (or None)
+    """
+    # Points at the origin are invalid (e.g. unborn particles), as well as points that
+    # coincide with the previous point (they would create segments of length 0)
+    valid = coords.any(axis=2)
+    valid[:, 1:] &= (coords[:, 1:] != coords[:, :-1]).any(axis=2)
+
+    # Strands with less than 2 points have no segments, they are skipped
+    point_counts = valid.sum(axis=1)
+    exported = point_counts > 1
+    valid &= exported[:, numpy.newaxis]
+    segments = point_counts[exported] - 1
+
+    # Row-major order of the mask keeps the points of each strand together
+    points = coords[valid]
+    transform = numpy.asarray(transform, dtype=numpy.float32)
+    points = points.dot(transform[:3, :3].T) + transform[:3, 3]
+
+    if step_thickness is None:
+        thickness = None
+    else:
+        thickness = numpy.broadcast_to(step_thickness, valid.shape)[valid]
+
+    return points, segments, exported, thickness
+
+
+def _get_hair_coords(blender_obj, psys, start, end, steps, engine):
+    """
+    Returns the world space points of the particles in range(start, end)
+    as float32 array of shape (end - start, steps + 1, 3), or None if the export was cancelled
+    """
+    # The Blender API has no bulk access for child hair, but we can avoid all other per-point work
+    co_hair = psys.co_hair
+    step_range = range(steps + 1)
+    coords = numpy.empty((max(end - start, 0), steps + 1, 3), dtype=numpy.float32)
+
+    for chunk_start in range(start, end, CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHUNK_SIZE, end)
+
+        # Make it possible to interrupt the export process
+        if engine:
+            progress = (chunk_start / end) * 100
+            engine.update_stats("Export", "Object: %s (Hair Particles: %d%%)" % (blender_obj.name, progress))
+
+            if engine.test_break():
+                return None
+
+        chunk = [co_hair(blender_obj, pindex, step) for pindex in range(chunk_start, chunk_end) for step in step_range]
+        coords[chunk_start - start:chunk_end - start] = numpy.array(chunk, dtype=numpy.float32).reshape(-1, steps + 1, 3)
+
+    return coords
+
+
+def _get_step_thickness(steps, root_width, tip_width, width_offset):
+    """ Returns the (unscaled) strand thickness at each step """
+    step = numpy.arange(steps + 1, dtype=numpy.float32)
+    taper = ((root_width * (steps - step - 1) + tip_width * (step - steps * width_offset))
+             / (steps * (1 - width_offset) - 1))
+    return numpy.where(step > steps * width_offset, taper, root_width).astype(numpy.float32)
+
+
+def _get_parent_index(pindex, num_children):
+    # Children use the first particle, like in the original export loop
+    return pindex if num_children == 0 else 0
+
+
+def _get_image_pixels(exporter, image):
+    """
+    Returns the pixels of the image as float32 array of shape (height, width, 4).
+    The array is cached, so hair systems using the same image only read it once per export.
+    """
+    key = utils.make_key(image)
+
+    try:
+        return exporter.hair_image_pixels[key]
+    except KeyError:
+        pass
+
+    width, height = image.size
+
+    if hasattr(image.pixels, "foreach_get"):
+        pixels = numpy.empty(width * height * 4, dtype=numpy.float32)
+        image.pixels.foreach_get(pixels)
+    else:
+        # Blender 2.79 has no bulk access, slicing at least avoids one API call per pixel
+        pixels = numpy.array(image.pixels[:], dtype=numpy.float32)
+
+    pixels.shape = (height, width, 4)
+    exporter.hair_image_pixels[key] = pixels
+    return pixels
+
+
+def sample_image_bilinear(pixels, uvs):
+    """
+    Returns the bilinearly interpolated RGB colors at the uv coordinates as array of shape (len(uvs), 3)
+    pixels: array of shape (height, width, channels), as returned by _get_image_pixels()
+    uvs: array of shape (N, 2)
+    """
+    height, width = pixels.shape[:2]
+    x = numpy.clip(uvs[:, 0] * (width - 1), 0, width - 1)
+    y = numpy.clip(uvs[:, 1] * (height - 1), 0, height - 1)
+
+    x0 = x.astype(numpy.intp)
+    y0 = y.astype(numpy.intp)
+    x1 = numpy.minimum(x0 + 1, width - 1)
+    y1 = numpy.minimum(y0 + 1, height - 1)
+    # Weights of the right/upper neighbours
+    fx = (x - x0)[:, numpy.newaxis]
+    fy = (y - y0)[:, numpy.newaxis]
+
+    rgb = pixels[:, :, :3]
+    bottom = rgb[y0, x0] * (1 - fx) + rgb[y0, x1] * fx
+    top = rgb[y1, x0] * (1 - fx) + rgb[y1, x1] * fx
+    return bottom * (1 - fy) + top * fy
+
+
+def _to_tuples(array):
+    return list(map(tuple, array.tolist()))
@@ -1,50 +1,81 @@
 import bpy
-import tempfile
+import hashlib
+import json
 import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue
+from time import time, sleep
 from .. import utils
+from ..utils import image_info
+
+INDEX_FILENAME = "index.json"
+DEFAULT_DIRNAME = "luxcore_image_cache"
+# Executed in separate Blender processes to downscale images
+RESIZE_SCRIPT = os.path.join(os.path.dirname(__file__), "resize_image.py")
+# Every resize job runs a complete Blender process that decodes the full image,
+# so only a few of them may run at the same time, otherwise we can run out of memory
+MAX_RESIZE_PROCESSES = 3
+# Formats that resize_image.py can write, other images are converted to PNG
+RESIZE_EXTENSIONS = {".bmp", ".exr", ".hdr", ".jpeg", ".jpg", ".png", ".tga", ".tif", ".tiff"}
 
 
 class ImageExporter(object):
     """
+    Saves packed and generated images to files that LuxCore can load.
+    The files are named after a hash of the image content, so an image is only saved once.
+    If the image cache is enabled in the addon preferences, the files are re-used across
+    Blender sessions, otherwise they are deleted when Blender exits.
+    Packed files are written by a worker thread and downscaled images are created by
+    a pool of Blender processes, call wait() before LuxCore loads them.
     This class is a singleton
     """
-    temp_images = {}
+    _cache_dir = ""
+    _persistent = False
+    _max_size = 0
+    _session_dir = ""
+    # {filename: {"size": bytes, "last_used": time}}
+    _index = None
+    _index_changed = False
 
-    @classmethod
-    def _save_to_temp_file(cls, image):
-        key = utils.make_key(image)
+    _queue = None
+    _thread = None
+    # Filenames that are not yet written by the worker thread
+    _pending = set()
+    _errors = []
 
-        if key in cls.temp_images:
-            # Image was already exported
-            temp_image = cls.temp_images[key]
-        else:
-            if image.filepath_raw:
-                _, extension = os.path.splitext(image.filepath_raw)
-            else:
-                # Generated images do not have a filepath, fallback to file_format
-                extension = "." + image.file_format.lower()
+    _resize_pool = None
+    # {filename: Future}
+    _resize_jobs = {}
 
-            temp_image = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
-            cls.temp_images[key] = temp_image
+    # Content hashes of the images exported in this session, see _get_content_hash()
+    # {image key: (image state, hash)}
+    _hashes = {}
 
-            print('Unpacking image "%s" to temp file "%s"' % (image.name, temp_image.name))
-            orig_filepath = image.filepath_raw
-            orig_source = image.source
-            image.filepath_raw = temp_image.name
-            image.save()
-            # This changes the source to "FILE", so we have to restore the original source
-            image.filepath_raw = orig_filepath
-            image.source = orig_source
+    @classmethod
+    def export(cls, image, max_size=0):
+        """
+        Returns the path of a file that LuxCore can load.
+        max_size: If > 0, a downscaled copy is used if the image is larger than this (in pixels)
+        """
+        filepath = cls._get_filepath(image)
 
-        return temp_image.name
+        if max_size > 0:
+            filepath = cls._get_resized(filepath, max_size)
+
+        return filepath
 
     @classmethod
-    def export(cls, image):
+    def _get_filepath(cls, image):
         if image.source == "GENERATED":
-            return cls._save_to_temp_file(image)
+            return cls._save_to_cache(image)
         elif image.source == "FILE":
             if image.packed_file:
-                return cls._save_to_temp_file(image)
+                return cls._save_to_cache(image)
             else:
                 try:
                     filepath = utils.get_abspath(image.filepath, library=image.library, must_exist=True, must_be_existing_file=True)
@@ -59,11 +90,349 @@ class ImageExporter(object):
         else:
             raise Exception('Unsupported image source "%s" in image "%s"' % (image.source, image.name))
 
+    @classmethod
+    def wait(cls, engine=None):
+        """ Blocks until all images are written and resized (can be called from any thread) """
+        jobs = list(cls._resize_jobs.values())
+
+        for index, job in enumerate(as_completed(jobs), start=1):
+            if engine:
+                engine.update_stats("Export", "Resizing images (%d/%d)" % (index, len(jobs)))
+
+        if cls._queue is not None:
+            cls._queue.join()
+
+        if cls._errors:
+            filename, error = cls._errors[0]
+            for failed_filename, _ in cls._errors:
+                cls._index.pop(failed_filename, None)
+            cls._errors = []
+            raise OSError('Could not write image cache file "%s" (%s)' % (filename, error))
+
+    @classmethod
+    def get_pending(cls):
+        """ Returns the filenames of the images that are not yet written or resized """
+        return cls._pending.copy()
+
+    @classmethod
+    def wait_for(cls, filenames):
+        """
+        Blocks until the images with these filenames are written and resized (can be called
+        from any thread). Unlike wait(), images exported later don't delay the caller.
+        """
+        for filename in filenames:
+            job = cls._resize_jobs.get(filename)
+            if job:
+                job.result()
+            while filename in cls._pending:
+                # Written by the worker thread
+                sleep(0.01)
+
+        for failed_filename, error in cls._errors:
+            if failed_filename in filenames:
+                # wait() removes the failed files from the index
+                raise OSError('Could not write image cache file "%s" (%s)' % (failed_filename, error))
+
+    @classmethod
+    def save_index(cls):
+        """ Evicts the least recently used files if the cache is too large and saves the index """
+        if not cls._index_changed:
+            return
+
+        cls._index_changed = False
+
+        for filename, job in list(cls._resize_jobs.items()):
+            if job.done():
+                del cls._resize_jobs[filename]
+                try:
+                    cls._index[filename]["size"] = os.path.getsize(cls._get_path(filename))
+                except (KeyError, OSError):
+                    cls._index.pop(filename, None)
+
+        if not cls._persistent:
+            return
+
+        cls._evict()
+        path = cls._get_path(INDEX_FILENAME)
+        tmp_path = path + ".tmp"
+
+        try:
+            with open(tmp_path, "w") as index_file:
+                json.dump(cls._index, index_file)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            print("[Image Cache] Could not save index:", error)
+
+    @classmethod
+    def clear(cls, context):
+        prefs = utils.get_addon_preferences(context)
+        cache_dir = cls._get_cache_dir(prefs)
+
+        if not os.path.isdir(cache_dir):
+            return
+
+        cls.wait()
+        index = cls._load_index(cache_dir)
+        for filename in list(index.keys()) + [INDEX_FILENAME]:
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except OSError:
+                pass
+
+        if cache_dir == cls._cache_dir:
+            cls._index = {}
+
     @classmethod
     def cleanup(cls):
-        for temp_image in cls.temp_images.values():
-            print("Deleting temporary image:", temp_image.name)
-            os.remove(temp_image.name)
+        try:
+            cls.wait()
+        except OSError as error:
+            print(error)
+        cls.save_index()
 
-        cls.temp_images = {}
+        if cls._session_dir:
+            print("Deleting temporary images:", cls._session_dir)
+            shutil.rmtree(cls._session_dir, ignore_errors=True)
+
+        cls._session_dir = ""
+        cls._cache_dir = ""
+        cls._index = None
+        cls._hashes = {}
+
+    @classmethod
+    def _save_to_cache(cls, image):
+        cls._init_cache()
+
+        if image.filepath_raw:
+            _, extension = os.path.splitext(image.filepath_raw)
+        else:
+            # Generated images do not have a filepath, fallback to file_format
+            extension = "." + image.file_format.lower()
+
+        content_hash = cls._get_content_hash(image)
+        filename = content_hash + extension
+        filepath = cls._get_path(filename)
+        entry = cls._index.get(filename)
+
+        if entry and (filename in cls._pending or os.path.isfile(filepath)):
+            # Image was already exported
+            entry["last_used"] = time()
+            cls._index_changed = True
+            return filepath
+
+        print('Saving image "%s" to cache file "%s"' % (image.name, filepath))
+
+        if image.packed_file and not image.is_dirty:
+            # The packed file contains the original image file, we don't need Blender to save it
+            data = image.packed_file.data
+            size = len(data)
+            cls._write_async(filename, filepath, data)
+        else:
+            orig_filepath = image.filepath_raw
+            orig_source = image.source
+            image.filepath_raw = filepath
+            image.save()
+            # This changes the source to "FILE", so we have to restore the original source
+            image.filepath_raw = orig_filepath
+            image.source = orig_source
+            size = os.path.getsize(filepath)
+            # Saving clears is_dirty, the pixels in memory are now the ones we just hashed
+            cls._hashes[utils.make_key(image)] = (cls._get_state(image), content_hash)
+
+        cls._index[filename] = {"size": size, "last_used": time()}
+        cls._index_changed = True
+        return filepath
+
+    @classmethod
+    def _get_resized(cls, filepath, max_size):
+        if os.path.basename(filepath) in cls._pending:
+            # The packed file is still being written, we need it to read the resolution
+            cls.wait()
+
+        info = image_info.read(filepath)
+        if info is None or max(info.width, info.height) <= max_size:
+            return filepath
+
+        cls._init_cache()
+        stat = os.stat(filepath)
+        md5 = hashlib.md5()
+        md5.update(repr((filepath, stat.st_mtime, stat.st_size, max_size)).encode())
+
+        _, extension = os.path.splitext(filepath)
+        if extension.lower() not in RESIZE_EXTENSIONS:
+            extension = ".png"
+
+        filename = md5.hexdigest() + extension
+        resized_path = cls._get_path(filename)
+        entry = cls._index.get(filename)
+        cls._index_changed = True
+
+        if entry and (filename in cls._pending or os.path.isfile(resized_path)):
+            entry["last_used"] = time()
+            return resized_path
+
+        print('Resizing image "%s" (%d x %d) to max. %d pixels' % (filepath, info.width, info.height, max_size))
+
+        if cls._resize_pool is None:
+            cls._resize_pool = ThreadPoolExecutor(max_workers=min(MAX_RESIZE_PROCESSES, os.cpu_count() or 1))
+
+        cls._pending.add(filename)
+        cls._resize_jobs[filename] = cls._resize_pool.submit(cls._resize, bpy.app.binary_path,
+                                                             filepath, resized_path, max_size)
+        # The size is filled in when the file was written, see save_index()
+        cls._index[filename] = {"size": 0, "last_used": time()}
+        return resized_path
+
+    @classmethod
+    def _resize(cls, blender_path, filepath, resized_path, max_size):
+        """ Runs in the resize pool, every job starts its own Blender process """
+        base, extension = os.path.splitext(resized_path)
+        tmp_path = base + ".tmp" + extension
+        command = [
+            blender_path, "-b", "--factory-startup", "-noaudio", "--python-exit-code", "1",
+            "--python", RESIZE_SCRIPT, "--", filepath, tmp_path, str(max_size),
+        ]
+
+        try:
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            os.replace(tmp_path, resized_path)
+        except (OSError, subprocess.CalledProcessError) as error:
+            print('[Image Cache] Could not resize image "%s": %s' % (filepath, error))
+            # The exported properties already point to the resized file, so use the original image
+            try:
+                shutil.copyfile(filepath, resized_path)
+            except OSError as copy_error:
+                cls._errors.append((os.path.basename(resized_path), copy_error))
+        finally:
+            cls._pending.discard(os.path.basename(resized_path))
+
+    @classmethod
+    def _get_content_hash(cls, image):
+        """
+        Hashes the packed file or the pixels of the image. The result is re-used
+        as long as the image state does not change, except for painted images
+        (painting does not change anything we could check cheaply).
+        """
+        key = utils.make_key(image)
+        state = cls._get_state(image)
+
+        if not image.is_dirty:
+            cached = cls._hashes.get(key)
+            if cached and cached[0] == state:
+                return cached[1]
+
+        md5 = hashlib.md5()
+
+        if image.packed_file and not image.is_dirty:
+            # The packed file contains the original image file
+            md5.update(image.packed_file.data)
+        else:
+            # Painted or generated image, only the pixels in memory are up to date.
+            # Never use the generator settings, painting does not change them.
+            md5.update(repr((tuple(image.size), image.file_format)).encode())
+            md5.update(array("f", image.pixels[:]).tobytes())
+
+        content_hash = md5.hexdigest()
+        if not image.is_dirty:
+            cls._hashes[key] = (state, content_hash)
+        return content_hash
+
+    @classmethod
+    def _get_state(cls, image):
+        """ Cheap to compute properties that change when the content of a not painted image changes """
+        packed_file = image.packed_file
+        # A new packed file (e.g. after a reload) is a new struct, even if the size is the same
+        packed_state = (packed_file.as_pointer(), packed_file.size) if packed_file else None
+        generated_state = (image.generated_type, image.generated_width, image.generated_height,
+                           tuple(image.generated_color), image.use_generated_float)
+        return (image.source, tuple(image.size), image.file_format, packed_state, generated_state)
+
+    @classmethod
+    def _init_cache(cls):
+        prefs = utils.get_addon_preferences(bpy.context)
+        persistent = prefs.use_image_cache
+
+        if persistent:
+            cache_dir = cls._get_cache_dir(prefs)
+        else:
+            if not cls._session_dir:
+                cls._session_dir = tempfile.mkdtemp(prefix="luxcore_images_")
+            cache_dir = cls._session_dir
+
+        cls._max_size = prefs.image_cache_size * 1024 * 1024
+
+        if cache_dir == cls._cache_dir and cls._index is not None:
+            return
+
+        # The cache directory changed (or this is the first export), switch to the new one
+        cls.save_index()
+        os.makedirs(cache_dir, exist_ok=True)
+        cls._cache_dir = cache_dir
+        cls._persistent = persistent
+        cls._index = cls._load_index(cache_dir) if persistent else {}
+
+    @classmethod
+    def _get_cache_dir(cls, prefs):
+        if prefs.image_cache_dir:
+            return bpy.path.abspath(prefs.image_cache_dir)
+        return os.path.join(tempfile.gettempdir(), DEFAULT_DIRNAME)
+
+    @classmethod
+    def _get_path(cls, filename):
+        return os.path.join(cls._cache_dir, filename)
+
+    @classmethod
+    def _load_index(cls, cache_dir):
+        try:
+            with open(os.path.join(cache_dir, INDEX_FILENAME)) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    @classmethod
+    def _evict(cls):
+        total_size = sum(entry["size"] for entry in cls._index.values())
+
+        if total_size <= cls._max_size:
+            return
+
+        # Least recently used files first
+        for filename, entry in sorted(cls._index.items(), key=lambda item: item[1]["last_used"]):
+            if total_size <= cls._max_size:
+                break
+            if filename in cls._pending:
+                continue
+
+            total_size -= entry["size"]
+            del cls._index[filename]
+            try:
+                os.remove(cls._get_path(filename))
+            except OSError:
+                pass
+
+    @classmethod
+    def _write_async(cls, filename, filepath, data):
+        if cls._thread is None:
+            cls._queue = Queue()
+            cls._thread = threading.Thread(target=cls._worker, daemon=True)
+            cls._thread.start()
+
+        cls._pending.add(filename)
+        cls._queue.put((filename, filepath, data))
+
+    @classmethod
+    def _worker(cls):
+        while True:
+            filename, filepath, data = cls._queue.get()
+            # Write to a temporary file first, so an interrupted write never leaves a broken cache file
+            tmp_path = filepath + ".tmp"
 
+            try:
+                with open(tmp_path, "wb") as image_file:
+                    image_file.write(data)
+                os.replace(tmp_path, filepath)
+            except OSError as error:
+                cls._errors.append((filename, error))
+            finally:
+                cls._pending.discard(filename)
+                cls._queue.task_done()
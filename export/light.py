@@ -1,32 +1,42 @@
 import bpy
 from mathutils import Matrix
 import math
+import os
+from collections import OrderedDict
 from ..bin import pyluxcore
 from .. import utils
 from ..utils import ExportedObject, ExportedLight
+from .caches import PropertiesCache
 from .image import ImageExporter
 
 
 WORLD_BACKGROUND_LIGHT_NAME = "__WORLD_BACKGROUND_LIGHT__"
 MISSING_IMAGE_COLOR = [1, 0, 1]
 
+# IES data shared by all lights, see _get_ies_blob()
+# {absolute filepath: ((mtime, size), blob)} and {text key: (text content, blob)}
+_ies_file_cache = OrderedDict()
+_ies_text_cache = OrderedDict()
+# Exported lamp images, see _export_lamp_image()
+# {(image key, filepath, max_size): ((mtime, size), mapfile)}
+_mapfile_cache = OrderedDict()
+# Maximum number of entries in each of the caches above, the least recently used ones are removed first
+MAX_CACHE_ENTRIES = 64
 
-def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suffix=""):
+
+def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suffix="", exported_object=None):
+    """
+    exported_object: The ExportedLight or ExportedObject (area light) from the previous export
+    of this lamp. If it is available, the light is updated instead of deleted and re-created.
+    """
     try:
         assert isinstance(blender_obj, bpy.types.Object)
         assert blender_obj.type == "LAMP"
         print("converting lamp:", blender_obj.name)
 
         luxcore_name = utils.get_luxcore_name(blender_obj, context) + dupli_suffix
-
-        # If this light was previously defined as an area lamp, delete the area lamp mesh
-        luxcore_scene.DeleteObject(luxcore_name)
-        # If this light was previously defined as a light, delete it
-        luxcore_scene.DeleteLight(luxcore_name)
-
         prefix = "scene.lights." + luxcore_name + "."
         definitions = {}
-        exported_light = ExportedLight(luxcore_name)
 
         lamp = blender_obj.data
 
@@ -47,8 +57,7 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
 
                 if lamp.luxcore.image:
                     try:
-                        filepath = ImageExporter.export(lamp.luxcore.image)
-                        definitions["mapfile"] = filepath
+                        definitions["mapfile"] = _export_lamp_image(exporter, lamp.luxcore.image)
                         definitions["gamma"] = lamp.luxcore.gamma
                     except OSError as error:
                         msg = 'Lamp "%s": %s' % (blender_obj.name, error)
@@ -109,7 +118,7 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
             if lamp.luxcore.image:
                 # projection
                 try:
-                    definitions["mapfile"] = ImageExporter.export(lamp.luxcore.image)
+                    definitions["mapfile"] = _export_lamp_image(exporter, lamp.luxcore.image)
                     definitions["type"] = "projection"
                     definitions["fov"] = coneangle * 2
                     definitions["gamma"] = lamp.luxcore.gamma
@@ -138,7 +147,7 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
 
         elif lamp.type == "HEMI":
             if lamp.luxcore.image:
-                _convert_infinite(definitions, lamp, scene, matrix)
+                _convert_infinite(exporter, definitions, lamp, scene, matrix)
             else:
                 # Fallback
                 definitions["type"] = "constantinfinite"
@@ -160,6 +169,9 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
                 definitions["transformation"] = transformation
             else:
                 # area (mesh light)
+                if not isinstance(exported_object, ExportedObject):
+                    # If this light was previously defined as a light, delete it
+                    luxcore_scene.DeleteLight(luxcore_name)
                 return _convert_area_lamp(blender_obj, scene, context, luxcore_scene, gain, importance)
 
         else:
@@ -170,7 +182,7 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
         _visibilitymap(definitions, lamp)
 
         props = utils.create_props(prefix, definitions)
-        return props, exported_light
+        return _update_light(luxcore_scene, luxcore_name, props, context, exported_object)
     except Exception as error:
         msg = 'Light "%s": %s' % (blender_obj.name, error)
         scene.luxcore.errorlog.add_warning(msg)
@@ -179,6 +191,38 @@ def convert_lamp(exporter, blender_obj, scene, context, luxcore_scene, dupli_suf
         return pyluxcore.Properties(), None
 
 
+def _update_light(luxcore_scene, luxcore_name, props, context, exported_object):
+    """
+    Returns the properties that have to be parsed and the ExportedLight.
+    LuxCore replaces a light that is parsed again in place, so it is only deleted
+    and re-created if its type changed or if it was an area light (mesh) before.
+    Note that LuxCore creates a light from the properties of a single Parse() call,
+    so the complete definition is sent if any of its properties changed.
+    """
+    if isinstance(exported_object, ExportedLight) and exported_object.props_cache:
+        changed_keys = exported_object.props_cache.diff(props)
+
+        if not changed_keys:
+            # E.g. only a property that is not exported changed
+            return pyluxcore.Properties(), exported_object
+
+        if "scene.lights." + luxcore_name + ".type" in changed_keys:
+            luxcore_scene.DeleteLight(luxcore_name)
+        return props, exported_object
+
+    # If this light was previously defined as an area lamp, delete the area lamp mesh
+    luxcore_scene.DeleteObject(luxcore_name)
+    # If this light was previously defined as a light, delete it
+    luxcore_scene.DeleteLight(luxcore_name)
+
+    exported_light = ExportedLight(luxcore_name)
+    if context:
+        # Only lights in the viewport are updated, final renders don't need the hashes
+        exported_light.props_cache = PropertiesCache()
+        exported_light.props_cache.diff(props)
+    return props, exported_light
+
+
 def convert_world(exporter, world, scene):
     try:
         assert isinstance(world, bpy.types.World)
@@ -215,7 +259,7 @@ def convert_world(exporter, world, scene):
         elif light_type == "infinite":
             if world.luxcore.image:
                 transformation = Matrix.Rotation(world.luxcore.rotation, 4, "Z")
-                _convert_infinite(definitions, world, scene, transformation)
+                _convert_infinite(exporter, definitions, world, scene, transformation)
             else:
                 # Fallback if no image is set
                 definitions["type"] = "constantinfinite"
@@ -248,11 +292,12 @@ def _convert_common_props(exporter, scene, lamp_or_world):
     return gain, importance, lightgroup_id
 
 
-def _convert_infinite(definitions, lamp_or_world, scene, transformation=None):
+def _convert_infinite(exporter, definitions, lamp_or_world, scene, transformation=None):
     assert lamp_or_world.luxcore.image is not None
 
     try:
-        filepath = ImageExporter.export(lamp_or_world.luxcore.image)
+        image = lamp_or_world.luxcore.image
+        filepath = ImageExporter.export(image, exporter.get_image_max_size(image))
     except OSError as error:
         error_context = "Lamp" if isinstance(lamp_or_world, bpy.types.Lamp) else "World"
         msg = '%s "%s": %s' % (error_context, lamp_or_world.name, error)
@@ -414,28 +459,102 @@ def export_ies(definitions, ies, library, is_meshlight=False):
     definitions[prefix + "map.width"] = ies.map_width
     definitions[prefix + "map.height"] = ies.map_height
 
-    # There are two ways to specify IES data: filepath or blob (ascii text)
+    # There are two ways to specify IES data: filepath or blob (ascii text).
+    # We always send a blob, so files are only read once and not by every light that uses them
+    blob = _get_ies_blob(ies, library)
+    if blob:
+        definitions[prefix + "iesblob"] = [blob]
+
+    # has ies
+    return True
+
+
+def _get_ies_blob(ies, library):
+    """
+    Returns the content of the IES text or file. The data is cached, files are
+    only read again if their modification time or size changed.
+    """
     if ies.file_type == "TEXT":
         # Blender text block
         text = ies.file_text
+        content = text.as_string()
+        key = utils.make_key(text)
+        cached = _cache_get(_ies_text_cache, key)
 
-        if text:
-            blob = text.as_string().encode("ascii")
+        if cached and cached[0] == content:
+            return cached[1]
 
-            if blob:
-                definitions[prefix + "iesblob"] = [blob]
+        blob = content.encode("ascii")
+        _cache_set(_ies_text_cache, key, (content, blob))
+        return blob
     else:
         # File path
         iesfile = ies.file_path
+        filepath = utils.get_abspath(iesfile, library)
+
+        try:
+            stat = os.stat(filepath)
+            version = (stat.st_mtime, stat.st_size)
+            cached = _cache_get(_ies_file_cache, filepath)
 
-        if iesfile:
-            try:
-                filepath = utils.get_abspath(iesfile, library, must_exist=True, must_be_existing_file=True)
-                definitions[prefix + "iesfile"] = filepath
-            except OSError as error:
-                # Make the error message more precise
-                raise OSError('Could not find .ies file at path "%s" (%s)'
-                              % (iesfile, error))
+            if cached and cached[0] == version:
+                return cached[1]
 
-    # has ies
-    return True
+            with open(filepath, "rb") as ies_file:
+                blob = ies_file.read()
+        except OSError as error:
+            # Make the error message more precise
+            raise OSError('Could not find .ies file at path "%s" (%s)'
+                          % (iesfile, error))
+
+        _cache_set(_ies_file_cache, filepath, (version, blob))
+        return blob
+
+
+def _export_lamp_image(exporter, image):
+    """
+    ImageExporter.export() for lamp images. For unchanged image files, the result
+    of the last export (e.g. the path of the downscaled copy) is re-used.
+    """
+    max_size = exporter.get_image_max_size(image)
+
+    if image.source != "FILE" or image.packed_file or image.is_dirty:
+        # Packed and generated images are already cached by the ImageExporter
+        return ImageExporter.export(image, max_size)
+
+    filepath = utils.get_abspath(image.filepath, library=image.library)
+    key = (utils.make_key(image), filepath, max_size)
+
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        # ImageExporter raises the error with a more precise message
+        _mapfile_cache.pop(key, None)
+        return ImageExporter.export(image, max_size)
+
+    version = (stat.st_mtime, stat.st_size)
+    cached = _cache_get(_mapfile_cache, key)
+
+    # A downscaled copy might have been deleted from the image cache in the meantime
+    if cached and cached[0] == version and (cached[1] == filepath or os.path.isfile(cached[1])):
+        return cached[1]
+
+    mapfile = ImageExporter.export(image, max_size)
+    _cache_set(_mapfile_cache, key, (version, mapfile))
+    return mapfile
+
+
+def _cache_get(cache, key):
+    """ Returns the cached value or None, and marks the entry as recently used """
+    try:
+        cache.move_to_end(key)
+    except KeyError:
+        return None
+    return cache[key]
+
+
+def _cache_set(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_CACHE_ENTRIES:
+        cache.popitem(last=False)
@@ -0,0 +1,326 @@
+import bpy
+import hashlib
+import json
+import os
+import tempfile
+from array import array
+from time import time
+from ..bin import pyluxcore
+from .. import utils
+
+INDEX_FILENAME = "index.json"
+DEFAULT_DIRNAME = "luxcore_mesh_cache"
+
+# The result of these modifiers depends on the current frame, even if their settings do not change
+TIME_DEPENDENT_MODIFIERS = {
+    "CLOTH", "COLLISION", "DYNAMIC_PAINT", "EXPLODE", "FLUID_SIMULATION", "MESH_CACHE",
+    "MESH_SEQUENCE_CACHE", "OCEAN", "PARTICLE_INSTANCE", "SMOKE", "SOFT_BODY", "WAVE",
+}
+
+
+class MeshCache(object):
+    """
+    Persistent on-disk cache for the tessellated meshes of final renders.
+    The key of a mesh is a hash of the mesh data, the modifier stack and the modifier mode.
+    This class is a singleton.
+    """
+    active = False
+    hits = 0
+    misses = 0
+
+    _cache_dir = ""
+    _max_size = 0
+    _index = None
+
+    @classmethod
+    def begin_export(cls, context):
+        """ Has to be called before the objects are exported """
+        cls.active = False
+        cls.hits = 0
+        cls.misses = 0
+
+        # The cache is only used in final render. In viewport render, the meshes
+        # are only exported once anyway and we would hash them on every edit.
+        if context:
+            return
+
+        prefs = utils.get_addon_preferences(bpy.context)
+        if not prefs.use_mesh_cache:
+            return
+
+        cls._cache_dir = cls._get_cache_dir(prefs)
+        cls._max_size = prefs.mesh_cache_size * 1024 * 1024
+
+        try:
+            os.makedirs(cls._cache_dir, exist_ok=True)
+        except OSError as error:
+            print("[Mesh Cache] Can not create cache directory:", error)
+            return
+
+        cls._index = cls._load_index()
+        cls.active = True
+
+    @classmethod
+    def end_export(cls):
+        """ Evicts old entries if the cache is too large and saves the index """
+        if not cls.active:
+            return
+
+        cls.active = False
+        print("[Mesh Cache] %d hits, %d misses" % (cls.hits, cls.misses))
+        cls._evict()
+        cls._save_index()
+
+    @classmethod
+    def make_key(cls, blender_obj, scene, modifier_mode, mesh_transform):
+        """
+        Returns the cache key of the object or None if it can not be cached
+        (e.g. because a modifier depends on another object)
+        """
+        if blender_obj.type != "MESH":
+            return None
+
+        md5 = hashlib.md5()
+        md5.update(cls._index["version"].encode())
+        md5.update(repr((modifier_mode, mesh_transform)).encode())
+
+        if not hash_mesh(md5, blender_obj.data, bool(blender_obj.vertex_groups)):
+            return None
+
+        for mod in blender_obj.modifiers:
+            if not hash_modifier(md5, mod, modifier_mode, scene):
+                return None
+
+        return md5.hexdigest()
+
+    @classmethod
+    def load(cls, key, luxcore_name, props, shape_prefix="Mesh-"):
+        """
+        Defines the cached shapes in props.
+        Returns the mesh definitions in the format of DefineBlenderMesh(), or None on a cache miss.
+        shape_prefix: The prefix that was used in the shape names, DefineBlenderMesh() adds "Mesh-"
+        """
+        entry = cls._index["entries"].get(key)
+
+        if entry is None or not all(os.path.isfile(cls._get_path(filename))
+                                    for _, _, filename in entry["definitions"]):
+            # Entry was never stored or someone deleted files from the cache directory
+            cls._index["entries"].pop(key, None)
+            cls.misses += 1
+            return None
+
+        mesh_definitions = []
+        for suffix, material_index, filename in entry["definitions"]:
+            lux_object_name = luxcore_name + suffix
+            prefix = "scene.shapes." + shape_prefix + lux_object_name + "."
+            props.Set(pyluxcore.Property(prefix + "type", "mesh"))
+            props.Set(pyluxcore.Property(prefix + "ply", cls._get_path(filename)))
+            mesh_definitions.append([lux_object_name, material_index])
+
+        entry["last_used"] = time()
+        cls.hits += 1
+        return mesh_definitions
+
+    @classmethod
+    def store(cls, key, luxcore_name, mesh_definitions, luxcore_scene, shape_prefix="Mesh-"):
+        definitions = []
+        size = 0
+
+        try:
+            for lux_object_name, material_index in mesh_definitions:
+                filename = "%s_%d.ply" % (key, material_index)
+                filepath = cls._get_path(filename)
+                luxcore_scene.SaveMesh(shape_prefix + lux_object_name, filepath)
+                size += os.path.getsize(filepath)
+                # Store only the suffix because the luxcore_name contains the memory address
+                # of the object, which is different in the next Blender session
+                definitions.append([lux_object_name[len(luxcore_name):], material_index, filename])
+        except (AttributeError, RuntimeError, OSError) as error:
+            print("[Mesh Cache] Could not store mesh:", error)
+            return
+
+        cls._index["entries"][key] = {
+            "definitions": definitions,
+            "size": size,
+            "last_used": time(),
+        }
+
+    @classmethod
+    def clear(cls, context):
+        prefs = utils.get_addon_preferences(context)
+        cache_dir = cls._get_cache_dir(prefs)
+
+        if not os.path.isdir(cache_dir):
+            return
+
+        for filename in os.listdir(cache_dir):
+            if filename.endswith(".ply") or filename == INDEX_FILENAME:
+                os.remove(os.path.join(cache_dir, filename))
+
+    @classmethod
+    def _get_cache_dir(cls, prefs):
+        if prefs.mesh_cache_dir:
+            return bpy.path.abspath(prefs.mesh_cache_dir)
+        return os.path.join(tempfile.gettempdir(), DEFAULT_DIRNAME)
+
+    @classmethod
+    def _get_path(cls, filename):
+        return os.path.join(cls._cache_dir, filename)
+
+    @classmethod
+    def _load_index(cls):
+        version = _get_version_string()
+        index = None
+
+        try:
+            with open(cls._get_path(INDEX_FILENAME)) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            pass
+
+        if index is None or index.get("version") != version:
+            # The addon or LuxCore version changed, the cached files might be incompatible
+            if index is not None:
+                print("[Mesh Cache] Version changed, invalidating cache")
+                for key in list(index.get("entries", {}).keys()):
+                    cls._delete_entry(index, key)
+            index = {"version": version, "entries": {}}
+
+        return index
+
+    @classmethod
+    def _save_index(cls):
+        path = cls._get_path(INDEX_FILENAME)
+        tmp_path = path + ".tmp"
+
+        try:
+            with open(tmp_path, "w") as index_file:
+                json.dump(cls._index, index_file)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            print("[Mesh Cache] Could not save index:", error)
+
+    @classmethod
+    def _evict(cls):
+        entries = cls._index["entries"]
+        total_size = sum(entry["size"] for entry in entries.values())
+
+        if total_size <= cls._max_size:
+            return
+
+        # Least recently used entries first
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]["last_used"]):
+            if total_size <= cls._max_size:
+                break
+            total_size -= entry["size"]
+            cls._delete_entry(cls._index, key)
+
+    @classmethod
+    def _delete_entry(cls, index, key):
+        entry = index["entries"].pop(key)
+
+        for _, _, filename in entry["definitions"]:
+            try:
+                os.remove(cls._get_path(filename))
+            except OSError:
+                pass
+
+
+def _get_version_string():
+    from .. import bl_info
+    version = bl_info["version"]
+    return "%d.%d%s_%s" % (version[0], version[1], bl_info["warning"], pyluxcore.Version())
+
+
+def hash_collection(md5, collection, attribute, typecode, elem_len=1):
+    buffer = array(typecode, [0]) * (len(collection) * elem_len)
+    collection.foreach_get(attribute, buffer)
+    md5.update(buffer.tobytes())
+
+
+def hash_mesh(md5, mesh, use_vertex_groups=False):
+    """
+    use_vertex_groups: Hash the vertex group weights (only needed if the object has vertex groups)
+    Returns False if the mesh can not be cached
+    """
+    if mesh.has_custom_normals:
+        # Custom split normals are only accessible after calc_normals_split(), which modifies the mesh
+        return False
+
+    md5.update(repr((mesh.use_auto_smooth, mesh.auto_smooth_angle)).encode())
+
+    hash_collection(md5, mesh.vertices, "co", "f", 3)
+    hash_collection(md5, mesh.edges, "vertices", "i", 2)
+    hash_collection(md5, mesh.edges, "crease", "f")
+    sharp = [False] * len(mesh.edges)
+    mesh.edges.foreach_get("use_edge_sharp", sharp)
+    md5.update(bytes(sharp))
+
+    hash_collection(md5, mesh.loops, "vertex_index", "i")
+    hash_collection(md5, mesh.polygons, "loop_total", "i")
+    hash_collection(md5, mesh.polygons, "material_index", "i")
+
+    smooth = [False] * len(mesh.polygons)
+    mesh.polygons.foreach_get("use_smooth", smooth)
+    md5.update(bytes(smooth))
+
+    md5.update(repr([uv.active_render for uv in mesh.uv_textures]).encode())
+    for uv_layer in mesh.uv_layers:
+        hash_collection(md5, uv_layer.data, "uv", "f", 2)
+
+    md5.update(repr([vcol.active for vcol in mesh.vertex_colors]).encode())
+    for vcol_layer in mesh.vertex_colors:
+        hash_collection(md5, vcol_layer.data, "color", "f", 3)
+
+    if use_vertex_groups:
+        # The weights are stored per vertex, there is no way to read them in bulk
+        group_counts = array("i", [len(vertex.groups) for vertex in mesh.vertices])
+        groups = array("i", [elem.group for vertex in mesh.vertices for elem in vertex.groups])
+        weights = array("f", [elem.weight for vertex in mesh.vertices for elem in vertex.groups])
+        md5.update(group_counts.tobytes())
+        md5.update(groups.tobytes())
+        md5.update(weights.tobytes())
+
+    if mesh.shape_keys:
+        if mesh.shape_keys.animation_data:
+            # Drivers on shape keys can depend on anything
+            return False
+
+        for key_block in mesh.shape_keys.key_blocks:
+            md5.update(repr((key_block.value, key_block.mute)).encode())
+            hash_collection(md5, key_block.data, "co", "f", 3)
+
+    return True
+
+
+def hash_modifier(md5, mod, modifier_mode, scene):
+    enabled = mod.show_render if modifier_mode == "RENDER" else mod.show_viewport
+    md5.update(repr((mod.type, enabled)).encode())
+
+    if not enabled:
+        return True
+
+    if mod.type in TIME_DEPENDENT_MODIFIERS:
+        # The result depends on simulation caches, colliders or particles, not only on the frame
+        return False
+
+    for prop in mod.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier in {"rna_type", "name"} or prop.type == "COLLECTION":
+            continue
+
+        value = getattr(mod, identifier)
+
+        if prop.type == "POINTER":
+            if isinstance(value, bpy.types.ID):
+                # The result depends on another datablock (e.g. boolean or armature
+                # target, displacement texture) whose changes we can't track here
+                return False
+            # Non-ID pointers like particle system settings do not change the mesh
+            continue
+        elif getattr(prop, "is_array", False):
+            value = tuple(value)
+
+        md5.update(repr((identifier, value)).encode())
+
+    return True
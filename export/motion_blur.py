@@ -1,6 +1,18 @@
 import math
+import numpy
 from ..bin import pyluxcore
 from .. import utils
+from .mesh_cache import TIME_DEPENDENT_MODIFIERS
+
+# If more than this fraction of the objects is animated, the matrices of all objects
+# are read at once with foreach_get() instead of reading the animated ones individually
+READ_ALL_MATRICES_RATIO = 0.25
+
+# Modifiers that can change the vertex positions over time even if their own settings are not animated
+DEFORM_MODIFIERS = TIME_DEPENDENT_MODIFIERS | {
+    "ARMATURE", "CAST", "CURVE", "DISPLACE", "HOOK", "LAPLACIANDEFORM", "LATTICE",
+    "MESH_DEFORM", "SHRINKWRAP", "SIMPLE_DEFORM", "SURFACE_DEFORM", "WARP",
+}
 
 
 def convert(context, scene, objects, exported_objects):
@@ -11,72 +23,110 @@ def convert(context, scene, objects, exported_objects):
     steps = motion_blur.steps
     assert steps >= 2 and isinstance(steps, int)
 
-    frame_offsets = _calc_frame_offsets(motion_blur.shutter, steps)
-    matrices = _get_matrices(context, scene, steps, frame_offsets, objects, exported_objects)
+    frame_offsets = calc_frame_offsets(motion_blur.shutter, steps)
+
+    prefixes, matrix_steps = _get_matrices(context, scene, steps, frame_offsets, objects, exported_objects)
 
-    # Find and delete entries of non-moving objects (where all matrices are equal)
-    for prefix, matrix_steps in list(matrices.items()):
-        matrices_equal = utils.all_elems_equal(matrix_steps)
+    if motion_blur.object_blur and not context and objects and exported_objects:
+        for obj in objects:
+            if (utils.make_key(obj) in exported_objects and utils.use_obj_motion_blur(obj, scene)
+                    and _may_deform(obj)):
+                msg = ('Object "%s": Mesh might deform during the shutter time, but LuxCore '
+                       'only supports transformation motion blur' % obj.name)
+                scene.luxcore.errorlog.add_warning(msg)
 
-        if matrices_equal:
-            # This object does not need motion blur because it does not move
-            del matrices[prefix]
+    # Skip non-moving objects (where all matrices are equal), they don't need motion blur
+    is_moving = (matrix_steps != matrix_steps[0]).any(axis=(0, 2))
+    moving_prefixes = [prefix for prefix, moving in zip(prefixes, is_moving) if moving]
+    transformations, _ = utils.matrices_to_array(matrix_steps[:, is_moving], scene, apply_worldscale=True)
+    transformations.shape = (steps, len(moving_prefixes), 16)
 
     # Export the properties for moving objects
     props = pyluxcore.Properties()
 
-    for prefix, matrix_steps in matrices.items():
+    for i, prefix in enumerate(moving_prefixes):
         for step in range(steps):
-            time = frame_offsets[step]
-            matrix = matrix_steps[step]
-            transformation = utils.matrix_to_list(matrix, scene, apply_worldscale=True)
             definitions = {
-                "motion.%d.time" % step: time,
-                "motion.%d.transformation" % step: transformation,
+                "motion.%d.time" % step: frame_offsets[step],
+                "motion.%d.transformation" % step: transformations[step, i].tolist(),
             }
             props.Set(utils.create_props(prefix, definitions))
 
     # We need this information outside
-    is_camera_moving = "scene.camera." in matrices
+    is_camera_moving = "scene.camera." in moving_prefixes
     return props, is_camera_moving
 
 
-def _calc_frame_offsets(shutter, steps):
+def calc_frame_offsets(shutter, steps):
     """ Return a list of offsets (unit: frame) to step through in _get_matrices() """
     step_interval = shutter / (steps - 1)
     return [step_interval * step - shutter / 2 for step in range(steps)]
 
 
+def frame_set_offset(scene, frame_center, subframe_center, offset):
+    """ Set the scene to the (fractional) frame that is offset frames away from the center frame """
+    frame = frame_center + subframe_center + offset
+    frame_int = math.floor(frame)
+    subframe = frame - frame_int
+    scene.frame_set(frame_int, subframe)
+
+
 def _get_matrices(context, scene, steps, frame_offsets, objects=None, exported_objects=None):
+    """
+    Returns the property prefixes of the blurred objects/camera and
+    a float32 array of shape (steps, len(prefixes), 16) with their matrices at each step.
+    """
     motion_blur = scene.camera.data.luxcore.motion_blur
-    matrices = {}  # {prefix: [matrix1, matrix2, ...]}
+    animated_cache = {}
+    use_camera_blur = motion_blur.camera_blur and not context and _is_animated(scene.camera, animated_cache)
+
+    if motion_blur.object_blur and objects and exported_objects:
+        indices, prefixes = _get_blurred_objects(scene, objects, exported_objects, animated_cache)
+    else:
+        indices, prefixes = [], []
+
+    if use_camera_blur:
+        prefixes.append("scene.camera.")
+
+    matrices = numpy.empty((steps, len(prefixes), 16), dtype=numpy.float32)
+
+    if not prefixes:
+        # Nothing is animated, we don't have to step through the frames at all
+        return prefixes, matrices
+
+    object_count = len(indices)
+    # Reading the matrices of all objects at once is faster than reading a few of them one by one
+    read_all = bool(indices) and object_count > len(objects) * READ_ALL_MATRICES_RATIO
+    blurred_objects = [] if read_all else [objects[index] for index in indices]
 
     frame_center = scene.frame_current
     subframe_center = scene.frame_subframe
 
     for step in range(steps):
-        offset = frame_offsets[step]
-        frame = frame_center + subframe_center + offset
-        frame_int = math.floor(frame)
-        subframe = frame - frame_int
-        scene.frame_set(frame_int, subframe)
+        frame_set_offset(scene, frame_center, subframe_center, frame_offsets[step])
 
-        if motion_blur.object_blur and objects and exported_objects:
-            _append_object_matrices(scene, objects, exported_objects, matrices, step)
+        if read_all:
+            matrices[step, :object_count] = utils.get_matrices(objects)[indices]
+        elif indices:
+            matrices[step, :object_count] = utils.get_matrices(blurred_objects)
 
-        if motion_blur.camera_blur and not context:
-            matrix = scene.camera.matrix_world
-
-            prefix = "scene.camera."
-            _append_matrix(matrices, prefix, matrix, step)
+        if use_camera_blur:
+            matrices[step, object_count] = utils.matrices_from_mathutils([scene.camera.matrix_world])[0]
 
     # Restore original frame
     scene.frame_set(frame_center, subframe_center)
-    return matrices
+    return prefixes, matrices
+
 
+def _get_blurred_objects(scene, objects, exported_objects, animated_cache):
+    """
+    Returns the indices (into objects) of the exported, animated objects
+    with motion blur and their property prefixes
+    """
+    indices = []
+    prefixes = []
 
-def _append_object_matrices(scene, objects, exported_objects, matrices, step):
-    for obj in objects:
+    for index, obj in enumerate(objects):
         if not utils.use_obj_motion_blur(obj, scene):
             # User disabled motion blur for this object, skip it
             continue
@@ -85,25 +135,82 @@ def _append_object_matrices(scene, objects, exported_objects, matrices, step):
 
         try:
             exported_thing = exported_objects[key]
-
-            for luxcore_name in exported_thing.luxcore_names:
-                # exported_objects contains instances of ExportedObject and ExportedLight
-                if isinstance(exported_thing, utils.ExportedObject):
-                    prefix = "scene.objects." + luxcore_name + "."
-                else:
-                    prefix = "scene.lights." + luxcore_name + "."
-
-                matrix = obj.matrix_world
-                _append_matrix(matrices, prefix, matrix, step)
         except KeyError:
             # This is not a problem, objects are skipped during epxort for various reasons
             # E.g. if the object is not visible, or if it's a camera
-            pass
+            continue
+
+        if not _is_animated(obj, animated_cache):
+            # The matrix is the same in all steps
+            continue
 
+        for luxcore_name in exported_thing.luxcore_names:
+            # exported_objects contains instances of ExportedObject and ExportedLight
+            if isinstance(exported_thing, utils.ExportedObject):
+                prefix = "scene.objects." + luxcore_name + "."
+            else:
+                prefix = "scene.lights." + luxcore_name + "."
 
-def _append_matrix(matrices, prefix, matrix, step):
-    matrix = matrix.copy()
-    if step == 0:
-        matrices[prefix] = [matrix]
-    else:
-        matrices[prefix].append(matrix)
+            indices.append(index)
+            prefixes.append(prefix)
+
+    return indices, prefixes
+
+
+def _is_animated(obj, cache):
+    """
+    Returns True if the matrix of the object might change over time.
+    This is conservative, objects that are only possibly animated
+    (e.g. constraints that depend on other objects) count as animated.
+    cache: dict {object key: bool}, shared between calls to avoid walking the same parents again
+    """
+    key = utils.make_key(obj)
+
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+
+    parent = obj.parent
+    animated = (
+        _has_animation(obj)
+        or len(obj.constraints) > 0
+        or obj.rigid_body is not None
+        # Vertex parents follow the (possibly deforming) mesh of the parent
+        or (parent is not None and obj.parent_type in {"VERTEX", "VERTEX_3", "BONE"}
+            and parent.type in {"MESH", "ARMATURE", "CURVE", "LATTICE"})
+        # Children of a curve with "Path Animation" follow the path (also driven by the curve data)
+        or (parent is not None and parent.type == "CURVE" and (parent.data.use_path or _has_animation(parent.data)))
+        or (parent is not None and _is_animated(parent, cache))
+    )
+
+    cache[key] = animated
+    return animated
+
+
+def _has_animation(datablock):
+    anim = datablock.animation_data
+    return anim is not None and (anim.action is not None or len(anim.drivers) > 0 or len(anim.nla_tracks) > 0)
+
+
+def _may_deform(obj):
+    """ Returns True if the vertices of the object might move over time (without to_mesh()) """
+    if obj.type != "MESH":
+        return False
+
+    if any(mod.type in DEFORM_MODIFIERS for mod in obj.modifiers):
+        return True
+
+    anim = obj.animation_data
+    if anim and (_animates_modifiers(anim.action) or any(d.data_path.startswith("modifiers")
+                                                         for d in anim.drivers)):
+        return True
+
+    mesh = obj.data
+    shape_keys = mesh.shape_keys
+    return bool(mesh.animation_data or (shape_keys and shape_keys.animation_data))
+
+
+def _animates_modifiers(action):
+    return action is not None and any(fcurve.data_path.startswith("modifiers")
+                                      for fcurve in action.fcurves)
@@ -0,0 +1,123 @@
+import threading
+from queue import Queue
+from time import time
+from ..utils.profiler import Profiler
+from .image import ImageExporter
+
+# How many property batches may wait for the worker thread before the main thread blocks
+MAX_QUEUED_BATCHES = 4
+# Number of exported objects after which the collected properties are sent to the worker thread
+BATCH_SIZE = 100
+
+
+class LockedScene(object):
+    """
+    Wraps a pyluxcore.Scene so it can be used from the main thread and the parse thread.
+    Every method call is done while holding a lock, because pyluxcore.Scene is not thread safe.
+    This means that the scene calls of the main thread (e.g. DefineBlenderMesh()) can't run
+    during a Parse() of the worker thread. Only the work on the Blender side (reading the
+    Blender data, converting meshes and materials, assembling properties) overlaps with parsing.
+    The time the main thread spends waiting for the lock is measured, see lock_wait_time.
+    """
+    def __init__(self, luxcore_scene):
+        self._scene = luxcore_scene
+        self._lock = threading.Lock()
+        # Seconds the main thread was blocked because the worker thread was using the scene
+        self.lock_wait_time = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._scene, name)
+
+        if not callable(attr):
+            return attr
+
+        def locked_call(*args, **kwargs):
+            if threading.current_thread() is threading.main_thread():
+                start = time()
+                with Profiler.section("Parse Pipeline", "Waiting for scene lock"):
+                    self._lock.acquire()
+                self.lock_wait_time += time() - start
+            else:
+                self._lock.acquire()
+
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._lock.release()
+
+        return locked_call
+
+
+class ParsePipeline(object):
+    """
+    Parses batches of scene properties on a worker thread while the main thread
+    continues to extract the next objects from Blender.
+    Everything that accesses Blender data has to stay on the main thread.
+    """
+    def __init__(self, luxcore_scene):
+        # Use this scene instead of the original luxcore_scene while the pipeline is running
+        self.scene = LockedScene(luxcore_scene)
+        # Seconds the worker thread spent in Parse()
+        self.parse_time = 0
+        # Seconds the main thread was blocked because the queue was full
+        # (waiting for the scene lock is measured in self.scene.lock_wait_time)
+        self.wait_time = 0
+        self.batch_count = 0
+
+        self._queue = Queue(maxsize=MAX_QUEUED_BATCHES)
+        self._error = None
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def submit(self, props):
+        """ Blocks if the worker thread can't keep up """
+        self._raise_worker_error()
+        start = time()
+        with Profiler.section("Parse Pipeline", "Waiting for parser"):
+            # Images exported after this point are not referenced by this batch
+            self._queue.put((props, ImageExporter.get_pending()))
+        self.wait_time += time() - start
+        self.batch_count += 1
+
+    def finish(self, raise_error=True):
+        """
+        Waits until all batches are parsed, then stops the worker thread.
+        raise_error: If False, an error of the worker thread is only printed. Use this if
+        the export already failed, so the original exception is not masked.
+        """
+        self._queue.put(None)
+        start = time()
+        with Profiler.section("Parse Pipeline", "Waiting for parser"):
+            self._thread.join()
+        self.wait_time += time() - start
+
+        if raise_error:
+            self._raise_worker_error()
+        elif self._error:
+            print("[Parse Pipeline] Error in worker thread:", self._error)
+
+    def _worker(self):
+        while True:
+            batch = self._queue.get()
+
+            if batch is None:
+                return
+            props, pending_images = batch
+
+            if self._error:
+                # Keep draining the queue so the main thread does not block forever
+                continue
+
+            start = time()
+            try:
+                # The batch might reference images that are still being written or resized
+                ImageExporter.wait_for(pending_images)
+                with Profiler.section("Parse", "Object Batch"):
+                    self.scene.Parse(props)
+            except Exception as error:
+                self._error = error
+            self.parse_time += time() - start
+
+    def _raise_worker_error(self):
+        if self._error:
+            raise self._error
@@ -0,0 +1,40 @@
+"""
+Downscales an image so its longest side is at most <max size> pixels.
+This script is executed by the ImageExporter in a separate Blender process:
+blender -b --factory-startup -noaudio --python resize_image.py -- <input> <output> <max size>
+"""
+
+import os
+import sys
+import bpy
+
+# Output file extension: Blender file format
+FILE_FORMATS = {
+    ".bmp": "BMP",
+    ".exr": "OPEN_EXR",
+    ".hdr": "HDR",
+    ".jpeg": "JPEG",
+    ".jpg": "JPEG",
+    ".png": "PNG",
+    ".tga": "TARGA",
+    ".tif": "TIFF",
+    ".tiff": "TIFF",
+}
+
+
+def resize(input_path, output_path, max_size):
+    image = bpy.data.images.load(input_path)
+    width, height = image.size
+    scale = max_size / max(width, height)
+
+    if scale < 1:
+        image.scale(max(1, round(width * scale)), max(1, round(height * scale)))
+
+    _, extension = os.path.splitext(output_path)
+    image.file_format = FILE_FORMATS[extension.lower()]
+    image.filepath_raw = output_path
+    image.save()
+
+
+args = sys.argv[sys.argv.index("--") + 1:]
+resize(args[0], args[1], int(args[2]))
@@ -1,5 +1,114 @@
 from .. import utils
-import array
+import numpy
+
+# Edge length of the blocks of cells in a SparseGrid
+BRICK_SIZE = 8
+# The number of values per cell of each channel
+CHANNEL_COMPONENTS = {
+    "density": 1,
+    "fire": 1,
+    "heat": 1,
+    # RGBA
+    "color": 4,
+    "velocity": 3,
+}
+
+
+class SparseGrid(object):
+    """
+    A smoke grid that only stores the bricks (blocks of BRICK_SIZE^3 cells)
+    which contain non-empty cells. Most smoke domains are largely empty.
+    """
+    def __init__(self, data, resolution, components):
+        self.components = components
+        nx, ny, nz = resolution
+        self.resolution = (nx, ny, nz)
+        # Blender stores the cells with x varying fastest, like the LuxCore densitygrid
+        cells = data.reshape(nz, ny, nx, components)
+
+        # Bounding box of the non-empty cells in (x, y, z) order, max is exclusive.
+        # It is grown to a multiple of the brick size if the grid is large enough, because the
+        # bricks can then be a view of the grid (the added cells are empty anyway)
+        bbox_min, bbox_max = _get_bbox(cells.any(axis=3))
+        self.bbox_min, self.bbox_max = zip(*[_align_to_bricks(low, high, size)
+                                             for low, high, size in zip(bbox_min, bbox_max, self.resolution)])
+        (x0, y0, z0), (x1, y1, z1) = self.bbox_min, self.bbox_max
+        cropped = cells[z0:z1, y0:y1, x0:x1]
+
+        # Split the cropped grid into bricks
+        self.brick_shape = tuple(-(-size // BRICK_SIZE) for size in cropped.shape[:3])
+        bz, by, bx = self.brick_shape
+        padded_shape = (bz * BRICK_SIZE, by * BRICK_SIZE, bx * BRICK_SIZE, components)
+
+        if cropped.shape != padded_shape:
+            # The grid is smaller than the bricks, pad it
+            padded = numpy.zeros(padded_shape, dtype=numpy.float32)
+            padded[:cropped.shape[0], :cropped.shape[1], :cropped.shape[2]] = cropped
+            cropped = padded
+
+        bricks = cropped.reshape(bz, BRICK_SIZE, by, BRICK_SIZE, bx, BRICK_SIZE, components)
+        bricks = bricks.transpose(0, 2, 4, 1, 3, 5, 6)
+
+        occupied = bricks.any(axis=(3, 4, 5, 6))
+        # (brick count, 3) array of brick coordinates in (z, y, x) order
+        self.brick_coords = numpy.argwhere(occupied)
+        # Only the occupied bricks are copied
+        self.bricks = bricks[occupied]
+
+    @property
+    def crop_resolution(self):
+        """ The resolution of the grid returned by to_dense() """
+        return [high - low for low, high in zip(self.bbox_min, self.bbox_max)]
+
+    @property
+    def nbytes(self):
+        return self.bricks.nbytes + self.brick_coords.nbytes
+
+    def to_dense(self):
+        """
+        Returns the cells inside the bounding box as flat float32 array
+        that can be passed to pyluxcore.Property.AddAllFloat()
+        """
+        bz, by, bx = self.brick_shape
+        components = self.components
+        padded_shape = (bz * BRICK_SIZE, by * BRICK_SIZE, bx * BRICK_SIZE, components)
+        buffer = numpy.zeros(int(numpy.prod(padded_shape)), dtype=numpy.float32)
+        dense = buffer.reshape(padded_shape)
+        # The bricks are written through a view, so the buffer is the only copy of the grid
+        blocks = dense.reshape(bz, BRICK_SIZE, by, BRICK_SIZE, bx, BRICK_SIZE, components)
+        blocks.transpose(0, 2, 4, 1, 3, 5, 6)[tuple(self.brick_coords.T)] = self.bricks
+
+        sx, sy, sz = self.crop_resolution
+        if (sz, sy, sx) == padded_shape[:3]:
+            return buffer
+
+        # Remove the padding in place, one z slice at a time (numpy handles the overlap)
+        slice_size = sy * sx * components
+        for z in range(sz):
+            buffer[z * slice_size:(z + 1) * slice_size].reshape(sy, sx, components)[:] = dense[z, :sy, :sx]
+        return buffer[:sz * slice_size]
+
+
+def get_grid(exporter, smoke_obj, channel):
+    """
+    Returns the SparseGrid of the channel in the current frame.
+    The grids are cached per domain and frame, so nodes using the same domain share them.
+    """
+    scene = exporter.scene
+    key = (utils.make_key(smoke_obj), scene.frame_current, scene.frame_subframe)
+    channels = exporter.smoke_grids.setdefault(key, {})
+
+    try:
+        return channels[channel]
+    except KeyError:
+        pass
+
+    resolution, data = convert(smoke_obj, channel)
+    grid = SparseGrid(data, resolution, CHANNEL_COMPONENTS[channel])
+    print("[Smoke Domain: %s] Channel %s: %d of %d bricks occupied, %.1f MiB cached"
+          % (smoke_obj.name, channel, len(grid.bricks), numpy.prod(grid.brick_shape), grid.nbytes / 1024**2))
+    channels[channel] = grid
+    return grid
 
 
 def convert(smoke_obj, channel):
@@ -33,7 +142,7 @@ def convert(smoke_obj, channel):
         msg = 'Object "%s": No smoke data (simulate some frames first)' % smoke_obj.name
         raise Exception(msg)
 
-    channeldata = list(grid)
+    channeldata = grid_to_array(grid)
 
     # The smoke resolution along the x, y, z axis
     resolution = list(settings.domain_resolution)
@@ -43,6 +152,54 @@ def convert(smoke_obj, channel):
         for i in range(3):
             resolution[i] *= settings.amplify + 1
 
-    print("conversion to list took %.3f s" % (time() - start))
+    print("conversion to array took %.3f s" % (time() - start))
 
     return resolution, channeldata
+
+
+def grid_to_array(grid):
+    """
+    Copies the grid into a float32 array without creating a Python list of all cells.
+    The result can be passed to pyluxcore.Property.AddAllFloat() directly.
+    """
+    count = len(grid)
+
+    if hasattr(grid, "foreach_get"):
+        data = numpy.empty(count, dtype=numpy.float32)
+        grid.foreach_get(data)
+        return data
+
+    # Blender 2.79 has no bulk access for float arrays, but fromiter()
+    # only keeps one Python float alive at a time
+    return numpy.fromiter(grid, dtype=numpy.float32, count=count)
+
+
+def _align_to_bricks(low, high, size):
+    """
+    Grows the range [low, high) to a multiple of BRICK_SIZE, moving it
+    if necessary to stay inside [0, size). Returns the range unchanged if size is too small.
+    """
+    length = -(-(high - low) // BRICK_SIZE) * BRICK_SIZE
+    if length > size:
+        return low, high
+    low = min(low, size - length)
+    return low, low + length
+
+
+def _get_bbox(occupied):
+    """
+    Returns the bounding box of the occupied cells as (x, y, z) tuples (max is exclusive).
+    An empty grid gets a bounding box of one cell.
+    """
+    bbox_min = []
+    bbox_max = []
+
+    # occupied has the axis order z, y, x
+    for axes in ((0, 1), (0, 2), (1, 2)):
+        indices = numpy.flatnonzero(occupied.any(axis=axes))
+        if len(indices) == 0:
+            return (0, 0, 0), (1, 1, 1)
+        bbox_min.append(int(indices[0]))
+        bbox_max.append(int(indices[-1]) + 1)
+
+    return tuple(bbox_min), tuple(bbox_max)
@@ -0,0 +1,208 @@
+import heapq
+from .. import utils
+from ..utils import image_info
+from ..utils import node as utils_node
+
+# The budget never downscales images below this size (in pixels)
+MIN_TEXTURE_SIZE = 64
+# LuxCore samples IES files into a single channel float image map
+IES_CHANNELS = 1
+IES_BYTES_PER_CHANNEL = 4
+
+
+class TextureUsage(object):
+    """ An image that LuxCore will load, with its estimated memory usage """
+    def __init__(self, name, kind, width, height, channels, bytes_per_channel, resizable=True):
+        self.name = name
+        # "Imagemap", "Lamp", "World" or "IES"
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bytes_per_channel = bytes_per_channel
+        # Images we can't downscale (e.g. IES files) are never resized by the budget
+        self.resizable = resizable
+        # Max. width/height assigned by the limit or the budget (0 = full resolution)
+        self.max_size = 0
+
+    @property
+    def full_size(self):
+        return self.width * self.height * self.channels * self.bytes_per_channel
+
+    @property
+    def size(self):
+        """ Estimated bytes in RAM with the assigned max_size """
+        width, height = get_resized_resolution(self.width, self.height, self.max_size)
+        return width * height * self.channels * self.bytes_per_channel
+
+    @property
+    def longest_side(self):
+        return max(get_resized_resolution(self.width, self.height, self.max_size))
+
+
+class TextureMemory(object):
+    """
+    Estimates how much memory LuxCore needs for the images of a scene and assigns reduced
+    resolutions if the images do not fit into the texture budget.
+    The results of the last analysis are kept for the UI.
+    This class is a singleton.
+    """
+    # {key: TextureUsage}
+    usages = {}
+    budget = 0
+    analyzed = False
+
+    @classmethod
+    def analyze(cls, scene, max_size=0, budget=0):
+        """
+        Collects all images used by the scene.
+        max_size: The global texture size limit in pixels (0 = no limit)
+        budget: Max. bytes for all images (0 = no budget)
+        Returns a dict {image key: max_size} for all images that have to be downscaled
+        """
+        cls.usages = _collect(scene)
+        cls.budget = budget
+        cls.analyzed = True
+
+        for usage in cls.usages.values():
+            if usage.resizable:
+                usage.max_size = max_size
+
+        if budget:
+            _apply_budget(cls.usages.values(), budget)
+
+        return {key: usage.max_size for key, usage in cls.usages.items()
+                if usage.resizable and usage.max_size}
+
+    @classmethod
+    def get_total(cls, full_resolution=False):
+        if full_resolution:
+            return sum(usage.full_size for usage in cls.usages.values())
+        return sum(usage.size for usage in cls.usages.values())
+
+    @classmethod
+    def get_report(cls):
+        """ Returns the usages sorted by memory, largest first """
+        return sorted(cls.usages.values(), key=lambda usage: usage.size, reverse=True)
+
+    @classmethod
+    def print_report(cls):
+        mib = 1024 * 1024
+        print("[Texture Memory] %.1f MiB for %d images (full resolution: %.1f MiB)"
+              % (cls.get_total() / mib, len(cls.usages), cls.get_total(full_resolution=True) / mib))
+
+        for usage in cls.get_report():
+            width, height = get_resized_resolution(usage.width, usage.height, usage.max_size)
+            print("  %-8s %-40s %5d x %-5d %8.1f MiB" % (usage.kind, usage.name, width, height, usage.size / mib))
+
+
+def get_resized_resolution(width, height, max_size):
+    """ The resolution that ImageExporter.export() produces for this max_size """
+    scale = max_size / max(width, height) if max_size else 1
+    if scale >= 1:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _apply_budget(usages, budget):
+    """ Halves the resolution of the largest image until all images fit into the budget """
+    usages = list(usages)
+    total = sum(usage.size for usage in usages)
+    # Max-heap of (negative size, index)
+    heap = [(-usage.size, index) for index, usage in enumerate(usages) if usage.resizable]
+    heapq.heapify(heap)
+
+    while total > budget and heap:
+        _, index = heapq.heappop(heap)
+        usage = usages[index]
+        longest_side = usage.longest_side
+
+        if longest_side <= MIN_TEXTURE_SIZE:
+            continue
+
+        total -= usage.size
+        usage.max_size = max(MIN_TEXTURE_SIZE, longest_side // 2)
+        total += usage.size
+        heapq.heappush(heap, (-usage.size, index))
+
+
+def _collect(scene):
+    usages = {}
+    node_trees = set()
+
+    for obj in scene.objects:
+        if obj.type == "LAMP":
+            lamp = obj.data
+            if lamp.luxcore.image:
+                _add_image(usages, lamp.luxcore.image, "Lamp")
+            if lamp.luxcore.ies.use:
+                _add_ies(usages, lamp.luxcore.ies, lamp.library)
+
+        for slot in obj.material_slots:
+            if slot.material and slot.material.luxcore.node_tree:
+                node_trees.add(slot.material.luxcore.node_tree)
+
+    world = scene.world
+    if world:
+        if world.luxcore.image and world.luxcore.light == "infinite":
+            _add_image(usages, world.luxcore.image, "World")
+        if world.luxcore.volume:
+            node_trees.add(world.luxcore.volume)
+
+    if scene.camera and scene.camera.type == "CAMERA" and scene.camera.data.luxcore.volume:
+        node_trees.add(scene.camera.data.luxcore.volume)
+
+    for node_tree in node_trees:
+        # Also finds the nodes in linked texture and volume node trees
+        for node in utils_node.find_nodes(node_tree, "LuxCoreNodeTexImagemap"):
+            if node.image:
+                _add_image(usages, node.image, "Imagemap")
+
+    return usages
+
+
+def _add_image(usages, image, kind):
+    key = utils.make_key(image)
+    if key in usages:
+        return
+
+    info = None
+    if image.source == "FILE" and not image.packed_file:
+        try:
+            filepath = utils.get_abspath(image.filepath, library=image.library,
+                                         must_exist=True, must_be_existing_file=True)
+            info = image_info.read(filepath)
+        except OSError:
+            # The export will report the missing file
+            return
+    elif image.packed_file:
+        info = image_info.read_bytes(image.packed_file.data)
+
+    if info:
+        usages[key] = TextureUsage(image.name, kind, info.width, info.height,
+                                   info.channels, info.bytes_per_channel)
+    else:
+        # Generated or unsupported format, we have to ask Blender (this loads the image)
+        width, height = image.size
+        if width == 0 or height == 0:
+            return
+        # Generated images are saved in their file format, which we can read after saving.
+        # For other unsupported formats, ImageExporter can't read the resolution and
+        # does not downscale them, so the budget must not count on it.
+        resizable = image.source == "GENERATED"
+        usages[key] = TextureUsage(image.name, kind, width, height,
+                                   image.channels, 4 if image.is_float else 1, resizable)
+
+
+def _add_ies(usages, ies, library):
+    if ies.file_type == "TEXT" and ies.file_text:
+        name = ies.file_text.name
+    elif ies.file_type == "PATH" and ies.file_path:
+        name = utils.get_abspath(ies.file_path, library)
+    else:
+        return
+
+    key = "IES_" + name
+    if key not in usages:
+        usages[key] = TextureUsage(name, "IES", ies.map_width, ies.map_height,
+                                   IES_CHANNELS, IES_BYTES_PER_CHANNEL, resizable=False)
@@ -5,6 +5,7 @@ from .. import utils
 from ..utils import node as utils_node
 from ..utils import ui as utils_ui
 from ..ui import ICON_MATERIAL, ICON_TEXTURE, ICON_VOLUME
+from ..utils.profiler import Profiler
 
 TREE_TYPES = (
     "luxcore_material_nodes",
@@ -74,7 +75,8 @@ class LuxCoreNode(Node):
             # Nodes can return a different luxcore_name than the one that
             # is passed in to sub_export, for example when an implicit scale
             # texture is added.
-            luxcore_name = self.sub_export(exporter, props, luxcore_name)
+            with Profiler.section("Node", self.bl_label):
+                luxcore_name = self.sub_export(exporter, props, luxcore_name)
             exporter.node_cache[cache_key] = luxcore_name
             return luxcore_name
 
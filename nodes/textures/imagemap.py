@@ -151,7 +151,7 @@ class LuxCoreNodeTexImagemap(LuxCoreNodeTexture):
                 return [0, 0, 0]
 
         try:
-            filepath = ImageExporter.export(self.image)
+            filepath = ImageExporter.export(self.image, exporter.get_image_max_size(self.image))
         except OSError as error:
             msg = 'Node "%s" in tree "%s": %s' % (self.name, self.id_data.name, error)
             exporter.scene.luxcore.errorlog.add_warning(msg)
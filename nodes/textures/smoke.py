@@ -5,6 +5,7 @@ from time import time
 from bpy.props import EnumProperty, PointerProperty, StringProperty
 from ...bin import pyluxcore
 from ...export import smoke
+from ...utils.profiler import Profiler
 from ... import utils
 from ...utils import node as utils_node
 from .. import LuxCoreNodeTexture
@@ -97,16 +98,25 @@ class LuxCoreNodeTexSmoke(LuxCoreNodeTexture):
         tex_rot2 = mathutils.Matrix.Rotation(math.radians(rotate[2]), 4, 'Z')
         tex_rot = tex_rot0 * tex_rot1 * tex_rot2
 
+        with Profiler.section("Smoke", "%s: %s" % (self.domain.name, self.source)):
+            sparse_grid = smoke.get_grid(exporter, self.domain, self.source)
+            # Only the bounding box of the non-empty cells is exported
+            grid = sparse_grid.to_dense()
+        nx, ny, nz = sparse_grid.crop_resolution
+
+        # Map the texture space to the bounding box (cell indices are in [0, resolution))
+        tex_crop = mathutils.Matrix.Translation([low / res for low, res in zip(sparse_grid.bbox_min,
+                                                                                 sparse_grid.resolution)])
+        for i in range(3):
+            tex_crop[i][i] = (sparse_grid.bbox_max[i] - sparse_grid.bbox_min[i]) / sparse_grid.resolution[i]
+
         # combine transformations
         mapping_type = 'globalmapping3d'
-        matrix_transformation = utils.matrix_to_list(tex_loc * tex_rot * tex_sca,
+        matrix_transformation = utils.matrix_to_list(tex_loc * tex_rot * tex_sca * tex_crop,
                                                      scene=exporter.scene,
                                                      apply_worldscale=True,
                                                      invert=True)
 
-        resolution, grid = smoke.convert(self.domain, self.source)
-        nx, ny, nz = resolution
-
         definitions = {
             "type": "densitygrid",
             "wrap": "black",
@@ -126,7 +136,8 @@ class LuxCoreNodeTexSmoke(LuxCoreNodeTexture):
         if self.source == "color":
             prop = pyluxcore.Property(prefix + "data3", [])
             # Omit every 4th element because the color_grid contains 4 values per cell
-            # but LuxCore expects 3 values per cell (r, g, b)
+            # but LuxCore expects 3 values per cell (r, g, b). The stride is applied while
+            # copying from the array, so no RGB copy of the grid is needed.
             prop.AddAllFloat(grid, 3, 1)
         elif self.source == "velocity":
             prop = pyluxcore.Property(prefix + "data3", [])
@@ -135,11 +146,8 @@ class LuxCoreNodeTexSmoke(LuxCoreNodeTexture):
             prop = pyluxcore.Property(prefix + "data", [])
             prop.AddAllFloat(grid)
 
-        # We have to free the memory manually because the grid can be VERY large
-        # and if we don't invoke the garbage collection, we use way more RAM than necessary
+        # The grid can be VERY large, free it as soon as it was copied into the property
         del grid
-        import gc
-        gc.collect()
 
         props.Set(prop)
 
@@ -1,7 +1,8 @@
 import webbrowser
 
 import bpy
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty
+from bpy_extras.io_utils import ExportHelper
 
 # Ensure initialization (note: no need to initialize utils)
 from . import (
@@ -10,6 +11,10 @@ from . import (
     pyluxcoretools, texture, update, world,
 )
 from .utils import init_vol_node_tree, poll_node
+from ..export.image import ImageExporter
+from ..export.mesh_cache import MeshCache
+from ..export.texture_memory import TextureMemory
+from ..utils.profiler import Profiler
 
 
 class LUXCORE_OT_errorlog_clear(bpy.types.Operator):
@@ -22,6 +27,70 @@ class LUXCORE_OT_errorlog_clear(bpy.types.Operator):
         return {"FINISHED"}
 
 
+class LUXCORE_OT_clear_mesh_cache(bpy.types.Operator):
+    bl_idname = "luxcore.clear_mesh_cache"
+    bl_label = "Clear Mesh Cache"
+    bl_description = "Delete all cached meshes from the mesh cache directory"
+
+    def execute(self, context):
+        MeshCache.clear(context)
+        return {"FINISHED"}
+
+
+class LUXCORE_OT_clear_image_cache(bpy.types.Operator):
+    bl_idname = "luxcore.clear_image_cache"
+    bl_label = "Clear Image Cache"
+    bl_description = "Delete all cached images from the image cache directory"
+
+    def execute(self, context):
+        ImageExporter.clear(context)
+        return {"FINISHED"}
+
+
+class LUXCORE_OT_analyze_texture_memory(bpy.types.Operator):
+    bl_idname = "luxcore.analyze_texture_memory"
+    bl_label = "Analyze Texture Memory"
+    bl_description = "Estimate how much memory the images of this scene need in a final render"
+
+    def execute(self, context):
+        config = context.scene.luxcore.config
+        max_size = config.texture_max_size if config.use_texture_max_size else 0
+        budget = config.texture_budget * 1024 * 1024 if config.use_texture_budget else 0
+        TextureMemory.analyze(context.scene, max_size, budget)
+        TextureMemory.print_report()
+        return {"FINISHED"}
+
+
+class LUXCORE_OT_save_export_profile(bpy.types.Operator, ExportHelper):
+    bl_idname = "luxcore.save_export_profile"
+    bl_label = "Save Export Profile"
+    bl_description = "Save the timings recorded by the export profiler"
+
+    format_items = [
+        ("REPORT", "Report", "Aggregated timings per category and name", 0),
+        ("CHROME_TRACE", "Chrome Trace", "All recorded sections, can be opened in chrome://tracing", 1),
+    ]
+    format = EnumProperty(name="Format", items=format_items, default="REPORT")
+    filter_glob = StringProperty(default="*.json", options={'HIDDEN'})
+    filename_ext = ".json"  # required by ExportHelper
+
+    @classmethod
+    def poll(cls, context):
+        return bool(Profiler.events)
+
+    def execute(self, context):
+        try:
+            if self.format == "REPORT":
+                Profiler.save_json(self.filepath, context.scene.luxcore.config.export_profiler_sort)
+            else:
+                Profiler.save_chrome_trace(self.filepath)
+        except OSError as error:
+            self.report({"ERROR"}, str(error))
+            return {"CANCELLED"}
+
+        return {"FINISHED"}
+
+
 class LUXCORE_OT_switch_texture_context(bpy.types.Operator):
     bl_idname = "luxcore.switch_texture_context"
     bl_label = ""
@@ -1,5 +1,20 @@
 from os.path import basename, dirname
 from bpy.types import AddonPreferences
+from bpy.props import BoolProperty, StringProperty, IntProperty
+
+
+MESH_CACHE_DESC = (
+    "Store the tessellated meshes of final renders on disk and re-use them "
+    "in later renders if the mesh and its modifiers did not change"
+)
+MESH_CACHE_DIR_DESC = "Directory for the mesh cache files (if empty, a folder in the temp directory is used)"
+MESH_CACHE_SIZE_DESC = "When the cache grows larger than this, the least recently used meshes are deleted"
+IMAGE_CACHE_DESC = (
+    "Keep the files of packed and generated images after Blender is closed and "
+    "re-use them in later renders if the image did not change"
+)
+IMAGE_CACHE_DIR_DESC = "Directory for the image cache files (if empty, a folder in the temp directory is used)"
+IMAGE_CACHE_SIZE_DESC = "When the cache grows larger than this, the least recently used images are deleted"
 
 
 class LuxCoreAddonPreferences(AddonPreferences):
@@ -8,7 +23,12 @@ class LuxCoreAddonPreferences(AddonPreferences):
     # We use dirname() two times to go up one level in the file system
     bl_idname = basename(dirname(dirname(__file__)))
 
-    # We could add properties here
+    use_mesh_cache = BoolProperty(name="Use Mesh Cache", default=False, description=MESH_CACHE_DESC)
+    mesh_cache_dir = StringProperty(name="Cache Directory", subtype="DIR_PATH", description=MESH_CACHE_DIR_DESC)
+    mesh_cache_size = IntProperty(name="Max. Size (MB)", default=4096, min=16, description=MESH_CACHE_SIZE_DESC)
+    use_image_cache = BoolProperty(name="Use Image Cache", default=False, description=IMAGE_CACHE_DESC)
+    image_cache_dir = StringProperty(name="Cache Directory", subtype="DIR_PATH", description=IMAGE_CACHE_DIR_DESC)
+    image_cache_size = IntProperty(name="Max. Size (MB)", default=2048, min=16, description=IMAGE_CACHE_SIZE_DESC)
 
     def draw(self, context):
         layout = self.layout
@@ -18,3 +38,20 @@ class LuxCoreAddonPreferences(AddonPreferences):
         row.operator("luxcore.change_version")
         # Add empty space to the right of the button
         row.label()
+
+        layout.separator()
+        layout.prop(self, "use_mesh_cache")
+        col = layout.column()
+        col.active = self.use_mesh_cache
+        col.prop(self, "mesh_cache_dir")
+        row = col.row()
+        row.prop(self, "mesh_cache_size")
+        row.operator("luxcore.clear_mesh_cache")
+
+        layout.prop(self, "use_image_cache")
+        col = layout.column()
+        col.active = self.use_image_cache
+        col.prop(self, "image_cache_dir")
+        row = col.row()
+        row.prop(self, "image_cache_size")
+        row.operator("luxcore.clear_image_cache")
@@ -75,6 +75,27 @@ MAX_CONSECUTIVE_REJECT_DESC = (
 
 IMAGE_MUTATION_RATE_DESC = "Maximum distance over the image plane for a small mutation"
 
+PIPELINED_EXPORT_DESC = (
+    "Parse the exported objects on a separate thread while the next objects "
+    "are extracted from Blender. Can speed up the export of large scenes"
+)
+
+EXPORT_PROFILER_DESC = (
+    "Record how long the export of each object, mesh, node etc. takes. "
+    "The report is shown in the Export Profiler panel"
+)
+
+LIMIT_TEXTURE_SIZE_DESC = (
+    "Use downscaled copies of image textures that are larger than the maximum size. "
+    "The copies are stored in the image cache and re-used in later renders"
+)
+TEXTURE_MAX_SIZE_DESC = "Maximum width/height of image textures in final renders"
+TEXTURE_MAX_SIZE_VIEWPORT_DESC = "Maximum width/height of image textures in viewport and material preview renders"
+TEXTURE_BUDGET_DESC = (
+    "Estimate the memory of all images before the render starts and downscale "
+    "the largest images until all of them fit into the budget"
+)
+
 
 class LuxCoreConfigPath(PropertyGroup):
     """
@@ -227,6 +248,27 @@ class LuxCoreConfig(PropertyGroup):
     filesaver_format = EnumProperty(name="", items=filesaver_format_items, default="BIN")
     filesaver_path = StringProperty(name="", subtype="DIR_PATH")
 
+    # Export options
+    use_pipelined_export = BoolProperty(name="Pipelined Export", default=False,
+                                        description=PIPELINED_EXPORT_DESC)
+    use_export_profiler = BoolProperty(name="Export Profiler", default=False,
+                                       description=EXPORT_PROFILER_DESC)
+    export_profiler_sort_items = [
+        ("TOTAL", "Total Time", "Sort by the sum of all times", 0),
+        ("MAX", "Max. Time", "Sort by the longest single time", 1),
+        ("COUNT", "Count", "Sort by how often the section was recorded", 2),
+        ("NAME", "Name", "Sort by category and name", 3),
+    ]
+    export_profiler_sort = EnumProperty(name="Sort By", items=export_profiler_sort_items, default="TOTAL")
+    use_texture_max_size = BoolProperty(name="Limit Texture Size", default=False,
+                                        description=LIMIT_TEXTURE_SIZE_DESC)
+    texture_max_size = IntProperty(name="Final", default=4096, min=64, subtype="PIXEL",
+                                   description=TEXTURE_MAX_SIZE_DESC)
+    texture_max_size_viewport = IntProperty(name="Viewport", default=1024, min=64, subtype="PIXEL",
+                                            description=TEXTURE_MAX_SIZE_VIEWPORT_DESC)
+    use_texture_budget = BoolProperty(name="Texture Budget", default=False, description=TEXTURE_BUDGET_DESC)
+    texture_budget = IntProperty(name="Budget (MB)", default=4096, min=16, description=TEXTURE_BUDGET_DESC)
+
     # Seed
     seed = IntProperty(name="Seed", default=1, min=1, description=SEED_DESC)
     use_animated_seed = BoolProperty(name="Animated Seed", default=False, description=ANIM_SEED_DESC)
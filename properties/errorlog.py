@@ -1,7 +1,11 @@
 import bpy
 from bpy.types import PropertyGroup
+from collections import deque
 from ..utils import ui as utils_ui
 
+# Older messages are dropped when more than this many errors or warnings are logged
+MAX_MESSAGES = 200
+
 
 class LuxCoreError:
     def __init__(self, message):
@@ -18,42 +22,68 @@ class LuxCoreErrorLog(PropertyGroup):
     But not every small export warning that can happen in normal Blender scenes,
     do not report: object without mesh data (aka Empty) or mesh without faces (e.g. curves used in modifiers)
     """
-    errors = []
-    warnings = []
+    errors = deque()
+    warnings = deque()
+    # Number of messages that were dropped because the log was full
+    errors_overflow = 0
+    warnings_overflow = 0
+
+    # {message: LuxCoreError}, to find duplicates without searching the lists
+    _error_index = {}
+    _warning_index = {}
+    # The error log panel is only tagged for redraw once until it is drawn
+    _redraw_tagged = False
 
     def add_error(self, message):
-        self._add("ERROR:", self.errors, message)
+        if self._add("ERROR:", LuxCoreErrorLog.errors, LuxCoreErrorLog._error_index, message):
+            LuxCoreErrorLog.errors_overflow += 1
 
     def add_warning(self, message):
-        self._add("WARNING:", self.warnings, message)
+        if self._add("WARNING:", LuxCoreErrorLog.warnings, LuxCoreErrorLog._warning_index, message):
+            LuxCoreErrorLog.warnings_overflow += 1
 
     def clear(self):
-        self.errors.clear()
-        self.warnings.clear()
+        LuxCoreErrorLog.errors.clear()
+        LuxCoreErrorLog.warnings.clear()
+        LuxCoreErrorLog._error_index.clear()
+        LuxCoreErrorLog._warning_index.clear()
+        LuxCoreErrorLog.errors_overflow = 0
+        LuxCoreErrorLog.warnings_overflow = 0
+        self._tag_redraw()
 
-        try:
-            # Force the panel to update (if we don't do this, the added warnings
-            # are only visible after the user moves the mouse over the error log panel)
-            utils_ui.tag_region_for_redraw(bpy.context, "PROPERTIES", "WINDOW")
-        except AttributeError:
-            # print("Can't tag errorlog for redraw in _RestrictContext")
-            pass
+    def on_draw(self):
+        """ Has to be called by the error log panel, new messages will tag it for redraw again """
+        LuxCoreErrorLog._redraw_tagged = False
 
-    def _add(self, prefix, collection, message):
-        for elem in collection:
-            if elem.message == message:
-                elem.count += 1
-                # print("Error or warning already logged. Abort adding to collection.")
-                return
+    def _add(self, prefix, collection, index, message):
+        """ Returns True if an old message had to be dropped """
+        message = str(message)
+        elem = index.get(message)
+
+        if elem:
+            elem.count += 1
+            return False
 
         print(prefix, message)
         new = LuxCoreError(message)
         collection.append(new)
+        index[message] = new
+
+        if not LuxCoreErrorLog._redraw_tagged:
+            self._tag_redraw()
+
+        if len(collection) > MAX_MESSAGES:
+            oldest = collection.popleft()
+            del index[oldest.message]
+            return True
+        return False
 
+    def _tag_redraw(self):
         try:
             # Force the panel to update (if we don't do this, the added warnings
             # are only visible after the user moves the mouse over the error log panel)
             utils_ui.tag_region_for_redraw(bpy.context, "PROPERTIES", "WINDOW")
+            LuxCoreErrorLog._redraw_tagged = True
         except AttributeError:
             # print("Can't tag errorlog for redraw in _RestrictContext")
             pass
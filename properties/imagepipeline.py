@@ -159,3 +159,7 @@ class LuxCoreImagepipeline(PropertyGroup):
     backgroundimage = PointerProperty(type=LuxCoreImagepipelineBackgroundImage)
     camera_response_func = PointerProperty(type=LuxCoreImagepipelineCameraResponseFunc)
     contour_lines = PointerProperty(type=LuxCoreImagepipelineContourLines)
+
+    def has_nonlocal_plugins(self):
+        """ True if a plugin is enabled that spreads the value of a pixel to its neighbours """
+        return self.bloom.enabled or self.coloraberration.enabled or self.contour_lines.enabled
@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: compare the old per-point hair export loop with the vectorised
+strand assembly in export/hair.py on a synthetic strand set.
+Both variants fetch the points through co_hair(), like the real export.
+
+Run with:
+blender -b --addons BlendLuxCore --factory-startup -noaudio --python hair_strands.py
+"""
+
+from time import time
+import numpy
+from mathutils import Matrix, Vector
+
+# import the already loaded addon
+import BlendLuxCore
+from BlendLuxCore.export import hair
+
+STRAND_COUNT = 100000
+STEPS = 8
+ROOT_WIDTH = 0.5
+TIP_WIDTH = 0.1
+WIDTH_OFFSET = 0.2
+HAIR_SIZE = 0.001
+
+
+class FakeParticleSystem:
+    """ Provides co_hair() for precomputed points """
+    def __init__(self, coords):
+        self.coords = coords
+
+    def co_hair(self, obj, pindex, step):
+        return Vector(self.coords[pindex, step])
+
+
+class FakeObject:
+    name = "Emitter"
+
+
+def make_coords():
+    rng = numpy.random.RandomState(0)
+    roots = rng.uniform(-1, 1, (STRAND_COUNT, 1, 3))
+    growth = numpy.linspace(0, 0.1, STEPS + 1).reshape(1, -1, 1) * [0, 0, 1]
+    coords = (roots + growth + rng.normal(0, 0.001, (STRAND_COUNT, STEPS + 1, 3))).astype(numpy.float32)
+    # Some unborn particles (all points at the origin) and some strands with collapsed points
+    coords[::50] = 0
+    coords[1::50, 1:] = coords[1::50, :1]
+    return coords
+
+
+def old_loop(psys, obj, matrix_world):
+    """ The previous implementation (points and thickness only), for comparison """
+    transform = matrix_world.inverted()
+    points = []
+    thickness = []
+    segments = []
+    steps = STEPS
+
+    for pindex in range(STRAND_COUNT):
+        seg_length = 1.0
+        point_count = 0
+
+        for step in range(0, steps + 1):
+            co = psys.co_hair(obj, pindex, step)
+            if step > 0 and points:
+                seg_length = (co - matrix_world * points[-1]).length_squared
+
+            if not (co.length_squared == 0 or seg_length == 0):
+                points.append(transform * co)
+
+                if step > steps * WIDTH_OFFSET:
+                    thick = (ROOT_WIDTH * (steps - step - 1) + TIP_WIDTH * (
+                                step - steps * WIDTH_OFFSET)) / (
+                                steps * (1 - WIDTH_OFFSET) - 1)
+                else:
+                    thick = ROOT_WIDTH
+
+                thickness.append(thick * HAIR_SIZE)
+                point_count += 1
+
+        if point_count == 1:
+            points.pop()
+            thickness.pop()
+        elif point_count > 1:
+            segments.append(point_count - 1)
+
+    return [tuple(point) for point in points], segments, thickness
+
+
+def vectorised(psys, obj, matrix_world):
+    coords = hair._get_hair_coords(obj, psys, 0, STRAND_COUNT, STEPS, None)
+    step_thickness = hair._get_step_thickness(STEPS, ROOT_WIDTH, TIP_WIDTH, WIDTH_OFFSET) * HAIR_SIZE
+    transform = numpy.array(matrix_world.inverted(), dtype=numpy.float32)
+    points, segments, _, thickness = hair.build_strands(coords, transform, step_thickness)
+    return hair._to_tuples(points), segments.tolist(), thickness.tolist()
+
+
+def bench():
+    psys = FakeParticleSystem(make_coords())
+    obj = FakeObject()
+    matrix_world = Matrix.Translation((1, 2, 3))
+
+    results = []
+    for func in (old_loop, vectorised):
+        start = time()
+        results.append(func(psys, obj, matrix_world))
+        print("%-12s %d strands x %d steps: %.2f s" % (func.__name__, STRAND_COUNT, STEPS + 1, time() - start))
+
+    (old_points, old_segments, _), (new_points, new_segments, _) = results
+    assert old_segments == new_segments
+    assert numpy.allclose(old_points, new_points, atol=1e-5)
+
+
+bench()
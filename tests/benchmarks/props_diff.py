@@ -0,0 +1,99 @@
+"""
+Micro-benchmark: compare the old string comparison (StringCache) with the
+PropertiesCache diff on realistic imagepipeline and config properties.
+
+Run with:
+blender -b --addons BlendLuxCore --factory-startup -noaudio --python props_diff.py
+"""
+
+from timeit import timeit
+
+# import the already loaded addon
+import BlendLuxCore
+from BlendLuxCore.bin import pyluxcore
+from BlendLuxCore.export.caches import PropertiesCache
+
+ITERATIONS = 10000
+
+IMAGEPIPELINE = """
+film.imagepipelines.0.0.type = "NOP"
+film.imagepipelines.0.1.type = "TONEMAP_LINEAR"
+film.imagepipelines.0.1.scale = 1.0
+film.imagepipelines.0.2.type = "BLOOM"
+film.imagepipelines.0.2.radius = 0.07
+film.imagepipelines.0.2.weight = 0.25
+film.imagepipelines.0.3.type = "VIGNETTING"
+film.imagepipelines.0.3.scale = 0.4
+film.imagepipelines.0.4.type = "CAMERA_RESPONSE_FUNC"
+film.imagepipelines.0.4.name = "Advantix_100CD"
+film.imagepipelines.0.radiancescales.0.enabled = 1
+film.imagepipelines.0.radiancescales.0.globalscale = 1.0
+film.imagepipelines.0.radiancescales.0.rgbscale = 1.0 1.0 1.0
+film.imagepipelines.0.radiancescales.1.enabled = 1
+film.imagepipelines.0.radiancescales.1.globalscale = 2.0
+film.imagepipelines.0.radiancescales.1.rgbscale = 1.0 0.5 0.25
+"""
+
+CONFIG = """
+renderengine.type = "PATHCPU"
+sampler.type = "SOBOL"
+sampler.sobol.adaptive.strength = 0.7
+film.width = 1920
+film.height = 1080
+film.filter.type = "BLACKMANHARRIS"
+film.filter.width = 1.5
+path.pathdepth.total = 6
+path.pathdepth.diffuse = 4
+path.pathdepth.glossy = 4
+path.pathdepth.specular = 6
+path.clamping.variance.maxvalue = 0
+lightstrategy.type = "LOG_POWER"
+scene.epsilon.min = 1e-05
+scene.epsilon.max = 0.1
+renderengine.seed = 1
+batch.haltthreshold = 0.0001
+batch.haltthreshold.stoprendering.enable = 0
+batch.halttime = 0
+batch.haltspp = 0
+""" + "\n".join("film.outputs.%d.type = \"RGB_IMAGEPIPELINE\"\nfilm.outputs.%d.index = %d" % (i, i, i)
+                for i in range(20))
+
+
+class StringCache(object):
+    """ The previous implementation, for comparison """
+    def __init__(self):
+        self.props = None
+
+    def diff(self, new_props):
+        props_str = str(self.props)
+        new_props_str = str(new_props)
+
+        if self.props is None:
+            self.props = new_props
+            return True
+
+        has_changes = props_str != new_props_str
+        self.props = new_props
+        return has_changes
+
+
+def bench(name, props_str, changed_key, changed_value):
+    unchanged = pyluxcore.Properties()
+    unchanged.SetFromString(props_str)
+    changed = pyluxcore.Properties(unchanged)
+    changed.Set(pyluxcore.Property(changed_key, changed_value))
+
+    for cache_class in (StringCache, PropertiesCache):
+        cache = cache_class()
+        cache.diff(unchanged)
+
+        t_unchanged = timeit(lambda: cache.diff(unchanged), number=ITERATIONS)
+        t_changed = timeit(lambda: (cache.diff(changed), cache.diff(unchanged)), number=ITERATIONS // 2)
+
+        print("%-14s %-16s unchanged: %7.2f us/diff   changed: %7.2f us/diff"
+              % (name, cache_class.__name__,
+                 t_unchanged / ITERATIONS * 1e6, t_changed / ITERATIONS * 1e6))
+
+
+bench("imagepipeline", IMAGEPIPELINE, "film.imagepipelines.0.1.scale", 2.0)
+bench("config", CONFIG, "film.width", 1280)
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark: compare the old list(grid) smoke export with the array based
+export in export/smoke.py on a synthetic 512^3 density grid.
+Peak memory only grows, so every variant has to be measured in its own process.
+
+Run with:
+blender -b --addons BlendLuxCore --factory-startup -noaudio --python smoke_grid.py -- <variant>
+where <variant> is one of: list, iter, foreach_get
+"""
+
+import resource
+import sys
+from array import array
+from time import time
+import numpy
+
+# import the already loaded addon
+import BlendLuxCore
+from BlendLuxCore.bin import pyluxcore
+from BlendLuxCore.export import smoke
+
+RESOLUTION = 512
+
+
+class FakeGrid:
+    """ Float array with foreach_get(), like the grids of newer Blender versions """
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def foreach_get(self, buffer):
+        buffer[:] = self.data
+
+
+def make_grid():
+    # Distinct values per cell, like a real simulation
+    count = RESOLUTION ** 3
+    return array("f", numpy.linspace(0, 1, count, dtype=numpy.float32).tobytes())
+
+
+def old_list(grid):
+    """ The previous implementation, for comparison """
+    return list(grid)
+
+
+def iterated(grid):
+    # Blender 2.79 code path (no foreach_get on float arrays)
+    return smoke.grid_to_array(grid)
+
+
+def foreach_get(grid):
+    return smoke.grid_to_array(FakeGrid(grid))
+
+
+VARIANTS = {
+    "list": old_list,
+    "iter": iterated,
+    "foreach_get": foreach_get,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(variant):
+    grid = make_grid()
+    base_rss = peak_rss_mb()
+
+    start = time()
+    data = VARIANTS[variant](grid)
+    convert_time = time() - start
+
+    start = time()
+    prop = pyluxcore.Property("scene.textures.smoke.data", [])
+    prop.AddAllFloat(data)
+    property_time = time() - start
+    assert prop.GetSize() == len(grid)
+
+    print("%-12s %d^3 cells: convert %.2f s, AddAllFloat %.2f s, peak RSS +%.0f MB"
+          % (variant, RESOLUTION, convert_time, property_time, peak_rss_mb() - base_rss))
+
+
+args = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+bench(args[0] if args else "foreach_get")
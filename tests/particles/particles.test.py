@@ -6,6 +6,7 @@ from BlendLuxCore.bin import pyluxcore
 from BlendLuxCore.export import Exporter
 from BlendLuxCore import utils
 import bpy
+import numpy
 
 TEST_FRAME = 3
 TEST_SUBFRAME = 0.0
@@ -105,6 +106,39 @@ class TestParticles(unittest.TestCase):
                 kd_tex_prefix = "scene.textures." + kd_tex_name
                 assertListsAlmostEqual(self, scene_props.Get(kd_tex_prefix + ".value").GetFloats(), [0.7, 0.0, 0.0])
 
+    def test_non_invertible_matrices_deterministic(self):
+        blender_scene = bpy.context.scene
+        settings = bpy.data.objects["Emitter"].particle_systems[0].settings
+        original_size = settings.particle_size
+
+        try:
+            # All particles get a scale of 0, so their matrices are non-invertible
+            settings.particle_size = 0
+            first_export = export(blender_scene).ToString()
+            second_export = export(blender_scene).ToString()
+        finally:
+            settings.particle_size = original_size
+
+        # The matrices are regularized without randomness, so repeated exports are identical
+        self.assertEqual(first_export.encode(), second_export.encode())
+
+    def test_regularize_matrices(self):
+        zero_scale = [
+            0, 0, 0, 0,
+            0, 1, 0, 0,
+            0, 0, 1, 0,
+            1, 2, 3, 1,
+        ]
+        matrices = numpy.array([zero_scale] * 2, dtype=numpy.float32)
+        first, count = utils.matrices_to_array(matrices)
+        second, _ = utils.matrices_to_array(matrices)
+
+        self.assertEqual(count, 2)
+        self.assertEqual(first.tobytes(), second.tobytes())
+        self.assertTrue((numpy.linalg.det(first.reshape(-1, 4, 4)) != 0).all())
+        # The translation is not changed
+        assertListsAlmostEqual(self, first[0, 12:].tolist(), [1, 2, 3, 1])
+
 
 # we have to manually invoke the test runner here, as we cannot use the CLI
 suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestParticles)
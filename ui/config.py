@@ -222,3 +222,11 @@ class LUXCORE_RENDER_PT_device_settings(RenderButtonsPanel, Panel):
             col = layout.column()
             col.label(text="CPU Threads:")
             self._draw_cpu_settings(col, context)
+
+        layout.prop(config, "use_pipelined_export")
+
+        layout.prop(config, "use_texture_max_size")
+        row = layout.row(align=True)
+        row.active = config.use_texture_max_size
+        row.prop(config, "texture_max_size")
+        row.prop(config, "texture_max_size_viewport")
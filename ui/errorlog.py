@@ -18,15 +18,17 @@ class LUXCORE_RENDER_PT_error_log(RenderButtonsPanel, Panel):
 
     def draw_header(self, context):
         errorlog = context.scene.luxcore.errorlog
+        # The header is also drawn when the panel is collapsed
+        errorlog.on_draw()
         text = "("
         icon = "NONE"
         if errorlog.errors:
-            text += utils.pluralize("%d Error", len(errorlog.errors))
+            text += utils.pluralize("%d Error", len(errorlog.errors) + errorlog.errors_overflow)
             icon = ICON_ERROR
         if errorlog.warnings:
             if text != "(":
                 text += ", "
-            text += utils.pluralize("%d Warning", len(errorlog.warnings))
+            text += utils.pluralize("%d Warning", len(errorlog.warnings) + errorlog.warnings_overflow)
             if icon == "NONE":
                 icon = ICON_WARNING
 
@@ -39,14 +41,15 @@ class LUXCORE_RENDER_PT_error_log(RenderButtonsPanel, Panel):
 
     def draw(self, context):
         errorlog = context.scene.luxcore.errorlog
+        errorlog.on_draw()
 
         if errorlog.errors or errorlog.warnings:
             self.layout.operator("luxcore.errorlog_clear", icon="X")
 
-        self._draw(errorlog.errors, "Errors:", ICON_ERROR)
-        self._draw(errorlog.warnings, "Warnings:", ICON_WARNING)
+        self._draw(errorlog.errors, errorlog.errors_overflow, "Errors:", ICON_ERROR)
+        self._draw(errorlog.warnings, errorlog.warnings_overflow, "Warnings:", ICON_WARNING)
 
-    def _draw(self, errors_or_warnings, label, icon="NONE"):
+    def _draw(self, errors_or_warnings, overflow, label, icon="NONE"):
         if len(errors_or_warnings) == 0:
             return
 
@@ -55,14 +58,17 @@ class LUXCORE_RENDER_PT_error_log(RenderButtonsPanel, Panel):
         box = col.box()
         box.label(text=label)
 
+        if overflow:
+            box.label(text=utils.pluralize("%d older message", overflow) + " not shown (see console)")
+
         box = col.box()
         for elem in errors_or_warnings:
             row = box.row()
 
             text = elem.message
             if elem.count > 1:
-                text += str(elem.count) + "x"
+                text += " (%dx)" % elem.count
 
-            row.label(elem.message, icon=icon)
+            row.label(text, icon=icon)
             op = row.operator("luxcore.copy_error_to_clipboard", icon="COPYDOWN")
             op.message = elem.message
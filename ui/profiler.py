@@ -0,0 +1,58 @@
+from bl_ui.properties_render import RenderButtonsPanel
+from bpy.types import Panel
+from ..utils.profiler import Profiler
+
+# The full report can be saved to a file
+MAX_ROWS = 30
+
+
+class LUXCORE_RENDER_PT_export_profiler(RenderButtonsPanel, Panel):
+    COMPAT_ENGINES = {"LUXCORE"}
+    bl_label = "LuxCore Export Profiler"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.render.engine == "LUXCORE"
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.luxcore.config, "use_export_profiler", text="")
+
+    def draw(self, context):
+        config = context.scene.luxcore.config
+        layout = self.layout
+
+        if not Profiler.events:
+            layout.label("Enable the profiler and start a render to record a profile", icon="INFO")
+            return
+
+        layout.prop(config, "export_profiler_sort")
+
+        row = layout.row(align=True)
+        op = row.operator("luxcore.save_export_profile", text="Save Report", icon="FILE_TEXT")
+        op.format = "REPORT"
+        op = row.operator("luxcore.save_export_profile", text="Save Chrome Trace", icon="TIME")
+        op.format = "CHROME_TRACE"
+
+        report = Profiler.get_report(config.export_profiler_sort)
+
+        col = layout.column(align=True)
+        box = col.box()
+        self._draw_row(box, "Category", "Name", "Count", "Total (s)", "Max (s)")
+
+        box = col.box()
+        for category, name, count, total, max_time in report[:MAX_ROWS]:
+            self._draw_row(box, category, name, str(count), "%.3f" % total, "%.3f" % max_time)
+
+        if len(report) > MAX_ROWS:
+            layout.label("%d more entries (save the report to see all)" % (len(report) - MAX_ROWS))
+
+    def _draw_row(self, layout, category, name, count, total, max_time):
+        split = layout.split(percentage=0.2)
+        split.label(category)
+        split = split.split(percentage=0.55)
+        split.label(name)
+        row = split.row()
+        row.label(count)
+        row.label(total)
+        row.label(max_time)
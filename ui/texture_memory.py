@@ -0,0 +1,65 @@
+from bl_ui.properties_render import RenderButtonsPanel
+from bpy.types import Panel
+from ..export.texture_memory import TextureMemory, get_resized_resolution
+
+# The full report is printed to the console
+MAX_ROWS = 30
+MIB = 1024 * 1024
+
+
+class LUXCORE_RENDER_PT_texture_memory(RenderButtonsPanel, Panel):
+    COMPAT_ENGINES = {"LUXCORE"}
+    bl_label = "LuxCore Texture Memory"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.render.engine == "LUXCORE"
+
+    def draw(self, context):
+        config = context.scene.luxcore.config
+        layout = self.layout
+
+        row = layout.row()
+        row.prop(config, "use_texture_budget")
+        sub = row.row()
+        sub.active = config.use_texture_budget
+        sub.prop(config, "texture_budget")
+
+        layout.operator("luxcore.analyze_texture_memory", icon="IMAGE_COL")
+
+        if not TextureMemory.analyzed:
+            return
+
+        total = TextureMemory.get_total()
+        full_total = TextureMemory.get_total(full_resolution=True)
+        layout.label("Total: %.1f MiB (full resolution: %.1f MiB)" % (total / MIB, full_total / MIB))
+
+        if TextureMemory.budget and total > TextureMemory.budget:
+            layout.label("The images do not fit into the budget even at the minimum size", icon="ERROR")
+
+        report = TextureMemory.get_report()
+
+        col = layout.column(align=True)
+        box = col.box()
+        self._draw_row(box, "Type", "Name", "Resolution", "MiB")
+
+        box = col.box()
+        for usage in report[:MAX_ROWS]:
+            width, height = get_resized_resolution(usage.width, usage.height, usage.max_size)
+            resolution = "%d x %d" % (width, height)
+            if usage.max_size and (width, height) != (usage.width, usage.height):
+                resolution += " (of %d x %d)" % (usage.width, usage.height)
+            self._draw_row(box, usage.kind, usage.name, resolution, "%.1f" % (usage.size / MIB))
+
+        if len(report) > MAX_ROWS:
+            layout.label("%d more images (the full report is printed to the console)" % (len(report) - MAX_ROWS))
+
+    def _draw_row(self, layout, kind, name, resolution, size):
+        split = layout.split(percentage=0.15)
+        split.label(kind)
+        split = split.split(percentage=0.5)
+        split.label(name)
+        row = split.row()
+        row.label(resolution)
+        row.label(size)
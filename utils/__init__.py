@@ -3,6 +3,7 @@ import mathutils
 import math
 import re
 import os
+import numpy
 from ..bin import pyluxcore
 
 
@@ -19,6 +20,9 @@ class ExportedLight(object):
     def __init__(self, luxcore_name):
         # this is a list to make it compatible with ExportedObject
         self.luxcore_names = [luxcore_name]
+        # export.caches.PropertiesCache of the light definition (only in viewport render),
+        # used to send only changed lights to LuxCore
+        self.props_cache = None
 
 
 def to_luxcore_name(string):
@@ -35,7 +39,12 @@ def make_key(datablock):
     # renamed during viewport render.
     # Note that the memory address changes on undo/redo, but in this case the viewport render
     # is stopped and re-started anyway, so it should not be a problem.
-    return str(datablock.as_pointer())
+    return make_key_from_pointer(datablock.as_pointer())
+
+
+def make_key_from_pointer(pointer):
+    """ Same as make_key(), for code that only tracks the integer memory address """
+    return str(pointer)
 
 
 def make_key_from_name(datablock):
@@ -79,13 +88,6 @@ def get_luxcore_name(datablock, is_viewport_render=True):
     return key
 
 
-def obj_from_key(key, objects):
-    for obj in objects:
-        if key == make_key(obj):
-            return obj
-    return None
-
-
 def create_props(prefix, definitions):
     """
     :param prefix: string, will be prepended to each key part of the definitions.
@@ -128,6 +130,15 @@ def get_scaled_to_world(matrix, scene):
     return matrix
 
 
+# Added to the diagonal of non-invertible matrices, see regularize_matrices()
+NON_INVERTIBLE_EPSILON = 1e-5
+# The first 12 elements of a flattened identity matrix (rotation/scale part, see regularize_matrices())
+IDENTITY_ROTATION_SCALE = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0]
+# Number of non-invertible matrices passed to matrix_to_list() or add_non_invertible_count()
+# since the last pop_non_invertible_count()
+_non_invertible_count = 0
+
+
 def matrix_to_list(matrix, scene=None, apply_worldscale=False, invert=False):
     """
     Flatten a 4x4 matrix into a list
@@ -149,17 +160,121 @@ def matrix_to_list(matrix, scene=None, apply_worldscale=False, invert=False):
 
     if matrix.determinant() == 0:
         # The matrix is non-invertible. This can happen if e.g. the scale on one axis is 0.
-        # Prevent a RuntimeError from LuxCore by adding a small random epsilon.
-        msg = "Non-invertible matrix. Can happen if e.g. an object has scale 0"
-        bpy.context.scene.luxcore.errorlog.add_warning(msg)
-
-        # TODO maybe look for a better way to handle this
-        from random import random
-        return [float(i) + (1e-5 + random() * 1e-5) for i in l]
+        # Prevent a RuntimeError from LuxCore. The exporter warns the user once per export.
+        global _non_invertible_count
+        _non_invertible_count += 1
+        matrices = numpy.array([l], dtype=numpy.float64)
+        regularize_matrices(matrices)
+        return matrices[0].tolist()
     else:
         return [float(i) for i in l]
 
 
+def add_non_invertible_count(count):
+    """ Counts non-invertible matrices that were not passed to matrix_to_list(), e.g. from matrices_to_array() """
+    global _non_invertible_count
+    _non_invertible_count += count
+
+
+def pop_non_invertible_count():
+    """ Returns the number of non-invertible matrices passed to matrix_to_list() and resets the counter """
+    global _non_invertible_count
+    count = _non_invertible_count
+    _non_invertible_count = 0
+    return count
+
+
+def regularize_matrices(matrices):
+    """
+    Make the non-invertible matrices in an array of shape (N, 16) invertible (in place).
+    A small epsilon is added to the diagonal, which fixes e.g. a scale of 0 on one axis.
+    Matrices that are still non-invertible after that are replaced by the identity matrix
+    (keeping their translation), so they are always invertible.
+    The result only depends on the input, so repeated exports are identical.
+    Returns the number of non-invertible matrices (including the replaced ones).
+    """
+    if len(matrices) == 0:
+        return 0
+
+    non_invertible = find_non_invertible(matrices)
+    non_invertible_count = int(numpy.count_nonzero(non_invertible))
+
+    if non_invertible_count:
+        fixed = matrices[non_invertible]
+        epsilon = NON_INVERTIBLE_EPSILON
+
+        # The first attempt is enough unless an axis is scaled by exactly -epsilon
+        for _ in range(3):
+            # Diagonal of the rotation/scale part in the flattened layout
+            fixed[:, [0, 5, 10]] += epsilon
+            still_non_invertible = find_non_invertible(fixed)
+            if not still_non_invertible.any():
+                break
+            epsilon *= 2
+        else:
+            # Give up, but the matrix must be invertible or LuxCore raises an exception
+            failed = fixed[still_non_invertible]
+            failed[:, :12] = IDENTITY_ROTATION_SCALE
+            # The last element might be 0 as well (e.g. a matrix of zeros)
+            failed[:, 15] = 1
+            fixed[still_non_invertible] = failed
+            print("WARNING: Replaced %d non-invertible matrices by identity matrices"
+                  % numpy.count_nonzero(still_non_invertible))
+
+        matrices[non_invertible] = fixed
+
+    return non_invertible_count
+
+
+def find_non_invertible(matrices):
+    """ Returns a bool array that is True for the non-invertible matrices in an array of shape (N, 16) """
+    if len(matrices) == 0:
+        return numpy.zeros(0, dtype=bool)
+    return numpy.linalg.det(matrices.reshape(-1, 4, 4)) == 0
+
+
+def get_matrices(collection, attribute="matrix_world"):
+    """
+    Returns the matrices of all elements in the collection as float32 array of shape (N, 16),
+    in the flattened layout of matrix_to_list() (but without world scale).
+    Uses foreach_get() if collection is a Blender collection, otherwise it can be any sequence.
+    """
+    if hasattr(collection, "foreach_get"):
+        count = len(collection)
+        matrices = numpy.empty(count * 16, dtype=numpy.float32)
+        # Blender stores matrices column-major, which is the layout LuxCore expects
+        collection.foreach_get(attribute, matrices)
+        return matrices.reshape(count, 16)
+
+    return matrices_from_mathutils([getattr(elem, attribute) for elem in collection])
+
+
+def matrices_from_mathutils(matrices):
+    """ Flatten a sequence of 4x4 mathutils.Matrix into a float32 array of shape (N, 16) """
+    rows = numpy.array(matrices, dtype=numpy.float32).reshape(-1, 4, 4)
+    # mathutils matrices are indexed [row][column], LuxCore expects the columns one after another
+    return numpy.ascontiguousarray(rows.transpose(0, 2, 1)).reshape(-1, 16)
+
+
+def matrices_to_array(matrices, scene=None, apply_worldscale=False):
+    """
+    Bulk version of matrix_to_list() for an array of shape (N, 16) (see get_matrices())
+    Returns a new contiguous float32 array of shape (N, 16) and the number of non-invertible matrices.
+    You only have to pass a valid scene if apply_worldscale is True
+    """
+    result = numpy.array(matrices, dtype=numpy.float32).reshape(-1, 16)
+
+    if apply_worldscale:
+        worldscale = get_worldscale(scene, as_scalematrix=False)
+        if worldscale != 1:
+            # Same as get_scaled_to_world(): scale the rotation/scale part and the translation
+            result[:, :15] *= worldscale
+
+    # Prevent a RuntimeError from LuxCore. The caller is responsible for warning the user.
+    non_invertible_count = regularize_matrices(result)
+    return result, non_invertible_count
+
+
 def calc_filmsize_raw(scene, context=None):
     if context:
         # Viewport render
@@ -395,6 +510,12 @@ def is_duplicator_visible(obj):
     return False
 
 
+def get_addon_preferences(context):
+    # The addon name is the name of the addon directory (usually "BlendLuxCore")
+    addon_name = os.path.basename(os.path.dirname(os.path.dirname(__file__)))
+    return context.user_preferences.addons[addon_name].preferences
+
+
 def get_theme(context):
     current_theme_name = context.user_preferences.themes.items()[0][0]
     return context.user_preferences.themes[current_theme_name]
@@ -459,7 +580,8 @@ def use_instancing(obj, scene, context):
         # When using object motion blur, we export all objects as instances
         return True
 
-    # TODO: more checks, e.g. Alt+D copies without modifiers or with equal modifier stacks
+    # Note: Alt+D copies with equivalent modifier stacks are instanced
+    # by the exporter (see find_shared_meshes() in export/blender_object.py)
 
     return False
 
@@ -0,0 +1,222 @@
+"""
+Reads the resolution and pixel format of image files from their headers, without decoding the pixels.
+Supported formats: PNG, JPEG, OpenEXR, Radiance HDR, TIFF, Targa and BMP.
+"""
+import io
+import os
+import struct
+
+# We never need more than this to find the information we are looking for
+HEADER_SIZE = 64 * 1024
+
+# PNG color type: channel count
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+# OpenEXR pixel type: bytes per channel
+EXR_PIXEL_TYPES = {0: 4, 1: 2, 2: 4}
+# TIFF tags
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_BITS_PER_SAMPLE = 258
+TIFF_SAMPLES_PER_PIXEL = 277
+# TIFF field type: (struct format, size in bytes)
+TIFF_TYPES = {1: ("B", 1), 3: ("H", 2), 4: ("I", 4)}
+
+_cache = {}
+
+
+class ImageInfo(object):
+    def __init__(self, width, height, channels, bytes_per_channel):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bytes_per_channel = bytes_per_channel
+
+    @property
+    def decoded_size(self):
+        """ Bytes needed to store the decoded image in RAM """
+        return self.width * self.height * self.channels * self.bytes_per_channel
+
+    def __repr__(self):
+        return "ImageInfo(%d x %d, %d channels, %d bytes per channel)" % (
+            self.width, self.height, self.channels, self.bytes_per_channel)
+
+
+def read(filepath):
+    """ Returns an ImageInfo or None if the format is not supported or the file is broken """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    key = (filepath, stat.st_mtime, stat.st_size)
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+
+    try:
+        with open(filepath, "rb") as image_file:
+            header = image_file.read(HEADER_SIZE)
+            info = _parse(header, image_file)
+    except (OSError, struct.error, ValueError, IndexError, KeyError):
+        info = None
+
+    _cache[key] = info
+    return info
+
+
+def read_bytes(data):
+    """ Like read(), but for the content of an image file in memory (e.g. a packed file) """
+    try:
+        return _parse(data[:HEADER_SIZE], io.BytesIO(data))
+    except (OSError, struct.error, ValueError, IndexError, KeyError):
+        return None
+
+
+def _parse(header, image_file):
+    """ image_file: Seekable file, needed by formats that store the information at any position """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _parse_png(header)
+    elif header.startswith(b"\xff\xd8"):
+        return _parse_jpeg(header)
+    elif header.startswith(b"\x76\x2f\x31\x01"):
+        return _parse_exr(header)
+    elif header.startswith(b"#?"):
+        return _parse_hdr(header)
+    elif header.startswith(b"II*\0") or header.startswith(b"MM\0*"):
+        return _parse_tiff(header, image_file)
+    elif header.startswith(b"BM"):
+        return _parse_bmp(header)
+    elif len(header) >= 18 and header[2] in {1, 2, 3, 9, 10, 11}:
+        # Targa has no magic number at the start, only the image type
+        return _parse_tga(header)
+    return None
+
+
+def _parse_png(header):
+    # The IHDR chunk is always the first one
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", header[16:26])
+    return ImageInfo(width, height, PNG_CHANNELS[color_type], 2 if bit_depth == 16 else 1)
+
+
+def _parse_jpeg(header):
+    offset = 2
+
+    while offset < len(header):
+        # Skip padding bytes
+        while header[offset] == 0xff:
+            offset += 1
+        marker = header[offset]
+        offset += 1
+
+        if 0xd0 <= marker <= 0xd9:
+            # Markers without payload
+            continue
+
+        length = struct.unpack(">H", header[offset:offset + 2])[0]
+
+        # Start of frame markers (0xc4, 0xc8 and 0xcc are other markers in this range)
+        if 0xc0 <= marker <= 0xcf and marker not in {0xc4, 0xc8, 0xcc}:
+            precision, height, width, channels = struct.unpack(">BHHB", header[offset + 2:offset + 8])
+            return ImageInfo(width, height, channels, 2 if precision > 8 else 1)
+
+        offset += length
+
+    return None
+
+
+def _parse_exr(header):
+    # Skip magic number and version
+    offset = 8
+    width = height = None
+    channels = []
+
+    while True:
+        end = header.index(b"\0", offset)
+        name = header[offset:end]
+        if not name:
+            # End of the header
+            break
+        type_end = header.index(b"\0", end + 1)
+        size = struct.unpack("<i", header[type_end + 1:type_end + 5])[0]
+        value = header[type_end + 5:type_end + 5 + size]
+        offset = type_end + 5 + size
+
+        if name == b"dataWindow":
+            x_min, y_min, x_max, y_max = struct.unpack("<iiii", value)
+            width = x_max - x_min + 1
+            height = y_max - y_min + 1
+        elif name == b"channels":
+            pos = 0
+            while value[pos:pos + 1] != b"\0":
+                name_end = value.index(b"\0", pos)
+                pixel_type = struct.unpack("<i", value[name_end + 1:name_end + 5])[0]
+                channels.append(EXR_PIXEL_TYPES[pixel_type])
+                # pixel type, pLinear, 3 reserved bytes, x and y sampling
+                pos = name_end + 17
+
+    if width is None or not channels:
+        return None
+    return ImageInfo(width, height, len(channels), max(channels))
+
+
+def _parse_hdr(header):
+    lines = header.split(b"\n")
+
+    for index, line in enumerate(lines):
+        if not line.strip():
+            # The resolution line follows after the empty line, e.g. "-Y 512 +X 1024"
+            parts = lines[index + 1].split()
+            sizes = {parts[0][-1:]: int(parts[1]), parts[2][-1:]: int(parts[3])}
+            return ImageInfo(sizes[b"X"], sizes[b"Y"], 3, 4)
+
+    return None
+
+
+def _parse_tiff(header, image_file):
+    endian = "<" if header.startswith(b"II") else ">"
+    # The first image file directory can be anywhere in the file (often after the pixels)
+    ifd_offset = struct.unpack(endian + "I", header[4:8])[0]
+    image_file.seek(ifd_offset)
+    entry_count = struct.unpack(endian + "H", image_file.read(2))[0]
+    entries = image_file.read(entry_count * 12)
+    tags = {}
+
+    for i in range(entry_count):
+        entry = entries[i * 12:(i + 1) * 12]
+        tag, field_type, value_count = struct.unpack(endian + "HHI", entry[:8])
+        if tag in {TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH, TIFF_BITS_PER_SAMPLE, TIFF_SAMPLES_PER_PIXEL}:
+            tags[tag] = _read_tiff_value(endian, field_type, value_count, entry[8:], image_file)
+
+    if TIFF_IMAGE_WIDTH not in tags or TIFF_IMAGE_LENGTH not in tags:
+        return None
+
+    channels = tags.get(TIFF_SAMPLES_PER_PIXEL, 1)
+    bits_per_sample = tags.get(TIFF_BITS_PER_SAMPLE, 1)
+    return ImageInfo(tags[TIFF_IMAGE_WIDTH], tags[TIFF_IMAGE_LENGTH], channels, max(1, bits_per_sample // 8))
+
+
+def _read_tiff_value(endian, field_type, value_count, value, image_file):
+    """ Returns the first value of a TIFF field """
+    value_format, size = TIFF_TYPES[field_type]
+
+    if size * value_count > 4:
+        # The values don't fit into the entry, it contains their offset instead
+        offset = struct.unpack(endian + "I", value)[0]
+        image_file.seek(offset)
+        value = image_file.read(size)
+
+    return struct.unpack(endian + value_format, value[:size])[0]
+
+
+def _parse_bmp(header):
+    width, height = struct.unpack("<ii", header[18:26])
+    bits_per_pixel = struct.unpack("<H", header[28:30])[0]
+    return ImageInfo(width, abs(height), max(1, bits_per_pixel // 8), 1)
+
+
+def _parse_tga(header):
+    width, height, bits_per_pixel = struct.unpack("<HHB", header[12:17])
+    if width == 0 or height == 0:
+        return None
+    return ImageInfo(width, height, max(1, bits_per_pixel // 8), 1)
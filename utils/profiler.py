@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+from time import perf_counter
+
+
+class _Section(object):
+    __slots__ = ("category", "name", "start")
+
+    def __init__(self, category, name):
+        self.category = category
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        Profiler.add_event(self.category, self.name, self.start, perf_counter())
+
+
+class _NullSection(object):
+    """ Returned by Profiler.section() if the profiler is not active, does nothing """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+_NULL_SECTION = _NullSection()
+
+SORT_KEYS = {
+    "TOTAL": lambda entry: -entry[3],
+    "MAX": lambda entry: -entry[4],
+    "COUNT": lambda entry: -entry[2],
+    "NAME": lambda entry: (entry[0], entry[1]),
+}
+
+
+class Profiler(object):
+    """
+    Records how long the steps of an export take (objects, meshes, nodes, Parse calls etc.).
+    Only active if enabled in the render settings, otherwise section() does nothing.
+    This class is a singleton.
+    """
+    active = False
+    # List of (category, name, start, end, thread id), times in seconds
+    events = []
+
+    _start = 0
+    _report_cache = {}
+
+    @classmethod
+    def begin_export(cls, scene):
+        cls.active = scene.luxcore.config.use_export_profiler
+
+        if cls.active:
+            cls.events = []
+            cls._report_cache = {}
+            cls._start = perf_counter()
+
+    @classmethod
+    def end_export(cls):
+        if not cls.active:
+            return
+
+        cls.active = False
+        cls._report_cache = {}
+        print("[Profiler] Recorded %d sections in %.1f s" % (len(cls.events), perf_counter() - cls._start))
+
+    @classmethod
+    def section(cls, category, name):
+        """
+        Returns a context manager that records the time spent in its with-block, e.g.
+        with Profiler.section("Object", obj.name):
+            ...
+        """
+        if not cls.active:
+            return _NULL_SECTION
+        return _Section(category, name)
+
+    @classmethod
+    def add_event(cls, category, name, start, end):
+        # list.append() is atomic, so sections can also be recorded from worker threads
+        cls.events.append((category, name, start, end, threading.get_ident()))
+
+    @classmethod
+    def get_report(cls, sort_by="TOTAL"):
+        """
+        Returns a list of (category, name, count, total seconds, max seconds),
+        one entry for each combination of category and name.
+        Note that the time of a section includes nested sections (e.g. a node includes its input nodes).
+        """
+        if cls.active:
+            # Still recording, don't cache the incomplete report
+            return cls._aggregate(sort_by)
+
+        try:
+            return cls._report_cache[sort_by]
+        except KeyError:
+            report = cls._aggregate(sort_by)
+            cls._report_cache[sort_by] = report
+            return report
+
+    @classmethod
+    def save_json(cls, filepath, sort_by="TOTAL"):
+        report = [{"category": category, "name": name, "count": count, "total": total, "max": max_time}
+                  for category, name, count, total, max_time in cls.get_report(sort_by)]
+
+        with open(filepath, "w") as file:
+            json.dump({"report": report}, file, indent=2)
+
+    @classmethod
+    def save_chrome_trace(cls, filepath):
+        """ The file can be opened in chrome://tracing or https://ui.perfetto.dev """
+        pid = os.getpid()
+        trace_events = []
+
+        for category, name, start, end, thread_id in cls.events:
+            trace_events.append({
+                "name": name,
+                "cat": category,
+                # Complete event with start and duration, in microseconds
+                "ph": "X",
+                "ts": (start - cls._start) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": thread_id,
+            })
+
+        with open(filepath, "w") as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+    @classmethod
+    def _aggregate(cls, sort_by):
+        entries = {}
+
+        for category, name, start, end, _ in cls.events:
+            duration = end - start
+            entry = entries.get((category, name))
+
+            if entry is None:
+                entries[(category, name)] = [category, name, 1, duration, duration]
+            else:
+                entry[2] += 1
+                entry[3] += duration
+                entry[4] = max(entry[4], duration)
+
+        return sorted((tuple(entry) for entry in entries.values()), key=SORT_KEYS[sort_by])
@@ -155,12 +155,12 @@ def get_pretty_stats(config, stats, scene, context=None):
     error_str = ""
 
     if errorlog.errors:
-        error_str += utils.pluralize("%d Error", len(errorlog.errors))
+        error_str += utils.pluralize("%d Error", len(errorlog.errors) + errorlog.errors_overflow)
 
     if errorlog.warnings:
         if error_str:
             error_str += ", "
-        error_str += utils.pluralize("%d Warning", len(errorlog.warnings))
+        error_str += utils.pluralize("%d Warning", len(errorlog.warnings) + errorlog.warnings_overflow)
 
     if error_str:
         pretty.append(error_str)